@@ -5,6 +5,17 @@ from datetime import datetime
 import sqlite3
 import requests
 import base64
+import asyncio
+import functools
+import json
+import os
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # Initialize SQLite database
 conn = sqlite3.connect('health_tracker.db', check_same_thread=False)
@@ -27,6 +38,8 @@ c.execute('''CREATE TABLE IF NOT EXISTS health_data
              sleep_hours FLOAT,
              FOREIGN KEY (user_id) REFERENCES users (id))''')
 
+c.execute("CREATE INDEX IF NOT EXISTS idx_health_data_user_date ON health_data (user_id, date)")
+
 conn.commit()
 
 # Set page configuration
@@ -81,26 +94,374 @@ def login_user(username, password):
         return result[0]
     return None
 
+# Dashboard aggregates
+# Each day is aggregated in SQL (several entries can be saved on one day, and 0
+# means the field was left blank), then the rolling windows and trends are
+# computed with NumPy over a dense calendar up to today. Results are cached per
+# user and recomputed once that user saves new data.
+DASHBOARD_METRICS = ["Weight (kg)", "Steps", "Heart Rate (bpm)", "Sleep Hours"]
+DASHBOARD_WINDOWS = {"Weekly": (7, 90), "Monthly": (30, 365)}  # window days, days charted
+DASHBOARD_CACHE_ENTRIES = 256
+DAILY_HEALTH_SQL = """
+    SELECT date, AVG(NULLIF(weight, 0)), MAX(NULLIF(steps, 0)),
+           AVG(NULLIF(heart_rate, 0)), AVG(NULLIF(sleep_hours, 0))
+    FROM health_data
+    WHERE user_id = ?
+    GROUP BY date
+    ORDER BY date
+"""
+
+def load_daily_health(db, user_id, today):
+    # One row per calendar day from the first entry to today; NaN where nothing was recorded
+    rows = db.execute(DAILY_HEALTH_SQL, (user_id,)).fetchall()
+    if not rows:
+        return None, None
+    days = np.array([row[0][:10] for row in rows], dtype="datetime64[D]")
+    values = np.array([row[1:] for row in rows], dtype=float)
+    offsets = (days - days[0]).astype(int)
+    dense = np.full((max(offsets[-1], int((today - days[0]).astype(int))) + 1, values.shape[1]), np.nan)
+    dense[offsets] = values
+    return days[0] + np.arange(len(dense)), dense
+
+def rolling_mean(dense, window):
+    # Trailing mean over the recorded days in each window, from cumulative sums
+    present = ~np.isnan(dense)
+    sums = np.vstack([np.zeros((1, dense.shape[1])), np.cumsum(np.where(present, dense, 0.0), axis=0)])
+    counts = np.vstack([np.zeros((1, dense.shape[1])), np.cumsum(present, axis=0)])
+    end = np.arange(1, len(dense) + 1)
+    start = np.maximum(end - window, 0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (sums[end] - sums[start]) / (counts[end] - counts[start])
+
+def window_trend(dense, window):
+    # Least-squares slope per week over the last `window` days, per metric
+    tail = dense[-window:]
+    present = ~np.isnan(tail)
+    x = np.broadcast_to(np.arange(len(tail), dtype=float)[:, None], tail.shape)
+    n = present.sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        x_mean = np.where(present, x, 0.0).sum(axis=0) / n
+        y_mean = np.where(present, tail, 0.0).sum(axis=0) / n
+        dx = np.where(present, x - x_mean, 0.0)
+        slope = (dx * np.where(present, tail - y_mean, 0.0)).sum(axis=0) / (dx ** 2).sum(axis=0)
+    return np.where(n >= 2, slope * 7, np.nan)
+
+def health_dashboard(db, user_id, window, chart_days, today):
+    days, dense = load_daily_health(db, user_id, today)
+    if days is None:
+        return None, None
+    means = rolling_mean(dense, window)
+    tail = dense[-window:]
+    summary = pd.DataFrame({
+        "Metric": DASHBOARD_METRICS,
+        "Average": means[-1],
+        "Min": np.fmin.reduce(tail, axis=0),  # fmin/fmax skip NaN without warning on empty windows
+        "Max": np.fmax.reduce(tail, axis=0),
+        "Trend per Week": window_trend(dense, window),
+        "Days Recorded": (~np.isnan(tail)).sum(axis=0),
+    })
+    chart = pd.DataFrame(means[-chart_days:], columns=DASHBOARD_METRICS,
+                         index=pd.Index(days[-chart_days:], name="Date"))
+    return chart, summary
+
+@st.cache_resource(show_spinner=False)
+def get_dashboard_versions():
+    # user_id -> version, changed by "Save Data" so the next dashboard recomputes
+    return {}
+
+@st.cache_data(max_entries=DASHBOARD_CACHE_ENTRIES, show_spinner=False)
+def cached_health_dashboard(user_id, period, today, version):
+    window, chart_days = DASHBOARD_WINDOWS[period]
+    return health_dashboard(conn, user_id, window, chart_days, np.datetime64(today))
+
+def invalidate_dashboard(user_id):
+    get_dashboard_versions()[user_id] = time.time_ns()
+
+# Nominatim lookups
+# Streamlit reruns this script on every interaction, so lookups go through a
+# persistent SQLite cache keyed by the normalized query. Misses and expired
+# entries go to one scheduler shared by every session, which keeps Nominatim's
+# limit of about one request per second, and sends identical concurrent
+# queries only once.
+NOMINATIM_URL = os.environ.get("NOMINATIM_URL", "https://nominatim.openstreetmap.org")
+NOMINATIM_HEADERS = {'User-Agent': 'HealthTrackerPro/1.0'}
+REQUEST_TIMEOUT = (3.05, 10)  # seconds to connect, seconds to read
+GEOCODE_CACHE_DB = "geocode_cache.db"
+GEOCODE_TTL = 30 * 24 * 3600  # places rarely move
+HOSPITALS_TTL = 24 * 3600
+GEOCODE_CACHE_MAX_ENTRIES = 10000
+GEOCODE_TOUCH_SECONDS = 300  # how stale last_used may get before a hit rewrites it
+NOMINATIM_RATE = 1.0  # requests per second
+NOMINATIM_BURST = 1
+NOMINATIM_MAX_QUEUE = 50  # requests waiting for a token before new ones are turned away
+NOMINATIM_WAIT_TIMEOUT = 30  # seconds a page waits for its answer
+NOMINATIM_RETRIES = 2
+NOMINATIM_RETRY_STATUSES = {429, 502, 503, 504}
+
+class GeocodeCache:
+    def __init__(self, db_file=GEOCODE_CACHE_DB, max_entries=GEOCODE_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_file, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute('''CREATE TABLE IF NOT EXISTS geocode_cache
+                    (key TEXT PRIMARY KEY,
+                     value TEXT NOT NULL,
+                     expires_at REAL NOT NULL,
+                     last_used REAL NOT NULL)''')
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_geocode_cache_last_used ON geocode_cache (last_used)")
+        self._conn.commit()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self.fetch_seconds = 0.0
+
+    def get_or_fetch(self, key, ttl, fetch):
+        # fetch() returns a JSON-serializable value; errors propagate uncached
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, expires_at, last_used FROM geocode_cache WHERE key = ?",
+                                     (key,)).fetchone()
+            if row and row[1] > now:
+                self.hits += 1
+                if now - row[2] > GEOCODE_TOUCH_SECONDS:
+                    self._conn.execute("UPDATE geocode_cache SET last_used = ? WHERE key = ?", (now, key))
+                    self._conn.commit()
+                return json.loads(row[0])
+            if row:
+                self.expired += 1
+            self.misses += 1
+        start = time.perf_counter()
+        value = fetch()
+        with self._lock:
+            self.fetch_seconds += time.perf_counter() - start
+        self.put(key, ttl, value)
+        return value
+
+    def put(self, key, ttl, value):
+        now = time.time()
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO geocode_cache VALUES (?, ?, ?, ?)",
+                               (key, json.dumps(value), now + ttl, now))
+            # Least recently used entries go first once the cache is over its bound
+            excess = self._conn.execute("SELECT COUNT(*) FROM geocode_cache").fetchone()[0] - self.max_entries
+            if excess > 0:
+                self._conn.execute("""DELETE FROM geocode_cache WHERE key IN
+                    (SELECT key FROM geocode_cache ORDER BY last_used LIMIT ?)""", (excess,))
+                self.evictions += excess
+            self._conn.commit()
+
+    def cached(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT expires_at FROM geocode_cache WHERE key = ?", (key,)).fetchone()
+        return bool(row) and row[0] > time.time()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "expired": self.expired,
+                "evictions": self.evictions,
+                "fetch_seconds": self.fetch_seconds,
+                "entries": self._conn.execute("SELECT COUNT(*) FROM geocode_cache").fetchone()[0],
+            }
+
+@st.cache_resource(show_spinner=False)
+def get_geocode_cache():
+    return GeocodeCache()
+
+@st.cache_resource(show_spinner=False)
+def get_http_session():
+    # Keep-alive connections shared by every session. Connection failures retry
+    # here; HTTP error statuses are retried by the scheduler, which paces them.
+    session = requests.Session()
+    session.headers.update(NOMINATIM_HEADERS)
+    retry = Retry(total=2, status=0, backoff_factor=0.5, allowed_methods=["GET"],
+                  respect_retry_after_header=False, raise_on_status=False)
+    session.mount("https://", HTTPAdapter(pool_maxsize=16, max_retries=retry))
+    session.mount("http://", HTTPAdapter(pool_maxsize=16, max_retries=retry))
+    return session
+
+class TokenBucket:
+    # Waiters take tokens in arrival order (asyncio.Lock is FIFO)
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        async with self._lock:
+            self._refill()
+            while self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+    def pause(self, seconds):
+        # Nothing is sent for `seconds` (e.g. after a 429 with Retry-After)
+        self._refill()
+        self.tokens = min(self.tokens, 1 - seconds * self.rate)
+
+class NominatimScheduler:
+    # An event loop on its own thread runs every Nominatim request. Script threads
+    # block on search(); identical queries already in flight share one request.
+    def __init__(self, session, rate=NOMINATIM_RATE, burst=NOMINATIM_BURST, max_queue=NOMINATIM_MAX_QUEUE):
+        self.session = session
+        self.max_queue = max_queue
+        self._loop = asyncio.new_event_loop()
+        self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="nominatim-http")
+        self._inflight = {}  # only touched on the loop thread
+        self._lock = threading.Lock()
+        self.bucket = TokenBucket(rate, burst)
+        self.waiting = 0
+        self.max_waiting = 0
+        self.sent = 0
+        self.coalesced = 0
+        self.retries = 0
+        self.errors = 0
+        self.rejected = 0
+        self._waits = deque(maxlen=1000)
+        threading.Thread(target=self._loop.run_forever, name="nominatim-scheduler", daemon=True).start()
+
+    def submit(self, params, on_result=None):
+        # Returns a concurrent.futures.Future for the decoded JSON answer. If this
+        # call starts the request, on_result(answer) runs before the request leaves
+        # the in-flight map, so a later identical lookup either joins it or finds
+        # whatever on_result stored.
+        return asyncio.run_coroutine_threadsafe(self._search(dict(params), on_result), self._loop)
+
+    def search(self, params, timeout=NOMINATIM_WAIT_TIMEOUT):
+        return self.submit(params).result(timeout)
+
+    async def _search(self, params, on_result=None):
+        key = tuple(sorted((name, str(value)) for name, value in params.items()))
+        task = self._inflight.get(key)
+        if task is None:
+            task = self._inflight[key] = asyncio.ensure_future(self._fetch(params, on_result))
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            with self._lock:
+                self.coalesced += 1
+        return await asyncio.shield(task)
+
+    async def _fetch(self, params, on_result):
+        value = await self._send(params)
+        if on_result is not None:
+            try:
+                await self._loop.run_in_executor(self._executor, on_result, value)
+            except Exception:
+                pass  # only costs a later lookup a request; the answer itself is fine
+        return value
+
+    async def _take_token(self):
+        with self._lock:
+            if self.waiting >= self.max_queue:
+                self.rejected += 1
+                raise RuntimeError("The location service is busy; please try again in a moment.")
+            self.waiting += 1
+            self.max_waiting = max(self.max_waiting, self.waiting)
+        start = time.monotonic()
+        try:
+            await self.bucket.acquire()
+        finally:
+            with self._lock:
+                self.waiting -= 1
+                self._waits.append(time.monotonic() - start)
+
+    async def _send(self, params):
+        get = functools.partial(self.session.get, f"{NOMINATIM_URL}/search", params=params, timeout=REQUEST_TIMEOUT)
+        try:
+            for attempt in range(NOMINATIM_RETRIES + 1):
+                await self._take_token()
+                response = await self._loop.run_in_executor(self._executor, get)
+                with self._lock:
+                    self.sent += 1
+                if response.status_code in NOMINATIM_RETRY_STATUSES and attempt < NOMINATIM_RETRIES:
+                    try:
+                        delay = float(response.headers.get("Retry-After", ""))
+                    except ValueError:
+                        delay = 2.0 ** attempt
+                    self.bucket.pause(delay)
+                    with self._lock:
+                        self.retries += 1
+                    continue
+                response.raise_for_status()
+                return response.json()
+        except Exception:
+            with self._lock:
+                self.errors += 1
+            raise
+
+    def stats(self):
+        with self._lock:
+            waits = np.array(self._waits) if self._waits else np.zeros(1)
+            return {
+                "waiting": self.waiting,
+                "max_waiting": self.max_waiting,
+                "sent": self.sent,
+                "coalesced": self.coalesced,
+                "retries": self.retries,
+                "errors": self.errors,
+                "rejected": self.rejected,
+                "wait_p50": float(np.percentile(waits, 50)),
+                "wait_p95": float(np.percentile(waits, 95)),
+                "wait_max": float(waits.max()),
+            }
+
+@st.cache_resource(show_spinner=False)
+def get_nominatim_scheduler():
+    return NominatimScheduler(get_http_session(), NOMINATIM_RATE, NOMINATIM_BURST, NOMINATIM_MAX_QUEUE)
+
+def nominatim_search(params):
+    return get_nominatim_scheduler().search(params)
+
+def normalize_location(location_string):
+    # "  New York,  NY " and "new york, ny" share a cache entry
+    return re.sub(r"\s+", " ", re.sub(r"\s*,\s*", ", ", location_string.strip().lower())).strip(" ,")
+
+def hospital_search_request(lat, lon, radius):
+    # Coordinates are rounded to about 10 m so nearby repeats share a cache entry
+    lat, lon = round(lat, 4), round(lon, 4)
+    return (f"hospitals:{lat:.4f},{lon:.4f},{radius}",
+            {'q': 'hospital', 'format': 'json', 'lat': lat, 'lon': lon, 'radius': radius})
+
+def prefetch_hospitals_near_location(lat, lon, radius=5000):
+    # Starts an uncached hospital search now and caches its answer. The later
+    # get_hospitals_near_location call joins the request while it is in flight
+    # and reads the cache once it has finished.
+    key, params = hospital_search_request(lat, lon, radius)
+    cache = get_geocode_cache()
+    if not cache.cached(key):
+        get_nominatim_scheduler().submit(params, lambda value: cache.put(key, HOSPITALS_TTL, value))
+
 def get_hospitals_near_location(lat, lon, radius=5000):
     # Use a simple API call to OpenStreetMap's Nominatim service
-    url = f"https://nominatim.openstreetmap.org/search?q=hospital&format=json&lat={lat}&lon={lon}&radius={radius}"
-    headers = {'User-Agent': 'HealthTrackerPro/1.0'}
+    key, params = hospital_search_request(lat, lon, radius)
     
     try:
-        response = requests.get(url, headers=headers)
-        return response.json()
+        return get_geocode_cache().get_or_fetch(key, HOSPITALS_TTL, lambda: nominatim_search(params))
+    except TimeoutError:
+        st.warning("The hospital search is taking longer than usual; please try again shortly.")
+        return []
     except Exception as e:
         st.error(f"Error fetching hospitals: {str(e)}")
         return []
 
 def geocode_location(location_string):
-    # Use Nominatim to geocode a location string
-    url = f"https://nominatim.openstreetmap.org/search?q={location_string}&format=json&limit=1"
-    headers = {'User-Agent': 'HealthTrackerPro/1.0'}
-    
-    try:
-        response = requests.get(url, headers=headers)
-        data = response.json()
+    # Use Nominatim to geocode a location string; "not found" is cached too
+    def fetch():
+        data = nominatim_search({'q': location_string.strip(), 'format': 'json', 'limit': 1})
         if data and len(data) > 0:
             return {
                 'lat': float(data[0]['lat']),
@@ -108,6 +469,12 @@ def geocode_location(location_string):
                 'display_name': data[0]['display_name']
             }
         return None
+    
+    try:
+        return get_geocode_cache().get_or_fetch(f"geocode:{normalize_location(location_string)}", GEOCODE_TTL, fetch)
+    except TimeoutError:
+        st.warning("Looking up that location is taking longer than usual; please try again shortly.")
+        return None
     except Exception as e:
         st.error(f"Error geocoding location: {str(e)}")
         return None
@@ -152,35 +519,47 @@ def main():
 
         if menu == "Dashboard":
             st.header("Your Health Dashboard")
-            col1, col2 = st.columns(2)
+            period = st.radio("View", list(DASHBOARD_WINDOWS), horizontal=True)
+            user_id = st.session_state.user_id
+            chart, summary = cached_health_dashboard(user_id, period, datetime.now().date().isoformat(),
+                                                     get_dashboard_versions().get(user_id, 0))
             
-            with col1:
-                # Health metrics visualization using Streamlit's native chart
-                health_data = pd.DataFrame({
-                    'Date': pd.date_range(start='2024-01-01', periods=7),
-                    'Steps': np.random.randint(5000, 15000, 7),
-                    'Heart Rate': np.random.randint(60, 100, 7)
-                })
+            if chart is None:
+                st.info("No health data yet. Add your first entry on the Health Tracking page.")
+            else:
+                window = DASHBOARD_WINDOWS[period][0]
+                col1, col2 = st.columns(2)
                 
-                # Use Streamlit's native line chart instead of plotly
-                st.subheader("Weekly Health Metrics")
-                st.line_chart(health_data.set_index('Date'))
+                with col1:
+                    # Rolling means of the daily values, using Streamlit's native chart
+                    st.subheader(f"{period} Health Metrics")
+                    st.caption(f"{window}-day rolling averages")
+                    st.line_chart(chart[["Steps", "Heart Rate (bpm)"]])
+                    st.line_chart(chart[["Weight (kg)"]])
 
-            with col2:
-                # Sleep tracking using a simple metric display
-                st.subheader("Sleep Hours")
-                sleep_hours = 7.5  # Example value
-                st.metric("Average Sleep", f"{sleep_hours} hours")
-                
-                # Create a simple progress bar to visualize sleep quality
-                st.progress(sleep_hours/12)
-                
-                if sleep_hours < 6:
-                    st.warning("You're not getting enough sleep!")
-                elif sleep_hours > 9:
-                    st.info("You're getting plenty of rest.")
-                else:
-                    st.success("Your sleep is in the healthy range.")
+                with col2:
+                    # Sleep tracking using a simple metric display
+                    st.subheader("Sleep Hours")
+                    sleep = summary.set_index("Metric").loc["Sleep Hours"]
+                    if np.isnan(sleep["Average"]):
+                        st.metric("Average Sleep", "No recent data")
+                    else:
+                        sleep_hours = float(sleep["Average"])
+                        trend = None if np.isnan(sleep["Trend per Week"]) else f"{sleep['Trend per Week']:+.1f} h/week"
+                        st.metric(f"Average Sleep ({window} days)", f"{sleep_hours:.1f} hours", trend)
+                        
+                        # Create a simple progress bar to visualize sleep quality
+                        st.progress(min(sleep_hours / 12, 1.0))
+                        
+                        if sleep_hours < 6:
+                            st.warning("You're not getting enough sleep!")
+                        elif sleep_hours > 9:
+                            st.info("You're getting plenty of rest.")
+                        else:
+                            st.success("Your sleep is in the healthy range.")
+
+                st.subheader(f"Last {window} Days")
+                st.dataframe(summary.round(1), hide_index=True)
 
         elif menu == "Health Tracking":
             st.header("Track Your Health")
@@ -200,6 +579,7 @@ def main():
                     VALUES (?, ?, ?, ?, ?, ?)
                 """, (st.session_state.user_id, datetime.now().date(), weight, steps, heart_rate, sleep))
                 conn.commit()
+                invalidate_dashboard(st.session_state.user_id)
                 st.success("Health data saved successfully!")
 
         elif menu == "Find Hospitals":
@@ -211,6 +591,8 @@ def main():
             if location:
                 loc = geocode_location(location)
                 if loc:
+                    # The hospital search runs while the location and map render
+                    prefetch_hospitals_near_location(loc['lat'], loc['lon'])
                     st.write(f"Found location: {loc['display_name']}")
                     
                     # Create a simple map display using st.map
@@ -245,6 +627,14 @@ def main():
                         st.info("No hospitals found in the area")
                 else:
                     st.error("Location not found")
+                
+                cache_stats = get_geocode_cache().stats()
+                queue_stats = get_nominatim_scheduler().stats()
+                st.caption(f"{cache_stats['hit_rate']:.0%} of location lookups answered from the local cache "
+                           f"({cache_stats['entries']} cached places and searches). Nominatim: "
+                           f"{queue_stats['sent']} requests sent, {queue_stats['coalesced']} shared, "
+                           f"{queue_stats['waiting']} queued (most {queue_stats['max_waiting']}), "
+                           f"wait p95 {queue_stats['wait_p95']:.1f} s.")
 
         elif menu == "Settings":
             st.header("Account Settings")
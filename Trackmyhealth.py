@@ -1,13 +1,28 @@
 import streamlit as st
 import sqlite3
 import os
+import atexit
 import hashlib
+import hmac
 from datetime import datetime, timedelta
 import uuid
 import base64
+import bisect
+import csv
+import difflib
+import functools
+import heapq
+import io
+import itertools
 import pandas as pd
+import numpy as np
 import webbrowser
 import json
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
 from PIL import Image
 
 # Set page configuration
@@ -22,9 +37,516 @@ st.set_page_config(
 os.makedirs("data", exist_ok=True)
 DB_FILE = "data/trackmyhealth.db"
 
+# Connection management
+# Streamlit re-executes this script on every rerun, so the pool lives in
+# st.cache_resource and is shared by all sessions and their script threads.
+class ConnectionPool:
+    def __init__(self, db_file, tracer, max_idle=8):
+        self.db_file = db_file
+        self.tracer = tracer
+        self.max_idle = max_idle
+        self._idle = []
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.reused = 0
+        self.closed = 0
+        self.in_use = 0
+
+    def _connect(self):
+        # Connections are checked out by one thread at a time, so they may
+        # safely move between Streamlit's script threads.
+        conn = sqlite3.connect(self.db_file, timeout=5.0, check_same_thread=False, factory=TracedConnection)
+        conn.tracer = self.tracer
+        conn.traced = False
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        conn.execute("PRAGMA cache_size=-16000")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+
+    def acquire(self):
+        conn = None
+        with self._lock:
+            if self._idle:
+                self.reused += 1
+                self.in_use += 1
+                conn = self._idle.pop()
+        if conn is None:
+            conn = self._connect()
+            with self._lock:
+                self.opened += 1
+                self.in_use += 1
+        # Statement counting follows the tracer being switched on or off
+        if conn.traced != self.tracer.enabled:
+            conn.set_trace_callback(self.tracer.count_statement if self.tracer.enabled else None)
+            conn.traced = self.tracer.enabled
+        return conn
+
+    def release(self, conn):
+        # Never hand an open transaction to the next caller
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            reusable = True
+        except sqlite3.Error:
+            reusable = False
+        with self._lock:
+            self.in_use -= 1
+            if reusable and len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+            self.closed += 1
+        conn.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "opened": self.opened,
+                "reused": self.reused,
+                "closed": self.closed,
+                "in_use": self.in_use,
+                "idle": len(self._idle),
+            }
+
+@st.cache_resource(show_spinner=False)
+def get_connection_pool(db_file):
+    return ConnectionPool(db_file, get_sql_tracer())
+
+@contextmanager
+def get_connection(db_file=None):
+    pool = get_connection_pool(db_file or DB_FILE)
+    conn = pool.acquire()
+    try:
+        yield conn
+    finally:
+        pool.release(conn)
+
+# SQL tracing
+# Off unless TRACKMYHEALTH_SQL_TRACE=1 or an admin switches it on. While on, pooled
+# connections count every statement SQLite runs (set_trace_callback, which also
+# sees BEGIN/COMMIT and trigger bodies) and hand out cursors that time execute
+# plus the fetches after it. Each rerun records its statement count and DB time,
+# statements are aggregated by normalized SQL, and slow ones are logged with the
+# shape of their parameters; parameter values are never kept. While off, the
+# cost is one attribute check per cursor.
+SQL_TRACE_ENABLED = os.environ.get("TRACKMYHEALTH_SQL_TRACE") == "1"
+SLOW_QUERY_MS = 50
+SLOW_QUERY_LOG_SIZE = 200
+SQL_TRACE_MAX_STATEMENTS = 500  # distinct normalized statements aggregated
+SQL_TRACE_MAX_PAGES = 100
+
+SQL_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+SQL_PLACEHOLDER_LISTS = re.compile(r"\?(?:\s*,\s*\?)+")
+
+@functools.lru_cache(maxsize=1024)
+def normalize_sql(sql):
+    # Literals become placeholders and IN lists of any length look alike
+    sql = SQL_PLACEHOLDER_LISTS.sub("?, ...", SQL_LITERALS.sub("?", sql))
+    return " ".join(sql.split())
+
+def params_shape(params):
+    if isinstance(params, dict):
+        return "{" + ", ".join(f"{name}: {type(value).__name__}" for name, value in params.items()) + "}"
+    parts = []
+    for name, group in itertools.groupby(type(value).__name__ for value in params):
+        count = sum(1 for _ in group)
+        parts.append(f"{name}[{count}]" if count > 1 else name)
+    return "(" + ", ".join(parts) + ")"
+
+class SqlTracer:
+    def __init__(self, enabled=SQL_TRACE_ENABLED, slow_ms=SLOW_QUERY_MS):
+        self.enabled = enabled
+        self.slow_ms = slow_ms
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # Statements finished from a cursor's __del__, which garbage collection can
+        # run while this thread already holds _lock; appended without the lock and
+        # folded in by the next caller that takes it
+        self._deferred = deque()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._deferred.clear()
+            self._statements = {}
+            self._pages = {}
+            self._slow = deque(maxlen=SLOW_QUERY_LOG_SIZE)
+            self.untracked = 0
+
+    def count_statement(self, sql):
+        # set_trace_callback hook, called on the thread running the statement
+        rerun = getattr(self._local, "rerun", None)
+        if rerun is not None:
+            rerun["statements"] += 1
+
+    def record(self, sql, shape, seconds, defer=False):
+        rerun = getattr(self._local, "rerun", None)
+        if rerun is not None:
+            rerun["queries"] += 1
+            rerun["db_seconds"] += seconds
+        if defer:
+            self._deferred.append((sql, shape, seconds))
+            return
+        with self._lock:
+            self._drain()
+            self._add(sql, shape, seconds)
+
+    def _drain(self):
+        # Caller holds _lock
+        while self._deferred:
+            self._add(*self._deferred.popleft())
+
+    def _add(self, sql, shape, seconds):
+        # Caller holds _lock
+        normalized = normalize_sql(sql)
+        if seconds * 1000 >= self.slow_ms:
+            self._slow.append({"at": datetime.now().isoformat(timespec="seconds"), "ms": seconds * 1000,
+                               "sql": normalized, "params": shape})
+        entry = self._statements.get(normalized)
+        if entry is None:
+            if len(self._statements) >= SQL_TRACE_MAX_STATEMENTS:
+                self.untracked += 1
+                return
+            entry = self._statements[normalized] = {"calls": 0, "seconds": 0.0, "max_seconds": 0.0}
+        entry["calls"] += 1
+        entry["seconds"] += seconds
+        entry["max_seconds"] = max(entry["max_seconds"], seconds)
+        entry["params"] = shape
+
+    @contextmanager
+    def rerun(self, page):
+        # Accounts for everything this thread runs inside the block; yields None while off
+        if not self.enabled:
+            yield None
+            return
+        rerun = self._local.rerun = {"page": page, "statements": 0, "queries": 0, "db_seconds": 0.0}
+        start = time.perf_counter()
+        try:
+            yield rerun
+        finally:
+            self._local.rerun = None
+            rerun["seconds"] = time.perf_counter() - start
+            with self._lock:
+                totals = self._pages.get(page)
+                if totals is None and len(self._pages) < SQL_TRACE_MAX_PAGES:
+                    totals = self._pages[page] = {"renders": 0, "statements": 0, "queries": 0, "db_seconds": 0.0,
+                                                  "max_db_seconds": 0.0, "seconds": 0.0}
+                if totals is not None:
+                    totals["renders"] += 1
+                    for name in ["statements", "queries", "db_seconds", "seconds"]:
+                        totals[name] += rerun[name]
+                    totals["max_db_seconds"] = max(totals["max_db_seconds"], rerun["db_seconds"])
+
+    def page_stats(self):
+        with self._lock:
+            return [
+                {"page": page, "renders": totals["renders"],
+                 "statements": totals["statements"] / totals["renders"],
+                 "queries": totals["queries"] / totals["renders"],
+                 "db_ms": totals["db_seconds"] * 1000 / totals["renders"],
+                 "max_db_ms": totals["max_db_seconds"] * 1000,
+                 "rerun_ms": totals["seconds"] * 1000 / totals["renders"]}
+                for page, totals in sorted(self._pages.items())
+            ]
+
+    def top_statements(self, limit=10):
+        with self._lock:
+            self._drain()
+            entries = sorted(self._statements.items(), key=lambda item: item[1]["seconds"], reverse=True)[:limit]
+            return [
+                {"sql": sql, "calls": entry["calls"], "total_ms": entry["seconds"] * 1000,
+                 "mean_ms": entry["seconds"] * 1000 / entry["calls"], "max_ms": entry["max_seconds"] * 1000,
+                 "params": entry["params"]}
+                for sql, entry in entries
+            ]
+
+    def slow_queries(self):
+        with self._lock:
+            self._drain()
+            return list(reversed(self._slow))
+
+class TracedCursor(sqlite3.Cursor):
+    # A statement's time is its execute plus the fetches after it; it is recorded
+    # when its rows run out, the cursor runs its next statement or is closed, or
+    # (deferred, see SqlTracer) when the cursor goes away.
+    _pending = None
+
+    def _finish(self, defer=False):
+        if self._pending is not None:
+            sql, shape, seconds = self._pending
+            self._pending = None
+            self.tracer.record(sql, shape, seconds, defer)
+
+    def _timed(self, method, *args):
+        if self._pending is None:
+            return method(*args)
+        start = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            self._pending[2] += time.perf_counter() - start
+
+    def execute(self, sql, parameters=()):
+        self._finish()
+        self._pending = [sql, params_shape(parameters), 0.0]
+        return self._timed(super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        self._finish()
+        rows = iter(seq_of_parameters)
+        first = next(rows, None)
+        if first is not None:
+            rows = itertools.chain([first], rows)
+        self._pending = [sql, "many" if first is None else f"many {params_shape(first)}", 0.0]
+        return self._timed(super().executemany, sql, rows)
+
+    def fetchone(self):
+        row = self._timed(super().fetchone)
+        if row is None:
+            self._finish()
+        return row
+
+    def fetchmany(self, size=None):
+        rows = self._timed(super().fetchmany, self.arraysize if size is None else size)
+        if not rows:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        rows = self._timed(super().fetchall)
+        self._finish()
+        return rows
+
+    def __next__(self):
+        try:
+            return self._timed(super().__next__)
+        except StopIteration:
+            self._finish()
+            raise
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        self._finish(defer=True)
+
+class TracedConnection(sqlite3.Connection):
+    # Connection.execute builds its cursor in C, so it is routed through cursor() here
+    tracer = None
+
+    def cursor(self, factory=sqlite3.Cursor):
+        if factory is not sqlite3.Cursor or self.tracer is None or not self.tracer.enabled:
+            return super().cursor(factory)
+        cursor = super().cursor(TracedCursor)
+        cursor.tracer = self.tracer
+        return cursor
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+@st.cache_resource(show_spinner=False)
+def get_sql_tracer():
+    return SqlTracer()
+
+# Query cache
+# Read-through cache for the lookups every rerun repeats. Entries are keyed by
+# (query, parameters, scope) and remember the scope version they were read at.
+# Versions live in the cache_versions table and are bumped by triggers in the
+# same transaction as the write, so writes from other workers, manage.py imports
+# and rollup rebuilds are seen on the next read. A lookup costs one primary key
+# read of the scope's version plus the '*' version bulk writers bump.
+QUERY_CACHE_MAX_ENTRIES = 2048
+
+class QueryCache:
+    def __init__(self, max_entries=QUERY_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get_or_load(self, sql, params, scope, version, load):
+        key = (sql, tuple(params), scope)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+                self.invalidations += 1
+            self.misses += 1
+        # Load outside the lock. The version was read first, so a write landing
+        # meanwhile leaves these rows tagged with an older version and they are
+        # reloaded on the next lookup.
+        rows = load()
+        with self._lock:
+            self._entries[key] = (version, rows)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return rows
+
+    def clear(self):
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+            }
+
+@st.cache_resource(show_spinner=False)
+def get_query_cache(db_file):
+    return QueryCache()
+
+def scope_name(scope):
+    # "hospitals", ("patient", id) -> "patient:<id>", ("hospital", id) -> "hospital:<id>"; None -> "*"
+    if scope is None:
+        return "*"
+    return scope if isinstance(scope, str) else f"{scope[0]}:{scope[1]}"
+
+def scope_version(cursor, scope):
+    cursor.execute(SCOPE_VERSION_SQL, (scope_name(scope),))
+    return cursor.fetchone()[0]
+
+def bump_scope_version(cursor, scope=None):
+    # For bulk writers that bypass the triggers' granularity; None invalidates every scope
+    cursor.execute(CACHE_VERSION_SQL.format(scope="?"), (scope_name(scope),))
+
+def cached_query(cursor, sql, params=(), scope=None):
+    def load():
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+    return get_query_cache(DB_FILE).get_or_load(sql, params, scope, scope_version(cursor, scope), load)
+
+# Password hashing
+# Hashes are stored as "<algorithm>$<k=v,...>$<salt>$<digest>" so every row
+# carries the parameters it was made with. Rows from before this scheme are bare
+# unsalted SHA-256 hex digests; they still verify and are rehashed on login.
+# `manage.py calibrate-kdf` picks parameters for a target latency on this host.
+class ScryptHasher:
+    algorithm = "scrypt"
+
+    def __init__(self, n=2 ** 14, r=8, p=1):
+        self.params = {"n": n, "r": r, "p": p}
+
+    @staticmethod
+    def derive(password, salt, n, r, p):
+        return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p,
+                              maxmem=256 * n * r * p, dklen=32)
+
+class Pbkdf2Hasher:
+    algorithm = "pbkdf2_sha256"
+
+    def __init__(self, iterations=600000):
+        self.params = {"iterations": iterations}
+
+    @staticmethod
+    def derive(password, salt, iterations):
+        return hashlib.pbkdf2_hmac("sha256", password.encode(), salt, iterations)
+
+PASSWORD_HASHERS = {hasher.algorithm: hasher for hasher in [ScryptHasher, Pbkdf2Hasher]}
+PASSWORD_HASHER = ScryptHasher(n=2 ** 14, r=8, p=1)
+
+def hash_password(password, hasher=None, salt=None):
+    hasher = hasher or PASSWORD_HASHER
+    salt = salt or os.urandom(16)
+    digest = hasher.derive(password, salt, **hasher.params)
+    params = ",".join(f"{key}={value}" for key, value in hasher.params.items())
+    return "$".join([hasher.algorithm, params, base64.b64encode(salt).decode(), base64.b64encode(digest).decode()])
+
+def verify_password(password, encoded):
+    # Returns (matches, needs_rehash)
+    if "$" not in encoded:
+        legacy = hashlib.sha256(password.encode()).hexdigest()
+        return hmac.compare_digest(legacy, encoded), True
+    algorithm, params, salt, digest = encoded.split("$")
+    params = {key: int(value) for key, value in (item.split("=") for item in params.split(","))}
+    derived = PASSWORD_HASHERS[algorithm].derive(password, base64.b64decode(salt), **params)
+    matches = hmac.compare_digest(derived, base64.b64decode(digest))
+    current = algorithm == PASSWORD_HASHER.algorithm and params == PASSWORD_HASHER.params
+    return matches, not current
+
+# A login storm must not turn the KDF into a CPU hotspot: at most one derivation
+# per core runs at a time, and successful verifications are remembered for a
+# few minutes under an HMAC of (stored hash, password) with a per-process key,
+# so a repeated login skips the KDF without keeping the password around.
+LOGIN_CACHE_TTL = 300
+LOGIN_CACHE_MAX_ENTRIES = 4096
+
+class PasswordVerifier:
+    def __init__(self, ttl=LOGIN_CACHE_TTL, max_entries=LOGIN_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._key = os.urandom(32)
+        self._verified = OrderedDict()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(os.cpu_count() or 1)
+        self.derivations = 0
+        self.cache_hits = 0
+        self.rehashes = 0
+
+    def verify(self, password, encoded):
+        token = hmac.new(self._key, f"{encoded}\0{password}".encode(), hashlib.sha256).digest()
+        now = time.monotonic()
+        with self._lock:
+            expires = self._verified.get(token)
+            if expires is not None and expires > now:
+                self._verified.move_to_end(token)
+                self.cache_hits += 1
+                return True, False
+        with self._slots:
+            matches, needs_rehash = verify_password(password, encoded)
+        with self._lock:
+            self.derivations += 1
+            if matches and not needs_rehash:
+                self._verified[token] = now + self.ttl
+                self._verified.move_to_end(token)
+                while len(self._verified) > self.max_entries:
+                    self._verified.popitem(last=False)
+        return matches, needs_rehash
+
+    def clear(self):
+        with self._lock:
+            self._verified.clear()
+
+    def record_rehash(self):
+        with self._lock:
+            self.rehashes += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "derivations": self.derivations,
+                "cache_hits": self.cache_hits,
+                "rehashes": self.rehashes,
+                "cached": len(self._verified),
+            }
+
+@st.cache_resource(show_spinner=False)
+def get_password_verifier():
+    return PasswordVerifier()
+
 # Utility functions
-def hash_password(password):
-    return hashlib.sha256(password.encode()).hexdigest()
 
 def get_trackmyhealth_logo():
     logo_svg = '''
@@ -37,10 +559,895 @@ def get_trackmyhealth_logo():
     '''
     return "data:image/svg+xml;base64," + base64.b64encode(logo_svg.encode()).decode()
 
-# Database setup
-def initialize_database():
-    conn = sqlite3.connect(DB_FILE)
+# Health record values
+RECORD_TYPES = [
+    "Blood Pressure", "Heart Rate", "Blood Sugar",
+    "Weight", "Temperature", "Exercise", "Medication"
+]
+
+# Record types with a numeric reading, and the unit it is stored in
+HEALTH_UNITS = {
+    "Blood Pressure": "mmHg",
+    "Heart Rate": "bpm",
+    "Blood Sugar": "mg/dL",
+    "Weight": "kg",
+    "Temperature": "°C",
+    "Exercise": "min",
+}
+
+HEALTH_VALUE_COLUMNS = [
+    ("numeric_value", "REAL"),    # systolic, bpm, mg/dL, kg, °C or exercise minutes
+    ("secondary_value", "REAL"),  # diastolic
+    ("unit", "TEXT"),
+    ("label", "TEXT"),            # exercise activity or medication name
+    ("dosage", "TEXT"),
+]
+
+def parse_health_value(record_type, value):
+    # Split a free-text value ("120/80", "Running: 30 minutes", "Aspirin: 100mg")
+    # into the typed health_records columns
+    fields = {"numeric_value": None, "secondary_value": None, "unit": HEALTH_UNITS.get(record_type),
+              "label": None, "dosage": None}
+    text = str(value if value is not None else "").strip()
+    try:
+        if record_type == "Blood Pressure":
+            systolic, _, diastolic = text.partition("/")
+            fields["numeric_value"] = float(systolic)
+            fields["secondary_value"] = float(diastolic) if diastolic else None
+        elif record_type == "Exercise":
+            activity, _, duration = text.rpartition(": ")
+            fields["label"] = activity or None
+            fields["numeric_value"] = float(duration.split()[0])
+        elif record_type == "Medication":
+            name, _, dose = text.partition(": ")
+            fields["label"] = name or None
+            fields["dosage"] = dose or None
+        elif record_type in HEALTH_UNITS:
+            fields["numeric_value"] = float(text)
+    except (ValueError, IndexError):
+        pass
+    return fields
+
+# Chart preparation
+# Upper bound on the points sent to the browser for one chart
+CHART_POINT_BUDGET = 500
+
+def lttb_indices(x, y, budget):
+    # Largest-Triangle-Three-Buckets: keep the first and last points and, from each
+    # bucket in between, the point forming the largest triangle with the previously
+    # kept point and the next bucket's average. Preserves peaks and the line's shape.
+    n = len(y)
+    if budget >= n or budget < 3:
+        return np.arange(n)
+    bounds = (np.arange(budget - 1) * ((n - 2) / (budget - 2))).astype(np.int64) + 1
+    bounds[-1] = n - 1
+    selected = np.empty(budget, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(budget - 2):
+        lo, hi = bounds[i], bounds[i + 1]
+        next_hi = bounds[i + 2] if i + 2 < len(bounds) else n
+        avg_x = x[hi:next_hi].mean()
+        avg_y = y[hi:next_hi].mean()
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(area.argmax())
+        selected[i + 1] = a
+    return selected
+
+def prepare_chart_data(series, columns, budget=CHART_POINT_BUDGET):
+    # series rows are (record_date, numeric_value, secondary_value) in date order
+    frame = pd.DataFrame.from_records(series, columns=["Date", "primary", "secondary"])
+    frame = pd.DataFrame({
+        "Date": pd.to_datetime(frame["Date"], format="ISO8601", errors="coerce"),
+        **{column: pd.to_numeric(frame[source], errors="coerce")
+           for column, source in zip(columns, ["primary", "secondary"])}
+    }).dropna(subset=["Date", columns[0]])
+    if len(frame) > budget:
+        x = frame["Date"].to_numpy(dtype="datetime64[s]").astype(np.float64)
+        y = frame[columns[0]].to_numpy(dtype=np.float64)
+        frame = frame.iloc[lttb_indices(x, y, budget)]
+    return frame.set_index("Date")
+
+# Pagination
+# Pages are fetched with keyset (seek) pagination: each page continues after the
+# sort key of the previous page's last row, so a page costs the same no matter
+# how deep into the result it is.
+PAGE_SIZES = [25, 50, 100, 250]
+COUNT_ESTIMATE_CAP = 10000
+
+def keyset_sql(base_sql, order_by, descending=True, after=False):
+    # base_sql selects the display columns followed by the order_by columns; the
+    # last order_by column must be unique so ties are broken deterministically
+    sql = base_sql.rstrip()
+    if after:
+        keyword = "AND" if re.search(r"\bWHERE\b", sql, re.IGNORECASE) else "WHERE"
+        placeholders = ", ".join("?" for _ in order_by)
+        sql += f" {keyword} ({', '.join(order_by)}) {'<' if descending else '>'} ({placeholders})"
+    direction = "DESC" if descending else "ASC"
+    return sql + " ORDER BY " + ", ".join(f"{column} {direction}" for column in order_by) + " LIMIT ?"
+
+def fetch_page(cursor, base_sql, params, order_by, page_size, after=None, descending=True):
+    # Returns the page's display rows and the key to pass as `after` for the next
+    # page (None on the last page)
+    cursor.execute(keyset_sql(base_sql, order_by, descending, after is not None),
+                   (*params, *(after or ()), page_size + 1))
+    rows = cursor.fetchall()
+    key_count = len(order_by)
+    next_after = tuple(rows[page_size - 1][-key_count:]) if len(rows) > page_size else None
+    return [row[:-key_count] for row in rows[:page_size]], next_after
+
+def estimate_count(cursor, base_sql, params, cap=COUNT_ESTIMATE_CAP):
+    # Counts at most cap + 1 matching rows; returns (count, whether it was capped)
+    from_clause = base_sql[re.search(r"\sFROM\s", base_sql, re.IGNORECASE).start():]
+    cursor.execute(f"SELECT COUNT(*) FROM (SELECT 1 {from_clause} LIMIT ?)", (*params, cap + 1))
+    count = cursor.fetchone()[0]
+    return min(count, cap), count > cap
+
+def paged_table(key, cursor, base_sql, params, order_by, columns, descending=True):
+    # Renders one page of a query with page size and previous/next controls and
+    # returns that page as a DataFrame. The stack of page start keys lives in the
+    # session and is reset whenever the filter parameters or the page size change.
+    params = tuple(params)
+    page_size = st.session_state.get(f"{key}_page_size", PAGE_SIZES[1])
+    if st.session_state.get(f"{key}_params") != (params, page_size):
+        st.session_state[f"{key}_params"] = (params, page_size)
+        st.session_state[f"{key}_pages"] = [(None, 0)]
+    pages = st.session_state[f"{key}_pages"]
+    after, offset = pages[-1]
+    
+    rows, next_after = fetch_page(cursor, base_sql, params, order_by, page_size, after, descending)
+    df = pd.DataFrame(rows, columns=columns)
+    if df.empty and len(pages) == 1:
+        return df
+    
+    # A later page can come back empty when rows were deleted since it was
+    # reached; the controls still render so the user can go back
+    if not df.empty:
+        total, capped = estimate_count(cursor, base_sql, params)
+        st.dataframe(df)
+    
+    col1, col2, col3, col4 = st.columns([2, 1, 1, 4])
+    with col1:
+        st.selectbox("Rows per page", PAGE_SIZES, index=PAGE_SIZES.index(page_size), key=f"{key}_page_size")
+    with col2:
+        if st.button("Previous", key=f"{key}_previous", disabled=len(pages) == 1):
+            pages.pop()
+            st.rerun()
+    with col3:
+        if st.button("Next", key=f"{key}_next", disabled=next_after is None):
+            pages.append((next_after, offset + len(rows)))
+            st.rerun()
+    with col4:
+        if not df.empty:
+            st.caption(f"Rows {offset + 1:,}–{offset + len(rows):,} of {'more than ' if capped else ''}{total:,}")
+    
+    return df
+
+# Exports
+# Exports stream rows from the cursor in chunks into a per-request in-memory file,
+# so nothing is written to the working directory or shared between sessions.
+EXPORT_CHUNK_ROWS = 5000
+
+def iter_query(cursor, sql, params=(), chunk_rows=EXPORT_CHUNK_ROWS):
+    cursor.execute(sql, params)
+    while True:
+        rows = cursor.fetchmany(chunk_rows)
+        if not rows:
+            return
+        yield rows
+
+def csv_chunks(row_chunks, columns):
+    # Yields UTF-8 encoded CSV, one chunk per batch of rows
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(columns)
+    yield buffer.getvalue().encode("utf-8")
+    for rows in row_chunks:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(rows)
+        yield buffer.getvalue().encode("utf-8")
+
+def query_csv(sql, params, columns):
+    # Uses its own pooled connection so the caller's cursor is left untouched
+    output = io.BytesIO()
+    with get_connection() as conn:
+        for chunk in csv_chunks(iter_query(conn.cursor(), sql, params), columns):
+            output.write(chunk)
+    output.seek(0)
+    return output
+
+# Bulk columnar export
+# Analysts pull whole tables as Hive-partitioned Parquet datasets. Rows are read
+# in chunks and handed to pyarrow as record batches, so memory stays bounded by
+# the chunk size rather than the table size. pyarrow is only needed here.
+EXPORT_DIR = os.path.join("data", "exports")
+COLUMNAR_CHUNK_ROWS = 50000
+
+COLUMNAR_EXPORTS = {
+    # dataset: (query, timestamp column, partition columns)
+    "health_records": ("""
+        SELECT id, patient_id, record_date, record_type, value, notes,
+               numeric_value, secondary_value, unit, label, dosage
+        FROM health_records
+    """, "record_date", ["record_type", "month"]),
+    "appointments": ("""
+        SELECT id, patient_id, hospital_id, appointment_date, reason, status
+        FROM appointments
+    """, "appointment_date", ["hospital_id"]),
+}
+
+def columnar_schema(pa, dataset):
+    if dataset == "health_records":
+        return pa.schema([
+            ("id", pa.string()), ("patient_id", pa.string()), ("record_date", pa.timestamp("us")),
+            ("record_type", pa.string()), ("value", pa.string()), ("notes", pa.string()),
+            ("numeric_value", pa.float64()), ("secondary_value", pa.float64()), ("unit", pa.string()),
+            ("label", pa.string()), ("dosage", pa.string()), ("month", pa.string()),
+        ])
+    return pa.schema([
+        ("id", pa.string()), ("patient_id", pa.string()), ("hospital_id", pa.string()),
+        ("appointment_date", pa.timestamp("us")), ("reason", pa.string()), ("status", pa.string()),
+    ])
+
+def columnar_batches(pa, schema, sql, date_column, chunk_rows):
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        for rows in iter_query(cursor, sql, (), chunk_rows):
+            frame = pd.DataFrame.from_records(rows, columns=[column[0] for column in cursor.description])
+            frame[date_column] = pd.to_datetime(frame[date_column], format="ISO8601", errors="coerce")
+            if "month" in schema.names:
+                frame["month"] = frame[date_column].dt.strftime("%Y-%m").fillna("unknown")
+            yield pa.RecordBatch.from_pandas(frame, schema=schema, preserve_index=False)
+
+def export_columnar(out_dir, chunk_rows=COLUMNAR_CHUNK_ROWS):
+    # Returns one (dataset, file, rows) tuple per Parquet file written
+    try:
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+    except ImportError as e:
+        raise RuntimeError("Columnar export needs pyarrow (pip install pyarrow).") from e
+    # Partitions left by an earlier export (e.g. of a since-deleted month) would
+    # silently join the new dataset, so only empty or new directories are used
+    if os.path.isdir(out_dir) and os.listdir(out_dir):
+        raise FileExistsError(f"{out_dir} is not empty; export into a new directory.")
+    
+    written = []
+    for dataset, (sql, date_column, partition_columns) in COLUMNAR_EXPORTS.items():
+        schema = columnar_schema(pa, dataset)
+        reader = pa.RecordBatchReader.from_batches(
+            schema, columnar_batches(pa, schema, sql, date_column, chunk_rows))
+        ds.write_dataset(
+            reader,
+            os.path.join(out_dir, dataset),
+            format="parquet",
+            partitioning=ds.partitioning(
+                pa.schema([schema.field(column) for column in partition_columns]), flavor="hive"),
+            basename_template="part-{i}.parquet",
+            max_open_files=256,
+            max_rows_per_group=chunk_rows,
+            existing_data_behavior="error",
+            file_visitor=lambda file, dataset=dataset: written.append(
+                (dataset, os.path.relpath(file.path, out_dir), file.metadata.num_rows)),
+        )
+    return written
+
+# Health rollups
+# health_rollups keeps count/sum/min/max/last of numeric readings per patient,
+# record type and day/week/month. Writers update it in the same transaction as
+# the raw insert, so long-window charts and statistics read a few hundred rollup
+# rows instead of the whole history. Weeks start on Monday.
+ROLLUP_PERIODS = ["day", "week", "month"]
+
+# SQLite expressions giving each period's start date for a record_date
+ROLLUP_PERIOD_STARTS = {
+    "day": "date(record_date)",
+    "week": "date(record_date, '-' || ((CAST(strftime('%w', record_date) AS INTEGER) + 6) % 7) || ' days')",
+    "month": "date(record_date, 'start of month')",
+}
+
+UPSERT_ROLLUP_SQL = """
+    INSERT INTO health_rollups (patient_id, record_type, period, period_start, count, total,
+                                secondary_total, minimum, maximum, last_date, last_value)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (patient_id, record_type, period, period_start) DO UPDATE SET
+        count = count + excluded.count,
+        total = total + excluded.total,
+        secondary_total = COALESCE(secondary_total + excluded.secondary_total,
+                                   secondary_total, excluded.secondary_total),
+        minimum = MIN(minimum, excluded.minimum),
+        maximum = MAX(maximum, excluded.maximum),
+        last_value = CASE WHEN excluded.last_date >= last_date THEN excluded.last_value ELSE last_value END,
+        last_date = MAX(last_date, excluded.last_date)
+"""
+
+def rollup_period_starts(record_date):
+    day = datetime.fromisoformat(record_date).date()
+    return {
+        "day": day.isoformat(),
+        "week": (day - timedelta(days=day.weekday())).isoformat(),
+        "month": day.replace(day=1).isoformat(),
+    }
+
+def update_rollups(cursor, readings):
+    # readings: (patient_id, record_type, record_date, numeric_value, secondary_value).
+    # Readings are combined per rollup row first, so a bulk import issues one
+    # upsert per period touched rather than three per reading. Does not commit;
+    # runs inside the caller's insert transaction.
+    groups = {}
+    for patient_id, record_type, record_date, value, secondary in readings:
+        if value is None:
+            continue
+        for period, period_start in rollup_period_starts(record_date).items():
+            key = (patient_id, record_type, period, period_start)
+            group = groups.get(key)
+            if group is None:
+                groups[key] = [1, value, secondary, value, value, record_date, value]
+                continue
+            group[0] += 1
+            group[1] += value
+            if secondary is not None:
+                group[2] = secondary if group[2] is None else group[2] + secondary
+            group[3] = min(group[3], value)
+            group[4] = max(group[4], value)
+            if record_date >= group[5]:
+                group[5], group[6] = record_date, value
+    cursor.executemany(UPSERT_ROLLUP_SQL, [(*key, *group) for key, group in groups.items()])
+
+def rebuild_rollups(cursor, patient_id=None):
+    # Recomputes rollups from raw health_records, for one patient or everyone.
+    # last_value is the latest reading in each period (ties broken by id), taken
+    # with a window function rather than a bare column next to several aggregates.
+    where = "WHERE numeric_value IS NOT NULL" + (" AND patient_id = ?" if patient_id else "")
+    params = (patient_id,) if patient_id else ()
+    cursor.execute("DELETE FROM health_rollups" + (" WHERE patient_id = ?" if patient_id else ""), params)
+    for period in ROLLUP_PERIODS:
+        cursor.execute(f"""
+            INSERT INTO health_rollups (patient_id, record_type, period, period_start, count, total,
+                                        secondary_total, minimum, maximum, last_date, last_value)
+            SELECT patient_id, record_type, '{period}', period_start,
+                   COUNT(*), SUM(numeric_value), SUM(secondary_value), MIN(numeric_value),
+                   MAX(numeric_value), MAX(record_date), MAX(last_value)
+            FROM (
+                SELECT patient_id, record_type, record_date, numeric_value, secondary_value,
+                       {ROLLUP_PERIOD_STARTS[period]} AS period_start,
+                       FIRST_VALUE(numeric_value) OVER (
+                           PARTITION BY patient_id, record_type, {ROLLUP_PERIOD_STARTS[period]}
+                           ORDER BY record_date DESC, id DESC
+                       ) AS last_value
+                FROM health_records
+                {where}
+            )
+            GROUP BY patient_id, record_type, period_start
+        """, params)
+    cursor.execute("SELECT COUNT(*) FROM health_rollups" + (" WHERE patient_id = ?" if patient_id else ""), params)
+    return cursor.fetchone()[0]
+
+# Bulk health record import
+# Device exports (CSV, a JSON array or JSON Lines) with record_date, record_type,
+# value and optional notes are checked against what the Track Health form
+# accepts, deduplicated against the file and the patient's existing readings,
+# and written with executemany in one transaction per chunk, rollups included.
+IMPORT_CHUNK_ROWS = 2000
+IMPORT_MAX_REJECTIONS = 1000  # rejected rows reported individually; all are counted
+
+IMPORT_COLUMN_ALIASES = {
+    "date": "record_date", "datetime": "record_date", "timestamp": "record_date", "time": "record_date",
+    "type": "record_type", "metric": "record_type",
+    "reading": "value", "note": "notes",
+}
+IMPORT_RECORD_TYPES = {record_type.lower().replace(" ", "_"): record_type for record_type in RECORD_TYPES}
+IMPORT_RECORD_TYPES.update({
+    "bp": "Blood Pressure", "hr": "Heart Rate", "pulse": "Heart Rate", "glucose": "Blood Sugar",
+    "blood_glucose": "Blood Sugar", "body_weight": "Weight", "temp": "Temperature",
+    "body_temperature": "Temperature", "workout": "Exercise", "activity": "Exercise", "medicine": "Medication",
+})
+
+# Accepted range of numeric_value per record type, as in the Track Health form
+HEALTH_VALUE_RANGES = {
+    "Blood Pressure": (70, 220),
+    "Heart Rate": (30, 220),
+    "Blood Sugar": (20, 600),
+    "Weight": (1, 300),
+    "Temperature": (35, 42),
+    "Exercise": (1, 600),
+}
+DIASTOLIC_RANGE = (40, 180)
+
+def read_import_rows(file):
+    # Yields (line or item number, row dict) from a binary file object
+    text = io.TextIOWrapper(file, encoding="utf-8-sig", newline="")
+    head = ""
+    while not head.strip():
+        head = text.readline()
+        if not head:
+            return
+    if head.lstrip().startswith("["):
+        # A JSON array has to be parsed whole; JSON Lines and CSV stream
+        for number, row in enumerate(json.loads(head + text.read()), start=1):
+            yield number, row
+    elif head.lstrip().startswith("{"):
+        for number, line in enumerate(itertools.chain([head], text), start=1):
+            if line.strip():
+                try:
+                    yield number, json.loads(line)
+                except ValueError:
+                    yield number, None
+    else:
+        reader = csv.DictReader(itertools.chain([head], text))
+        for row in reader:
+            yield reader.line_num, row
+
+def normalize_import_row(row):
+    # Returns (record_date, record_type, value, notes, fields) or raises ValueError
+    if not isinstance(row, dict):
+        raise ValueError("not a record")
+    row = {IMPORT_COLUMN_ALIASES.get(str(key).strip().lower(), str(key).strip().lower()): value
+           for key, value in row.items() if key is not None}
+    raw_type = str(row.get("record_type") or "").strip()
+    record_type = IMPORT_RECORD_TYPES.get(raw_type.lower().replace(" ", "_").replace("-", "_"))
+    if not record_type:
+        raise ValueError(f"unknown record type '{raw_type}'")
+    raw_date = str(row.get("record_date") or "").strip()
+    try:
+        record_date = datetime.fromisoformat(raw_date.replace("Z", "+00:00"))
+    except ValueError:
+        raise ValueError(f"invalid date '{raw_date}'")
+    if record_date.tzinfo:
+        record_date = record_date.astimezone().replace(tzinfo=None)
+
+    value = row.get("value")
+    if record_type == "Blood Pressure" and value in (None, "") and row.get("systolic") not in (None, ""):
+        value = f"{row.get('systolic')}/{row.get('diastolic')}"
+    if value in (None, ""):
+        raise ValueError("missing value")
+    fields = parse_health_value(record_type, value)
+    number = fields["numeric_value"]
+    if record_type in HEALTH_VALUE_RANGES:
+        low, high = HEALTH_VALUE_RANGES[record_type]
+        if number is None:
+            raise ValueError(f"unreadable {record_type} value '{value}'")
+        if not low <= number <= high:
+            raise ValueError(f"{record_type} {number:g} outside {low}–{high}")
+    if record_type == "Blood Pressure":
+        diastolic = fields["secondary_value"]
+        if diastolic is None or not DIASTOLIC_RANGE[0] <= diastolic <= DIASTOLIC_RANGE[1]:
+            raise ValueError(f"diastolic pressure in '{value}' outside {DIASTOLIC_RANGE[0]}–{DIASTOLIC_RANGE[1]}")
+        value = f"{number:g}/{diastolic:g}"
+    elif record_type == "Exercise":
+        if not fields["label"]:
+            raise ValueError("exercise needs an activity, e.g. 'Running: 30 minutes'")
+        value = f"{fields['label']}: {number:g} minutes"
+    elif record_type == "Medication":
+        if not fields["label"]:
+            raise ValueError("medication needs a name, e.g. 'Aspirin: 100mg'")
+        value = str(value).strip()
+    else:
+        value = f"{number:g}"
+    return record_date.isoformat(timespec="seconds"), record_type, value, str(row.get("notes") or ""), fields
+
+def import_health_records(conn, patient_id, file, chunk_rows=IMPORT_CHUNK_ROWS):
+    start = time.perf_counter()
+    report = {"read": 0, "imported": 0, "duplicates": 0, "rejected": 0, "rejections": []}
+    seen = set()
     cursor = conn.cursor()
+
+    def write_chunk(chunk):
+        # The duplicate check and the insert share one write transaction
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            dates = sorted({reading[0] for reading in chunk})
+            existing = set()
+            for i in range(0, len(dates), 500):
+                batch = dates[i:i + 500]
+                cursor.execute(EXISTING_READINGS_SQL.format(placeholders=", ".join("?" * len(batch))),
+                               (patient_id, *batch))
+                existing.update(cursor.fetchall())
+            new = [reading for reading in chunk if reading[6] not in existing]
+            cursor.executemany(INSERT_HEALTH_RECORD_SQL, [
+                (f"REC_{uuid.uuid4().hex[:12]}", patient_id, record_date, record_type, value, notes,
+                 fields["numeric_value"], fields["secondary_value"], HEALTH_UNITS.get(record_type),
+                 fields["label"], fields["dosage"])
+                for record_date, record_type, value, notes, fields, _, _ in new])
+            update_rollups(cursor, [(patient_id, record_type, record_date,
+                                     fields["numeric_value"], fields["secondary_value"])
+                                    for record_date, record_type, _, _, fields, _, _ in new])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        report["imported"] += len(new)
+        report["duplicates"] += len(chunk) - len(new)
+
+    chunk = []
+    for number, row in read_import_rows(file):
+        report["read"] += 1
+        try:
+            record_date, record_type, value, notes, fields = normalize_import_row(row)
+        except ValueError as e:
+            report["rejected"] += 1
+            if len(report["rejections"]) < IMPORT_MAX_REJECTIONS:
+                report["rejections"].append((number, str(e)))
+            continue
+        key = (record_date, record_type, fields["numeric_value"], fields["secondary_value"],
+               fields["label"], fields["dosage"])
+        if key in seen:
+            report["duplicates"] += 1
+            continue
+        seen.add(key)
+        chunk.append((record_date, record_type, value, notes, fields, number, key))
+        if len(chunk) >= chunk_rows:
+            write_chunk(chunk)
+            chunk = []
+    if chunk:
+        write_chunk(chunk)
+
+    report["seconds"] = time.perf_counter() - start
+    # Rows written, so a re-import that only finds duplicates reports 0 rows/s
+    report["rows_per_second"] = report["imported"] / report["seconds"] if report["seconds"] else 0.0
+    return report
+
+# Appointment slots
+# Each hospital offers fixed-length slots per weekday (hospital_schedules), each
+# taking up to `capacity` patients. Free slots are computed from the schedule and
+# one indexed range read of the hospital's appointments; booking re-counts the
+# slot inside BEGIN IMMEDIATE, so two bookers can never both take the last place.
+WEEKDAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+# (weekday, open time, close time, slot minutes, capacity)
+DEFAULT_SCHEDULE = [(weekday, "09:00", "17:00", 30, 2) for weekday in range(5)]
+
+def insert_schedule(cursor, hospital_id, schedule=DEFAULT_SCHEDULE):
+    cursor.execute("DELETE FROM hospital_schedules WHERE hospital_id = ?", (hospital_id,))
+    cursor.executemany("INSERT INTO hospital_schedules VALUES (?, ?, ?, ?, ?, ?)",
+                       [(hospital_id, *row) for row in schedule])
+
+def schedule_slots(schedule, start_date, days):
+    # schedule rows are (weekday, open_time, close_time, slot_minutes, capacity);
+    # yields (slot start, slot end, capacity) as ISO strings like appointment_date
+    by_weekday = {row[0]: row[1:] for row in schedule}
+    for offset in range(days):
+        day = start_date + timedelta(days=offset)
+        if day.weekday() not in by_weekday:
+            continue
+        open_time, close_time, slot_minutes, capacity = by_weekday[day.weekday()]
+        slot = datetime.fromisoformat(f"{day.isoformat()}T{open_time}")
+        close = datetime.fromisoformat(f"{day.isoformat()}T{close_time}")
+        step = timedelta(minutes=slot_minutes)
+        while slot + step <= close:
+            yield slot.isoformat(), (slot + step).isoformat(), capacity
+            slot += step
+
+def available_slots(cursor, hospital_id, start_date, days=1, now=None):
+    # Returns [(slot start, places left)] for every slot still in the future
+    now = (now or datetime.now()).isoformat()
+    schedule = cached_query(cursor, HOSPITAL_SCHEDULE_SQL, (hospital_id,), ("hospital", hospital_id))
+    slots = [slot for slot in schedule_slots(schedule, start_date, days) if slot[0] >= now]
+    if not slots:
+        return []
+    range_start = start_date.isoformat()
+    range_end = (start_date + timedelta(days=days)).isoformat()
+    booked_times = cached_query(cursor, SLOT_APPOINTMENTS_SQL, (hospital_id, range_start, range_end),
+                                ("hospital", hospital_id))
+    starts = [start for start, _, _ in slots]
+    booked = [0] * len(slots)
+    for (appointment_date,) in booked_times:
+        index = bisect.bisect_right(starts, appointment_date) - 1
+        if index >= 0 and appointment_date < slots[index][1]:
+            booked[index] += 1
+    return [(start, capacity - taken) for (start, _, capacity), taken in zip(slots, booked)]
+
+def book_appointment(conn, patient_id, hospital_id, slot_start, reason):
+    # Returns the new appointment id, or None if the slot filled up first
+    slot = datetime.fromisoformat(slot_start)
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        schedule = conn.execute(HOSPITAL_SCHEDULE_SQL, (hospital_id,)).fetchall()
+        matching = [s for s in schedule_slots(schedule, slot.date(), 1) if s[0] == slot_start]
+        # A slot that has already started is no longer offered (see available_slots)
+        if not matching or slot_start < datetime.now().isoformat():
+            raise ValueError(f"{slot_start} is not an offered slot")
+        _, slot_end, capacity = matching[0]
+        taken = conn.execute(SLOT_BOOKINGS_SQL, (hospital_id, slot_start, slot_end)).fetchone()[0]
+        if taken >= capacity:
+            conn.rollback()
+            return None
+        appt_id = f"APT_{uuid.uuid4().hex[:6]}"
+        conn.execute("INSERT INTO appointments VALUES (?, ?, ?, ?, ?, ?)",
+                     (appt_id, patient_id, hospital_id, slot_start, reason, "Scheduled"))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return appt_id
+
+# Hospital search
+# hospital_search is an FTS5 index over hospital names and addresses, kept in step
+# with hospitals by triggers. Every query word matches as a prefix, so results
+# follow the search box as it is typed. A word that starts no indexed term is
+# replaced by the closest indexed terms (compared whole and by their first
+# letters), which absorbs most typos. Name matches outrank address matches.
+HOSPITAL_SEARCH_LIMIT = 20
+HOSPITAL_SEARCH_WEIGHTS = "bm25(0.0, 10.0, 1.0)"  # hospital_id, name, address
+SEARCH_TYPO_CUTOFF = 0.75
+SEARCH_TYPO_MATCHES = 3
+
+def search_words(text):
+    return re.findall(r"\w+", text.lower())
+
+def closest_terms(word, vocabulary, limit=SEARCH_TYPO_MATCHES, cutoff=SEARCH_TYPO_CUTOFF):
+    # Candidates share the word's first letter, which keeps this to a slice of the vocabulary
+    start = bisect.bisect_left(vocabulary, word[0])
+    end = bisect.bisect_left(vocabulary, word[0] + "\U0010ffff")
+    matcher = difflib.SequenceMatcher(b=word)
+    scored = []
+    for term in vocabulary[start:end]:
+        best = 0.0
+        for candidate in {term, term[:len(word)]}:
+            matcher.set_seq1(candidate)
+            if matcher.real_quick_ratio() >= cutoff and matcher.quick_ratio() >= cutoff:
+                best = max(best, matcher.ratio())
+        if best >= cutoff:
+            scored.append((best, term))
+    return [term for _, term in heapq.nlargest(limit, scored)]
+
+def hospital_match_query(words, vocabulary):
+    # Returns the MATCH expression and {typed word: indexed terms used instead}
+    groups, corrections = [], {}
+    for word in words:
+        index = bisect.bisect_left(vocabulary, word)
+        if len(word) < 3 or index < len(vocabulary) and vocabulary[index].startswith(word):
+            groups.append(f'"{word}"*')
+            continue
+        terms = closest_terms(word, vocabulary)
+        if terms:
+            corrections[word] = terms
+            groups.append("(" + " OR ".join(f'"{term}"' for term in terms) + ")")
+        else:
+            groups.append(f'"{word}"*')
+    return " AND ".join(groups), corrections
+
+def search_hospitals(cursor, text, limit=HOSPITAL_SEARCH_LIMIT):
+    # Returns ([(id, name, address, phone)], corrections), best match first
+    words = search_words(text)
+    if not words:
+        return [], {}
+    def load_vocabulary():
+        cursor.execute(HOSPITAL_SEARCH_TERMS_SQL)
+        return [term for (term,) in cursor.fetchall()]
+    vocabulary = get_query_cache(DB_FILE).get_or_load(HOSPITAL_SEARCH_TERMS_SQL, (), "hospitals",
+                                                      scope_version(cursor, "hospitals"), load_vocabulary)
+    match, corrections = hospital_match_query(words, vocabulary)
+    return cached_query(cursor, HOSPITAL_SEARCH_SQL, (match, limit), "hospitals"), corrections
+
+# Hospital locations
+# hospital_locations holds one point per hospital, loaded from a local gazetteer
+# file (no network), and an R*Tree mirrors it through triggers. A radius query
+# reads the bounding box(es) of the circle from the R*Tree and keeps the
+# candidates whose haversine distance, computed with NumPy in one pass, is within
+# the radius. k-nearest runs radius queries over a growing radius until k
+# hospitals fall inside, which makes them the k nearest overall.
+EARTH_RADIUS_KM = 6371.0088
+NEAREST_LIMIT = 10
+NEAREST_START_KM = 10.0
+NEAREST_GROWTH = 4.0
+MAX_DISTANCE_KM = np.pi * EARTH_RADIUS_KM
+
+def haversine_km(latitude, longitude, latitudes, longitudes):
+    lat, lon = np.radians(latitude), np.radians(longitude)
+    lats, lons = np.radians(latitudes), np.radians(longitudes)
+    a = np.sin((lats - lat) / 2) ** 2 + np.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+def bounding_boxes(latitude, longitude, radius_km):
+    # (min_lat, max_lat, min_lon, max_lon) boxes covering the circle, split at
+    # the antimeridian; a circle reaching a pole covers every longitude
+    angle = radius_km / EARTH_RADIUS_KM
+    min_lat, max_lat = latitude - np.degrees(angle), latitude + np.degrees(angle)
+    if min_lat <= -90 or max_lat >= 90 or angle >= np.pi / 2:
+        return [(max(min_lat, -90.0), min(max_lat, 90.0), -180.0, 180.0)]
+    delta_lon = np.degrees(np.arcsin(min(1.0, np.sin(angle) / np.cos(np.radians(latitude)))))
+    min_lon, max_lon = longitude - delta_lon, longitude + delta_lon
+    if min_lon < -180:
+        return [(min_lat, max_lat, min_lon + 360, 180.0), (min_lat, max_lat, -180.0, max_lon)]
+    if max_lon > 180:
+        return [(min_lat, max_lat, min_lon, 180.0), (min_lat, max_lat, -180.0, max_lon - 360)]
+    return [(min_lat, max_lat, min_lon, max_lon)]
+
+def located_within(cursor, latitude, longitude, radius_km):
+    # Returns [(hospital_id, distance_km)] within radius_km, nearest first
+    candidates = []
+    for box in bounding_boxes(latitude, longitude, radius_km):
+        cursor.execute(HOSPITALS_IN_BOX_SQL, box)
+        candidates.extend(cursor.fetchall())
+    if not candidates:
+        return []
+    ids = [row[0] for row in candidates]
+    points = np.array([row[1:] for row in candidates], dtype=float)
+    distances = haversine_km(latitude, longitude, points[:, 0], points[:, 1])
+    inside = np.flatnonzero(distances <= radius_km)
+    order = inside[np.argsort(distances[inside], kind="stable")]
+    return [(ids[i], float(distances[i])) for i in order]
+
+def nearest_hospitals(cursor, latitude, longitude, k=NEAREST_LIMIT, radius_km=None):
+    # The k nearest located hospitals, optionally only within radius_km, as
+    # [(id, name, address, phone, distance_km)]
+    if radius_km is not None:
+        found = located_within(cursor, latitude, longitude, radius_km)[:k]
+    else:
+        radius = NEAREST_START_KM
+        while True:
+            found = located_within(cursor, latitude, longitude, radius)
+            if len(found) >= k or radius >= MAX_DISTANCE_KM:
+                break
+            radius = min(radius * NEAREST_GROWTH, MAX_DISTANCE_KM)
+        found = found[:k]
+    if not found:
+        return []
+    cursor.execute(HOSPITALS_BY_ID_SQL.format(placeholders=", ".join("?" for _ in found)),
+                   [hospital_id for hospital_id, _ in found])
+    details = {row[0]: row for row in cursor.fetchall()}
+    return [(*details[hospital_id], distance) for hospital_id, distance in found if hospital_id in details]
+
+def load_hospital_locations(conn, file):
+    # Gazetteer rows (CSV, JSON array or JSON Lines) carry latitude and longitude
+    # plus a hospital_id, an exact hospital name, or a place. A place locates every
+    # hospital whose address ends with it ("123 Main St, Westside") and that is
+    # not named directly. Returns a report like import_health_records.
+    start = time.perf_counter()
+    by_id, by_name, by_place = {}, {}, {}
+    read = rejected = 0
+    rejections = []
+    for number, row in read_import_rows(file):
+        read += 1
+        try:
+            if not isinstance(row, dict):
+                raise ValueError("not a record")
+            row = {str(key).strip().lower(): value for key, value in row.items() if key is not None}
+            try:
+                point = (float(row.get("latitude")), float(row.get("longitude")))
+            except (TypeError, ValueError):
+                raise ValueError("latitude and longitude must be numbers")
+            if not (-90 <= point[0] <= 90 and -180 <= point[1] <= 180):
+                raise ValueError(f"coordinates {point[0]}, {point[1]} are out of range")
+            for column, target in [("hospital_id", by_id), ("name", by_name), ("place", by_place)]:
+                key = str(row.get(column) or "").strip()
+                if key:
+                    target[key if column == "hospital_id" else key.lower()] = point
+                    break
+            else:
+                raise ValueError("needs a hospital_id, name or place")
+        except ValueError as e:
+            rejected += 1
+            if len(rejections) < IMPORT_MAX_REJECTIONS:
+                rejections.append((number, str(e)))
+    
+    cursor = conn.cursor()
+    cursor.execute("SELECT id, name, address FROM hospitals")
+    located = []
+    hospitals = 0
+    for hospital_id, name, address in cursor.fetchall():
+        hospitals += 1
+        point, source = by_id.get(hospital_id) or by_name.get((name or "").strip().lower()), "hospital"
+        if point is None:
+            point, source = by_place.get((address or "").rsplit(",", 1)[-1].strip().lower()), "place"
+        if point is not None:
+            located.append((hospital_id, *point, source))
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        cursor.executemany(UPSERT_LOCATION_SQL, located)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return {"read": read, "rejected": rejected, "rejections": rejections, "located": len(located),
+            "hospitals": hospitals, "seconds": time.perf_counter() - start}
+
+# System log
+# Events (logins, failed logins, registrations, bookings, record changes, errors)
+# go into an in-memory ring buffer that a background thread writes to the
+# append-only system_logs table in batches, so no user action waits on a log
+# INSERT. If the buffer fills faster than it drains, the oldest unwritten events
+# are dropped and counted; events still buffered when the process dies are lost.
+LOG_LEVELS = ["INFO", "WARNING", "ERROR"]
+LOG_BUFFER_SIZE = 10000
+LOG_FLUSH_SECONDS = 2.0
+LOG_FLUSH_BATCH = 500  # buffered events that trigger an early flush
+
+class SystemLog:
+    def __init__(self, pool, capacity=LOG_BUFFER_SIZE, interval=LOG_FLUSH_SECONDS):
+        self.pool = pool
+        self.interval = interval
+        self._buffer = deque(maxlen=capacity)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self.logged = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed_flushes = 0
+        self.writer_errors = 0
+        threading.Thread(target=self._run, name="system-log-writer", daemon=True).start()
+        atexit.register(self.flush)
+
+    def log(self, level, event, message, user_id=None):
+        entry = (datetime.now().isoformat(timespec="milliseconds"), level, event, message, user_id)
+        with self._lock:
+            if len(self._buffer) == self._buffer.maxlen:
+                self.dropped += 1
+            self._buffer.append(entry)
+            self.logged += 1
+            if len(self._buffer) >= LOG_FLUSH_BATCH:
+                self._wake.set()
+
+    def _run(self):
+        # Nothing may end this loop: once the writer stops, events only pile up
+        # until the buffer drops them
+        while True:
+            try:
+                self._wake.wait(self.interval)
+                self._wake.clear()
+                self.flush()
+            except Exception:
+                with self._lock:
+                    self.writer_errors += 1
+
+    def flush(self):
+        # Writes everything buffered so far in one transaction; if that fails the
+        # events go back in front of newer ones for the next attempt
+        with self._flush_lock:
+            with self._lock:
+                entries = list(self._buffer)
+                self._buffer.clear()
+            if not entries:
+                return 0
+            conn = None
+            try:
+                conn = self.pool.acquire()
+                conn.executemany(INSERT_LOG_SQL, entries)
+                conn.commit()
+            except Exception:
+                with self._lock:
+                    self.failed_flushes += 1
+                    room = self._buffer.maxlen - len(self._buffer)
+                    kept = entries[len(entries) - room:] if room else []
+                    self.dropped += len(entries) - len(kept)
+                    self._buffer.extendleft(reversed(kept))
+                if conn is not None:
+                    conn.rollback()
+                return 0
+            finally:
+                if conn is not None:
+                    self.pool.release(conn)
+            with self._lock:
+                self.written += len(entries)
+            return len(entries)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "logged": self.logged,
+                "written": self.written,
+                "pending": len(self._buffer),
+                "dropped": self.dropped,
+                "failed_flushes": self.failed_flushes,
+                "writer_errors": self.writer_errors,
+            }
+
+@st.cache_resource(show_spinner=False)
+def get_system_log(db_file):
+    return SystemLog(get_connection_pool(db_file))
+
+def log_event(level, event, message, user_id=None):
+    # Attributed to the logged-in user unless given
+    if user_id is None and st.session_state.get("user"):
+        user_id = st.session_state.user["user_id"]
+    get_system_log(DB_FILE).log(level, event, message, user_id)
+
+# Database setup
+# Schema changes are ordered, idempotent migrations recorded in schema_version.
+# They run once per process and database file (see bootstrap_database), never
+# on the per-rerun path.
+def create_tables(cursor):
     cursor.execute('''CREATE TABLE IF NOT EXISTS users (
         id TEXT PRIMARY KEY,
         username TEXT UNIQUE,
@@ -80,14 +1487,20 @@ def initialize_database():
         value TEXT,
         notes TEXT
     )''')
-    
+
+def create_indexes(cursor):
+    # Composite indexes for the page queries below
+    for index_sql in INDEXES:
+        cursor.execute(index_sql)
+
+def seed_defaults(cursor):
     # Add admin user if it doesn't exist
     cursor.execute("SELECT * FROM users WHERE role = 'admin'")
     if not cursor.fetchone():
         admin_id = f"USR_ADM_{uuid.uuid4().hex[:6]}"
         cursor.execute("INSERT INTO users VALUES (?, ?, ?, ?, ?, ?)",
                       (admin_id, "admin", hash_password("admin123"), "admin", "System Admin", "admin@trackmyhealth.com"))
-    
+
     # Add some sample hospitals if none exist
     cursor.execute("SELECT * FROM hospitals LIMIT 1")
     if not cursor.fetchone():
@@ -96,36 +1509,567 @@ def initialize_database():
             ("Memorial Medical Center", "456 Oak Ave, Westside", "555-234-5678"),
             ("Community Health Network", "789 Pine Rd, Eastville", "555-345-6789")
         ]
-        
+
         for hospital in sample_hospitals:
             user_id = f"USR_HOS_{uuid.uuid4().hex[:6]}"
             hospital_id = f"HOS_{uuid.uuid4().hex[:6]}"
             hospital_name = hospital[0]
             username = hospital_name.lower().replace(" ", "")
-            
+
             cursor.execute("INSERT INTO users VALUES (?, ?, ?, ?, ?, ?)",
                          (user_id, username, hash_password("hospital123"), "hospital", hospital_name, f"info@{username}.com"))
             cursor.execute("INSERT INTO hospitals VALUES (?, ?, ?, ?, ?)",
                          (hospital_id, user_id, hospital_name, hospital[1], hospital[2]))
-    
-    conn.commit()
-    conn.close()
+
+def add_typed_health_values(cursor):
+    existing = {row[1] for row in cursor.execute("PRAGMA table_info(health_records)")}
+    for column, column_type in HEALTH_VALUE_COLUMNS:
+        if column not in existing:
+            cursor.execute(f"ALTER TABLE health_records ADD COLUMN {column} {column_type}")
+
+    # Backfill rows saved as free text, walking the primary key in batches
+    last_id = ""
+    while True:
+        cursor.execute("""
+            SELECT id, record_type, value FROM health_records
+            WHERE id > ? ORDER BY id LIMIT 5000
+        """, (last_id,))
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        updates = []
+        for record_id, record_type, value in rows:
+            fields = parse_health_value(record_type, value)
+            updates.append((fields["numeric_value"], fields["secondary_value"], fields["unit"],
+                            fields["label"], fields["dosage"], record_id))
+        cursor.executemany("""
+            UPDATE health_records
+            SET numeric_value = ?, secondary_value = ?, unit = ?, label = ?, dosage = ?
+            WHERE id = ?
+        """, updates)
+        last_id = rows[-1][0]
+
+    # Charts and statistics read (date, value) pairs straight from this index
+    cursor.execute("DROP INDEX IF EXISTS idx_health_records_patient_type_date")
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_health_records_series
+        ON health_records (patient_id, record_type, record_date, numeric_value, secondary_value)
+    """)
+
+def create_health_rollups(cursor):
+    cursor.execute('''CREATE TABLE IF NOT EXISTS health_rollups (
+        patient_id TEXT,
+        record_type TEXT,
+        period TEXT,
+        period_start TEXT,
+        count INTEGER,
+        total REAL,
+        secondary_total REAL,
+        minimum REAL,
+        maximum REAL,
+        last_date TEXT,
+        last_value REAL,
+        PRIMARY KEY (patient_id, record_type, period, period_start)
+    ) WITHOUT ROWID''')
+    rebuild_rollups(cursor)
+
+# Row counts for the admin dashboard, kept current by triggers so reading them
+# costs the same however large users and appointments grow. Counter names are
+# "role:<role>", "appointments" and "status:<status>".
+COUNTER_DELTA_SQL = "INSERT INTO system_counters VALUES ({name}, {delta}) ON CONFLICT (name) DO UPDATE SET value = value + excluded.value;"
+USER_ROLE_COUNTER = "'role:' || COALESCE({row}.role, '')"
+APPOINTMENT_STATUS_COUNTER = "'status:' || COALESCE({row}.status, '')"
+COUNTER_TRIGGERS = [
+    ("users_counters_insert", "AFTER INSERT ON users", [(USER_ROLE_COUNTER, "NEW", 1)]),
+    ("users_counters_delete", "AFTER DELETE ON users", [(USER_ROLE_COUNTER, "OLD", -1)]),
+    ("users_counters_update", "AFTER UPDATE OF role ON users WHEN OLD.role IS NOT NEW.role",
+     [(USER_ROLE_COUNTER, "OLD", -1), (USER_ROLE_COUNTER, "NEW", 1)]),
+    ("appointments_counters_insert", "AFTER INSERT ON appointments",
+     [("'appointments'", "NEW", 1), (APPOINTMENT_STATUS_COUNTER, "NEW", 1)]),
+    ("appointments_counters_delete", "AFTER DELETE ON appointments",
+     [("'appointments'", "OLD", -1), (APPOINTMENT_STATUS_COUNTER, "OLD", -1)]),
+    ("appointments_counters_update", "AFTER UPDATE OF status ON appointments WHEN OLD.status IS NOT NEW.status",
+     [(APPOINTMENT_STATUS_COUNTER, "OLD", -1), (APPOINTMENT_STATUS_COUNTER, "NEW", 1)]),
+]
+
+def create_system_counters(cursor):
+    cursor.execute('''CREATE TABLE IF NOT EXISTS system_counters (
+        name TEXT PRIMARY KEY,
+        value INTEGER
+    ) WITHOUT ROWID''')
+    for name, event, deltas in COUNTER_TRIGGERS:
+        body = "\n".join(COUNTER_DELTA_SQL.format(name=counter.format(row=row), delta=delta)
+                         for counter, row, delta in deltas)
+        cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN {body} END")
+    cursor.execute("DELETE FROM system_counters")
+    cursor.execute(f"""
+        INSERT INTO system_counters
+        SELECT {USER_ROLE_COUNTER.format(row="users")}, COUNT(*) FROM users GROUP BY 1
+    """)
+    cursor.execute(f"""
+        INSERT INTO system_counters
+        SELECT {APPOINTMENT_STATUS_COUNTER.format(row="appointments")}, COUNT(*) FROM appointments GROUP BY 1
+    """)
+    cursor.execute("INSERT INTO system_counters SELECT 'appointments', COUNT(*) FROM appointments")
+
+# Query cache versions, one row per scope ("hospitals", "patient:<id>",
+# "hospital:<id>", and "*" for changes that touch many scopes, such as a renamed
+# hospital or user showing up in other people's lists)
+CACHE_VERSION_SQL = "INSERT INTO cache_versions VALUES ({scope}, 1) ON CONFLICT (scope) DO UPDATE SET version = version + 1;"
+PATIENT_SCOPE = "'patient:' || {row}.patient_id"
+HOSPITAL_SCOPE = "'hospital:' || {row}.hospital_id"
+CACHE_VERSION_TRIGGERS = [
+    ("health_records_cache_insert", "AFTER INSERT ON health_records", [(PATIENT_SCOPE, "NEW")]),
+    ("health_records_cache_update", "AFTER UPDATE ON health_records", [(PATIENT_SCOPE, "OLD"), (PATIENT_SCOPE, "NEW")]),
+    ("health_records_cache_delete", "AFTER DELETE ON health_records", [(PATIENT_SCOPE, "OLD")]),
+    ("appointments_cache_insert", "AFTER INSERT ON appointments", [(PATIENT_SCOPE, "NEW"), (HOSPITAL_SCOPE, "NEW")]),
+    ("appointments_cache_update", "AFTER UPDATE ON appointments",
+     [(PATIENT_SCOPE, "OLD"), (HOSPITAL_SCOPE, "OLD"), (PATIENT_SCOPE, "NEW"), (HOSPITAL_SCOPE, "NEW")]),
+    ("appointments_cache_delete", "AFTER DELETE ON appointments", [(PATIENT_SCOPE, "OLD"), (HOSPITAL_SCOPE, "OLD")]),
+    ("hospital_schedules_cache_insert", "AFTER INSERT ON hospital_schedules", [(HOSPITAL_SCOPE, "NEW")]),
+    ("hospital_schedules_cache_update", "AFTER UPDATE ON hospital_schedules",
+     [(HOSPITAL_SCOPE, "OLD"), (HOSPITAL_SCOPE, "NEW")]),
+    ("hospital_schedules_cache_delete", "AFTER DELETE ON hospital_schedules", [(HOSPITAL_SCOPE, "OLD")]),
+    ("hospitals_cache_insert", "AFTER INSERT ON hospitals", [("'hospitals'", "NEW")]),
+    ("hospitals_cache_update", "AFTER UPDATE ON hospitals", [("'*'", "NEW")]),
+    ("hospitals_cache_delete", "AFTER DELETE ON hospitals", [("'*'", "OLD")]),
+    ("users_cache_update", "AFTER UPDATE OF name ON users WHEN OLD.name IS NOT NEW.name", [("'*'", "NEW")]),
+    ("users_cache_delete", "AFTER DELETE ON users", [("'*'", "OLD")]),
+]
+
+def create_cache_versions(cursor):
+    cursor.execute('''CREATE TABLE IF NOT EXISTS cache_versions (
+        scope TEXT PRIMARY KEY,
+        version INTEGER NOT NULL
+    ) WITHOUT ROWID''')
+    for name, event, scopes in CACHE_VERSION_TRIGGERS:
+        body = "\n".join(CACHE_VERSION_SQL.format(scope=scope.format(row=row)) for scope, row in scopes)
+        cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN {body} END")
+
+def create_hospital_schedules(cursor):
+    cursor.execute('''CREATE TABLE IF NOT EXISTS hospital_schedules (
+        hospital_id TEXT,
+        weekday INTEGER,
+        open_time TEXT,
+        close_time TEXT,
+        slot_minutes INTEGER,
+        capacity INTEGER,
+        PRIMARY KEY (hospital_id, weekday)
+    ) WITHOUT ROWID''')
+    cursor.execute("SELECT id FROM hospitals")
+    for (hospital_id,) in cursor.fetchall():
+        insert_schedule(cursor, hospital_id)
+
+def create_system_logs(cursor):
+    cursor.execute('''CREATE TABLE IF NOT EXISTS system_logs (
+        id INTEGER PRIMARY KEY,
+        logged_at TEXT NOT NULL,
+        level TEXT NOT NULL,
+        event TEXT NOT NULL,
+        message TEXT NOT NULL,
+        user_id TEXT
+    )''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_system_logs_time ON system_logs (logged_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_system_logs_level_time ON system_logs (level, logged_at)")
+    cursor.execute("""CREATE TRIGGER IF NOT EXISTS system_logs_append_only BEFORE UPDATE ON system_logs
+        BEGIN SELECT RAISE(ABORT, 'system_logs is append-only'); END""")
+
+def create_hospital_search(cursor):
+    # The index is keyed by hospital id rather than hospitals' implicit rowid,
+    # which VACUUM may renumber; updates and deletes find the entry by scanning
+    # the index content, which is fine at the rate profiles change.
+    cursor.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS hospital_search USING fts5(
+        hospital_id UNINDEXED, name, address, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+    )""")
+    cursor.execute("CREATE VIRTUAL TABLE IF NOT EXISTS hospital_search_terms USING fts5vocab(hospital_search, row)")
+    cursor.execute("INSERT INTO hospital_search (hospital_search, rank) VALUES ('rank', ?)", (HOSPITAL_SEARCH_WEIGHTS,))
+    cursor.execute("""CREATE TRIGGER IF NOT EXISTS hospitals_search_insert AFTER INSERT ON hospitals BEGIN
+        INSERT INTO hospital_search (hospital_id, name, address) VALUES (new.id, new.name, new.address);
+    END""")
+    cursor.execute("""CREATE TRIGGER IF NOT EXISTS hospitals_search_update AFTER UPDATE OF id, name, address ON hospitals BEGIN
+        DELETE FROM hospital_search WHERE hospital_id = old.id;
+        INSERT INTO hospital_search (hospital_id, name, address) VALUES (new.id, new.name, new.address);
+    END""")
+    cursor.execute("""CREATE TRIGGER IF NOT EXISTS hospitals_search_delete AFTER DELETE ON hospitals BEGIN
+        DELETE FROM hospital_search WHERE hospital_id = old.id;
+    END""")
+    cursor.execute("DELETE FROM hospital_search")
+    cursor.execute("INSERT INTO hospital_search (hospital_id, name, address) SELECT id, name, address FROM hospitals")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_hospitals_name ON hospitals (name)")
+
+def create_hospital_locations(cursor):
+    cursor.execute('''CREATE TABLE IF NOT EXISTS hospital_locations (
+        id INTEGER PRIMARY KEY,
+        hospital_id TEXT NOT NULL UNIQUE,
+        latitude REAL NOT NULL,
+        longitude REAL NOT NULL,
+        source TEXT
+    )''')
+    cursor.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS hospital_location_index
+        USING rtree(id, min_lat, max_lat, min_lon, max_lon)""")
+    cursor.execute("""CREATE TRIGGER IF NOT EXISTS hospital_locations_insert AFTER INSERT ON hospital_locations BEGIN
+        INSERT INTO hospital_location_index VALUES (new.id, new.latitude, new.latitude, new.longitude, new.longitude);
+    END""")
+    cursor.execute("""CREATE TRIGGER IF NOT EXISTS hospital_locations_update
+        AFTER UPDATE OF latitude, longitude ON hospital_locations BEGIN
+        UPDATE hospital_location_index SET min_lat = new.latitude, max_lat = new.latitude,
+            min_lon = new.longitude, max_lon = new.longitude WHERE id = new.id;
+    END""")
+    cursor.execute("""CREATE TRIGGER IF NOT EXISTS hospital_locations_delete AFTER DELETE ON hospital_locations BEGIN
+        DELETE FROM hospital_location_index WHERE id = old.id;
+    END""")
+    cursor.execute("""CREATE TRIGGER IF NOT EXISTS hospitals_location_delete AFTER DELETE ON hospitals BEGIN
+        DELETE FROM hospital_locations WHERE hospital_id = old.id;
+    END""")
+
+def add_keyset_index_ids(cursor):
+    # Page queries order by (sort key, id) and ids are TEXT primary keys, so the
+    # indexes must end in id for a page to be read in order instead of sorting
+    # every row that shares the key prefix in a temp B-tree
+    cursor.execute("DROP INDEX IF EXISTS idx_users_role_name")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_role_name_id ON users (role, name, id)")
+    cursor.execute("DROP INDEX IF EXISTS idx_health_records_patient_date")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_health_records_patient_date_id ON health_records (patient_id, record_date, id)")
+    cursor.execute("DROP INDEX IF EXISTS idx_health_records_series")
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_health_records_series
+        ON health_records (patient_id, record_type, record_date, id, numeric_value, secondary_value)
+    """)
+    cursor.execute("DROP INDEX IF EXISTS idx_appointments_hospital_date")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_appointments_hospital_date_id ON appointments (hospital_id, appointment_date, id)")
+    cursor.execute("DROP INDEX IF EXISTS idx_appointments_hospital_status_date")
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_appointments_hospital_status_date_id
+        ON appointments (hospital_id, status, appointment_date, id)
+    """)
+
+# (version, description, migration); append new entries, never reorder or edit applied ones
+MIGRATIONS = [
+    (1, "Create core tables", create_tables),
+    (2, "Add page query indexes", create_indexes),
+    (3, "Seed admin user and sample hospitals", seed_defaults),
+    (4, "Store typed health record values", add_typed_health_values),
+    (5, "Add daily/weekly/monthly health rollups", create_health_rollups),
+    (6, "Add trigger-maintained system counters", create_system_counters),
+    (7, "Add hospital appointment schedules", create_hospital_schedules),
+    (8, "Add system event log", create_system_logs),
+    (9, "Add hospital full-text search", create_hospital_search),
+    (10, "Add hospital locations with an R*Tree index", create_hospital_locations),
+    (11, "Add id to the keyset page indexes", add_keyset_index_ids),
+    (12, "Persist query cache versions", create_cache_versions),
+]
+
+def schema_version(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        description TEXT,
+        applied_at TEXT
+    )''')
+    return conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+
+def run_migrations(conn):
+    applied = []
+    for version, description, migration in MIGRATIONS:
+        if version <= schema_version(conn):
+            continue
+        # BEGIN IMMEDIATE takes the write lock up front, so a second process
+        # starting at the same time waits and then sees the new version.
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if conn.execute("SELECT 1 FROM schema_version WHERE version = ?", (version,)).fetchone():
+                conn.rollback()
+                continue
+            migration(conn.cursor())
+            conn.execute("INSERT INTO schema_version VALUES (?, ?, ?)",
+                         (version, description, datetime.now().isoformat()))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append(version)
+    return applied
+
+def initialize_database(db_file=None):
+    start = time.perf_counter()
+    with get_connection(db_file) as conn:
+        applied = run_migrations(conn)
+        version = schema_version(conn)
+    return {
+        "version": version,
+        "applied": applied,
+        "seconds": time.perf_counter() - start,
+        "initialized_at": datetime.now().isoformat(),
+    }
+
+@st.cache_resource(show_spinner=False)
+def bootstrap_database(db_file):
+    return initialize_database(db_file)
+
+INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_users_role_name ON users (role, name)",
+    "CREATE INDEX IF NOT EXISTS idx_patients_user ON patients (user_id)",
+    "CREATE INDEX IF NOT EXISTS idx_hospitals_user ON hospitals (user_id)",
+    "CREATE INDEX IF NOT EXISTS idx_health_records_patient_type_date ON health_records (patient_id, record_type, record_date)",
+    "CREATE INDEX IF NOT EXISTS idx_health_records_patient_date ON health_records (patient_id, record_date)",
+    "CREATE INDEX IF NOT EXISTS idx_appointments_hospital_status_date ON appointments (hospital_id, status, appointment_date)",
+    "CREATE INDEX IF NOT EXISTS idx_appointments_hospital_date ON appointments (hospital_id, appointment_date)",
+    "CREATE INDEX IF NOT EXISTS idx_appointments_patient_date ON appointments (patient_id, appointment_date)",
+    "CREATE INDEX IF NOT EXISTS idx_appointments_status ON appointments (status)",
+    "CREATE INDEX IF NOT EXISTS idx_appointments_date ON appointments (appointment_date)",
+]
+
+# Page queries
+# Kept at module level so `manage.py check-plans` explains exactly what the pages run.
+AUTHENTICATE_SQL = """
+    SELECT u.id, u.password_hash, u.role, u.name, u.email,
+           p.id, p.first_name, p.last_name, p.date_of_birth, p.gender,
+           h.id, h.name, h.address, h.phone
+    FROM users u
+    LEFT JOIN patients p ON p.user_id = u.id
+    LEFT JOIN hospitals h ON h.user_id = u.id
+    WHERE u.username = ?
+"""
+HOSPITAL_DIRECTORY_SQL = """
+    SELECT h.id, h.name, h.address, h.phone
+    FROM hospitals h
+    JOIN users u ON h.user_id = u.id
+    ORDER BY h.name
+    LIMIT ?
+"""
+HOSPITAL_SEARCH_SQL = """
+    SELECT h.id, h.name, h.address, h.phone
+    FROM hospital_search
+    JOIN hospitals h ON h.id = hospital_search.hospital_id
+    WHERE hospital_search MATCH ?
+    ORDER BY hospital_search.rank
+    LIMIT ?
+"""
+HOSPITAL_SEARCH_TERMS_SQL = "SELECT term FROM hospital_search_terms"
+HOSPITALS_IN_BOX_SQL = """
+    SELECT l.hospital_id, l.latitude, l.longitude
+    FROM hospital_location_index i
+    JOIN hospital_locations l ON l.id = i.id
+    WHERE i.max_lat >= ? AND i.min_lat <= ? AND i.max_lon >= ? AND i.min_lon <= ?
+"""
+HOSPITALS_BY_ID_SQL = "SELECT id, name, address, phone FROM hospitals WHERE id IN ({placeholders})"
+UPSERT_LOCATION_SQL = """
+    INSERT INTO hospital_locations (hospital_id, latitude, longitude, source) VALUES (?, ?, ?, ?)
+    ON CONFLICT (hospital_id) DO UPDATE SET
+        latitude = excluded.latitude, longitude = excluded.longitude, source = excluded.source
+"""
+HOSPITAL_CHOICES_SQL = "SELECT id, name FROM hospitals"
+RECORD_TYPES_SQL = "SELECT DISTINCT record_type FROM health_records WHERE patient_id = ?"
+HEALTH_HISTORY_SQL = """
+    SELECT record_date, record_type, value, notes
+    FROM health_records
+    WHERE patient_id = ?
+    ORDER BY record_date DESC
+"""
+INSERT_HEALTH_RECORD_SQL = """
+    INSERT INTO health_records (id, patient_id, record_date, record_type, value, notes,
+                                numeric_value, secondary_value, unit, label, dosage)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+EXISTING_READINGS_SQL = """
+    SELECT record_date, record_type, numeric_value, secondary_value, label, dosage
+    FROM health_records
+    WHERE patient_id = ? AND record_date IN ({placeholders})
+"""
+HEALTH_STATS_SQL = """
+    SELECT SUM(count), MIN(minimum), MAX(maximum),
+           SUM(total) / SUM(count), SUM(secondary_total) / SUM(count)
+    FROM health_rollups
+    WHERE patient_id = ? AND record_type = ? AND period = 'month'
+"""
+HEALTH_ROLLUP_COUNT_SQL = """
+    SELECT COUNT(*) FROM health_rollups
+    WHERE patient_id = ? AND record_type = ? AND period = ?
+"""
+HEALTH_ROLLUP_SERIES_SQL = """
+    SELECT period_start, total / count, secondary_total / count, minimum, maximum
+    FROM health_rollups
+    WHERE patient_id = ? AND record_type = ? AND period = ?
+    ORDER BY period_start
+"""
+HEALTH_SERIES_SQL = """
+    SELECT record_date, numeric_value, secondary_value
+    FROM health_records
+    WHERE patient_id = ? AND record_type = ? AND numeric_value IS NOT NULL
+    ORDER BY record_date
+"""
+HEALTH_HISTORY_PAGE_SQL = """
+    SELECT record_date, record_type, value, notes, record_date, id
+    FROM health_records
+    WHERE patient_id = ?
+"""
+HEALTH_HISTORY_BY_TYPE_PAGE_SQL = """
+    SELECT record_date, record_type, value, notes, record_date, id
+    FROM health_records
+    WHERE patient_id = ? AND record_type = ?
+"""
+HEALTH_HISTORY_BY_TYPE_SQL = """
+    SELECT record_date, record_type, value, notes
+    FROM health_records
+    WHERE patient_id = ? AND record_type = ?
+    ORDER BY record_date DESC
+"""
+PATIENT_APPOINTMENTS_SQL = """
+    SELECT a.id, h.name, a.appointment_date, a.reason, a.status
+    FROM appointments a
+    JOIN hospitals h ON a.hospital_id = h.id
+    WHERE a.patient_id = ?
+    ORDER BY a.appointment_date DESC
+"""
+UPCOMING_APPOINTMENTS_SQL = """
+    SELECT a.id, u.name, a.appointment_date, a.reason, a.status
+    FROM appointments a
+    JOIN patients p ON a.patient_id = p.id
+    JOIN users u ON p.user_id = u.id
+    WHERE a.hospital_id = ? AND a.status = 'Scheduled' AND a.appointment_date >= ?
+    ORDER BY a.appointment_date ASC
+"""
+HOSPITAL_SCHEDULE_SQL = """
+    SELECT weekday, open_time, close_time, slot_minutes, capacity
+    FROM hospital_schedules
+    WHERE hospital_id = ?
+    ORDER BY weekday
+"""
+SLOT_APPOINTMENTS_SQL = """
+    SELECT appointment_date
+    FROM appointments
+    WHERE hospital_id = ? AND appointment_date >= ? AND appointment_date < ? AND status != 'Cancelled'
+"""
+SLOT_BOOKINGS_SQL = """
+    SELECT COUNT(*)
+    FROM appointments
+    WHERE hospital_id = ? AND appointment_date >= ? AND appointment_date < ? AND status != 'Cancelled'
+"""
+HOSPITAL_STATUSES_SQL = "SELECT DISTINCT status FROM appointments WHERE hospital_id = ?"
+APPOINTMENT_HISTORY_SQL = """
+    SELECT a.id, u.name, a.appointment_date, a.reason, a.status
+    FROM appointments a
+    JOIN patients p ON a.patient_id = p.id
+    JOIN users u ON p.user_id = u.id
+    WHERE a.hospital_id = ?
+    ORDER BY a.appointment_date DESC
+"""
+APPOINTMENT_HISTORY_BY_STATUS_SQL = """
+    SELECT a.id, u.name, a.appointment_date, a.reason, a.status
+    FROM appointments a
+    JOIN patients p ON a.patient_id = p.id
+    JOIN users u ON p.user_id = u.id
+    WHERE a.hospital_id = ? AND a.status = ?
+    ORDER BY a.appointment_date DESC
+"""
+APPOINTMENT_HISTORY_PAGE_SQL = """
+    SELECT a.id, u.name, a.appointment_date, a.reason, a.status, a.appointment_date, a.id
+    FROM appointments a
+    JOIN patients p ON a.patient_id = p.id
+    JOIN users u ON p.user_id = u.id
+    WHERE a.hospital_id = ?
+"""
+APPOINTMENT_HISTORY_BY_STATUS_PAGE_SQL = """
+    SELECT a.id, u.name, a.appointment_date, a.reason, a.status, a.appointment_date, a.id
+    FROM appointments a
+    JOIN patients p ON a.patient_id = p.id
+    JOIN users u ON p.user_id = u.id
+    WHERE a.hospital_id = ? AND a.status = ?
+"""
+HOSPITAL_PATIENTS_SQL = """
+    SELECT p.id, u.name
+    FROM patients p
+    JOIN users u ON p.user_id = u.id
+    WHERE p.id IN (SELECT patient_id FROM appointments WHERE hospital_id = ?)
+"""
+SYSTEM_COUNTERS_SQL = "SELECT name, value FROM system_counters"
+SCOPE_VERSION_SQL = "SELECT COALESCE(SUM(version), 0) FROM cache_versions WHERE scope IN ('*', ?)"
+# CROSS JOIN pins appointments as the outer loop, so the newest ten are read from
+# idx_appointments_date; with statistics the planner otherwise prefers walking the
+# covering users index and sorting every appointment
+RECENT_ACTIVITY_SQL = """
+    SELECT u.name, a.appointment_date, h.name, a.status
+    FROM appointments a
+    CROSS JOIN patients p ON a.patient_id = p.id
+    CROSS JOIN users u ON p.user_id = u.id
+    CROSS JOIN hospitals h ON a.hospital_id = h.id
+    ORDER BY a.appointment_date DESC
+    LIMIT 10
+"""
+USERS_PAGE_SQL = """
+    SELECT id, username, role, name, email, role, name, id
+    FROM users
+"""
+USERS_BY_ROLE_PAGE_SQL = """
+    SELECT id, username, role, name, email, name, id
+    FROM users
+    WHERE role = ?
+"""
+INSERT_LOG_SQL = "INSERT INTO system_logs (logged_at, level, event, message, user_id) VALUES (?, ?, ?, ?, ?)"
+SYSTEM_LOGS_SQL = """
+    SELECT logged_at, level, event, message, user_id
+    FROM system_logs
+    WHERE logged_at >= ? AND logged_at < ?
+    ORDER BY logged_at DESC, id DESC
+"""
+SYSTEM_LOGS_BY_LEVEL_SQL = """
+    SELECT logged_at, level, event, message, user_id
+    FROM system_logs
+    WHERE level = ? AND logged_at >= ? AND logged_at < ?
+    ORDER BY logged_at DESC, id DESC
+"""
+SYSTEM_LOGS_PAGE_SQL = """
+    SELECT logged_at, level, event, message, user_id, logged_at, id
+    FROM system_logs
+    WHERE logged_at >= ? AND logged_at < ?
+"""
+SYSTEM_LOGS_BY_LEVEL_PAGE_SQL = """
+    SELECT logged_at, level, event, message, user_id, logged_at, id
+    FROM system_logs
+    WHERE level = ? AND logged_at >= ? AND logged_at < ?
+"""
 
 # Authentication
+# The login result carries the patient/hospital id and profile, so pages read
+# them from the session instead of looking them up in every tab
 def authenticate(username, password):
     try:
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, password_hash, role, name FROM users WHERE username = ?", (username,))
-        user = cursor.fetchone()
-        if user and user[1] == hash_password(password):
-            return {'user_id': user[0], 'role': user[2], 'name': user[3]}
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(AUTHENTICATE_SQL, (username,))
+            user = cursor.fetchone()
+        if not user:
+            log_event("WARNING", "login_failed", f"Failed login attempt: {username}")
+            return None
+        (user_id, password_hash, role, name, email,
+         patient_id, first_name, last_name, date_of_birth, gender,
+         hospital_id, hospital_name, address, phone) = user
+        verifier = get_password_verifier()
+        matches, needs_rehash = verifier.verify(password, password_hash)
+        if matches:
+            if needs_rehash:
+                # Upgrade legacy or outdated hashes while the password is at hand;
+                # the WHERE clause skips the write if it changed meanwhile
+                with get_connection() as conn:
+                    conn.execute("UPDATE users SET password_hash = ? WHERE id = ? AND password_hash = ?",
+                                 (hash_password(password), user_id, password_hash))
+                    conn.commit()
+                verifier.record_rehash()
+            log_event("INFO", "login", f"User login: {username}", user_id)
+            result = {'user_id': user_id, 'role': role, 'name': name}
+            if role == "patient":
+                result['patient_id'] = patient_id
+                result['profile'] = {'first_name': first_name, 'last_name': last_name,
+                                     'date_of_birth': date_of_birth, 'gender': gender, 'email': email}
+            elif role == "hospital":
+                result['hospital_id'] = hospital_id
+                result['profile'] = {'name': hospital_name, 'address': address, 'phone': phone, 'email': email}
+            return result
+        log_event("WARNING", "login_failed", f"Failed login attempt: {username}", user_id)
         return None
     except Exception as e:
+        log_event("ERROR", "error", f"Authentication error for {username}: {e}")
         st.error(f"Authentication error: {e}")
         return None
-    finally:
-        conn.close()
 
 # Registration logic
 def register_user():
@@ -148,28 +2092,27 @@ def register_user():
                     password = custom_password if custom_password else "patient123"
                     
                     # Check if username already exists
-                    conn = sqlite3.connect(DB_FILE)
-                    cursor = conn.cursor()
-                    cursor.execute("SELECT username FROM users WHERE username = ?", (username,))
-                    if cursor.fetchone():
-                        st.error(f"Username '{username}' already exists. Please choose another username.")
-                        conn.close()
-                        return
+                    with get_connection() as conn:
+                        cursor = conn.cursor()
+                        cursor.execute("SELECT username FROM users WHERE username = ?", (username,))
+                        if cursor.fetchone():
+                            st.error(f"Username '{username}' already exists. Please choose another username.")
+                            return
                     
-                    user_id = f"USR_PAT_{uuid.uuid4().hex[:6]}"
-                    patient_id = f"PAT_{uuid.uuid4().hex[:6]}"
+                        user_id = f"USR_PAT_{uuid.uuid4().hex[:6]}"
+                        patient_id = f"PAT_{uuid.uuid4().hex[:6]}"
                     
-                    try:
-                        cursor.execute("INSERT INTO users VALUES (?, ?, ?, ?, ?, ?)",
-                                    (user_id, username, hash_password(password), "patient", f"{first_name} {last_name}", email))
-                        cursor.execute("INSERT INTO patients VALUES (?, ?, ?, ?, ?, ?)",
-                                    (patient_id, user_id, first_name, last_name, dob.isoformat(), gender))
-                        conn.commit()
-                        st.success(f"Registered successfully! Username: {username}, Password: {password}")
-                    except Exception as e:
-                        st.error(f"Registration error: {e}")
-                    finally:
-                        conn.close()
+                        try:
+                            cursor.execute("INSERT INTO users VALUES (?, ?, ?, ?, ?, ?)",
+                                        (user_id, username, hash_password(password), "patient", f"{first_name} {last_name}", email))
+                            cursor.execute("INSERT INTO patients VALUES (?, ?, ?, ?, ?, ?)",
+                                        (patient_id, user_id, first_name, last_name, dob.isoformat(), gender))
+                            conn.commit()
+                            log_event("INFO", "registration", f"New patient registered: {username}", user_id)
+                            st.success(f"Registered successfully! Username: {username}, Password: {password}")
+                        except Exception as e:
+                            log_event("ERROR", "error", f"Patient registration failed for {username}: {e}")
+                            st.error(f"Registration error: {e}")
                 else:
                     st.warning("Please fill all required fields.")
     
@@ -190,28 +2133,28 @@ def register_user():
                     password = custom_password if custom_password else "hospital123"
                     
                     # Check if username already exists
-                    conn = sqlite3.connect(DB_FILE)
-                    cursor = conn.cursor()
-                    cursor.execute("SELECT username FROM users WHERE username = ?", (username,))
-                    if cursor.fetchone():
-                        st.error(f"Username '{username}' already exists. Please choose another username.")
-                        conn.close()
-                        return
+                    with get_connection() as conn:
+                        cursor = conn.cursor()
+                        cursor.execute("SELECT username FROM users WHERE username = ?", (username,))
+                        if cursor.fetchone():
+                            st.error(f"Username '{username}' already exists. Please choose another username.")
+                            return
                     
-                    user_id = f"USR_HOS_{uuid.uuid4().hex[:6]}"
-                    hospital_id = f"HOS_{uuid.uuid4().hex[:6]}"
+                        user_id = f"USR_HOS_{uuid.uuid4().hex[:6]}"
+                        hospital_id = f"HOS_{uuid.uuid4().hex[:6]}"
                     
-                    try:
-                        cursor.execute("INSERT INTO users VALUES (?, ?, ?, ?, ?, ?)",
-                                    (user_id, username, hash_password(password), "hospital", name, email))
-                        cursor.execute("INSERT INTO hospitals VALUES (?, ?, ?, ?, ?)",
-                                    (hospital_id, user_id, name, address, phone))
-                        conn.commit()
-                        st.success(f"Registered successfully! Username: {username}, Password: {password}")
-                    except Exception as e:
-                        st.error(f"Registration error: {e}")
-                    finally:
-                        conn.close()
+                        try:
+                            cursor.execute("INSERT INTO users VALUES (?, ?, ?, ?, ?, ?)",
+                                        (user_id, username, hash_password(password), "hospital", name, email))
+                            cursor.execute("INSERT INTO hospitals VALUES (?, ?, ?, ?, ?)",
+                                        (hospital_id, user_id, name, address, phone))
+                            insert_schedule(cursor, hospital_id)
+                            conn.commit()
+                            log_event("INFO", "registration", f"New hospital registered: {username}", user_id)
+                            st.success(f"Registered successfully! Username: {username}, Password: {password}")
+                        except Exception as e:
+                            log_event("ERROR", "error", f"Hospital registration failed for {username}: {e}")
+                            st.error(f"Registration error: {e}")
                 else:
                     st.warning("Please fill all required fields.")
 
@@ -266,590 +2209,720 @@ def search_hospital():
         
         st.info("A link to search for hospitals has been provided above. Click it to open Google search in a new tab.")
         
-    # Display local hospitals from the database
+    # Search local hospitals from the database
     st.subheader("Hospitals in our system")
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute("SELECT h.id, h.name, h.address, h.phone FROM hospitals h JOIN users u ON h.user_id = u.id")
-    hospitals = cursor.fetchall()
+    query = st.text_input("Search by name or address", placeholder="e.g. memorial, oak ave", key="hospital_query")
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        if query.strip():
+            hospitals, corrections = search_hospitals(cursor, query)
+            if corrections:
+                st.caption("Also searched for " + "; ".join(
+                    f"{', '.join(terms)} instead of \"{word}\"" for word, terms in corrections.items()))
+        else:
+            hospitals = cached_query(cursor, HOSPITAL_DIRECTORY_SQL, (HOSPITAL_SEARCH_LIMIT,), "hospitals")
     
-    if hospitals:
-        df = pd.DataFrame(hospitals, columns=["Hospital ID", "Name", "Address", "Phone"])
-        st.dataframe(df)
+        if hospitals:
+            df = pd.DataFrame(hospitals, columns=["Hospital ID", "Name", "Address", "Phone"])
+            st.dataframe(df)
+            if len(hospitals) == HOSPITAL_SEARCH_LIMIT:
+                st.caption(f"Showing the top {HOSPITAL_SEARCH_LIMIT} hospitals; type more to narrow the search.")
         
-        # Store hospitals in session state for selection
-        hospital_dict = {row[1]: row[0] for row in hospitals}
-        st.session_state.hospital_dict = hospital_dict
-        st.session_state.hospital_selected = True
-    else:
-        st.info("No hospitals found in our system. Please use the search function to find hospitals.")
+            # Store hospitals in session state for selection
+            hospital_dict = {row[1]: row[0] for row in hospitals}
+            st.session_state.hospital_dict = hospital_dict
+            st.session_state.hospital_selected = True
+        elif query.strip():
+            st.info(f"No hospitals match \"{query}\". Try fewer words or use the search function above.")
+        else:
+            st.info("No hospitals found in our system. Please use the search function to find hospitals.")
+    
+    # Nearest hospitals by coordinates
+    st.subheader("Nearest Hospitals")
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        latitude = st.number_input("Latitude", min_value=-90.0, max_value=90.0, value=None, format="%.5f")
+    with col2:
+        longitude = st.number_input("Longitude", min_value=-180.0, max_value=180.0, value=None, format="%.5f")
+    with col3:
+        radius = st.number_input("Within (km, 0 for any distance)", min_value=0.0, value=0.0, step=5.0)
+    if st.button("Find Nearest"):
+        if latitude is None or longitude is None:
+            st.warning("Please enter both latitude and longitude.")
+        else:
+            with get_connection() as conn:
+                nearby = nearest_hospitals(conn.cursor(), latitude, longitude, radius_km=radius or None)
+            if nearby:
+                df = pd.DataFrame(nearby, columns=["Hospital ID", "Name", "Address", "Phone", "Distance (km)"])
+                st.dataframe(df.round({"Distance (km)": 1}))
+            else:
+                st.info("No hospitals with a known location" + (f" within {radius:g} km." if radius else "."))
     
-    conn.close()
 
 def record_health_data():
     st.subheader("Record Health Data")
     
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute("SELECT id FROM patients WHERE user_id = ?", (st.session_state.user['user_id'],))
-    patient_data = cursor.fetchone()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        patient_id = st.session_state.user.get('patient_id')
     
-    if patient_data:
-        patient_id = patient_data[0]
+        if patient_id:
         
-        with st.form("health_record_form"):
-            record_type = st.selectbox("Record Type", [
-                "Blood Pressure", "Heart Rate", "Blood Sugar", 
-                "Weight", "Temperature", "Exercise", "Medication"
-            ])
+            with st.form("health_record_form"):
+                record_type = st.selectbox("Record Type", RECORD_TYPES)
             
-            if record_type == "Blood Pressure":
-                systolic = st.number_input("Systolic (mm Hg)", min_value=70, max_value=220)
-                diastolic = st.number_input("Diastolic (mm Hg)", min_value=40, max_value=180)
-                value = f"{systolic}/{diastolic}"
-            elif record_type == "Heart Rate":
-                value = st.number_input("Beats Per Minute", min_value=30, max_value=220)
-            elif record_type == "Blood Sugar":
-                value = st.number_input("Blood Sugar (mg/dL)", min_value=20, max_value=600)
-            elif record_type == "Weight":
-                value = st.number_input("Weight (kg)", min_value=1.0, max_value=300.0, step=0.1)
-            elif record_type == "Temperature":
-                value = st.number_input("Temperature (°C)", min_value=35.0, max_value=42.0, step=0.1)
-            elif record_type == "Exercise":
-                activity = st.text_input("Activity Type")
-                duration = st.number_input("Duration (minutes)", min_value=1, max_value=600)
-                value = f"{activity}: {duration} minutes"
-            elif record_type == "Medication":
-                med_name = st.text_input("Medication Name")
-                med_dose = st.text_input("Dosage")
-                value = f"{med_name}: {med_dose}"
+                if record_type == "Blood Pressure":
+                    systolic = st.number_input("Systolic (mm Hg)", min_value=70, max_value=220)
+                    diastolic = st.number_input("Diastolic (mm Hg)", min_value=40, max_value=180)
+                    value = f"{systolic}/{diastolic}"
+                    fields = {"numeric_value": systolic, "secondary_value": diastolic}
+                elif record_type == "Heart Rate":
+                    value = st.number_input("Beats Per Minute", min_value=30, max_value=220)
+                    fields = {"numeric_value": value}
+                elif record_type == "Blood Sugar":
+                    value = st.number_input("Blood Sugar (mg/dL)", min_value=20, max_value=600)
+                    fields = {"numeric_value": value}
+                elif record_type == "Weight":
+                    value = st.number_input("Weight (kg)", min_value=1.0, max_value=300.0, step=0.1)
+                    fields = {"numeric_value": value}
+                elif record_type == "Temperature":
+                    value = st.number_input("Temperature (°C)", min_value=35.0, max_value=42.0, step=0.1)
+                    fields = {"numeric_value": value}
+                elif record_type == "Exercise":
+                    activity = st.text_input("Activity Type")
+                    duration = st.number_input("Duration (minutes)", min_value=1, max_value=600)
+                    value = f"{activity}: {duration} minutes"
+                    fields = {"numeric_value": duration, "label": activity}
+                elif record_type == "Medication":
+                    med_name = st.text_input("Medication Name")
+                    med_dose = st.text_input("Dosage")
+                    value = f"{med_name}: {med_dose}"
+                    fields = {"label": med_name, "dosage": med_dose}
             
-            notes = st.text_area("Notes", height=100)
-            record_date = st.date_input("Date")
-            record_time = st.time_input("Time")
+                notes = st.text_area("Notes", height=100)
+                record_date = st.date_input("Date")
+                record_time = st.time_input("Time")
             
-            submit_button = st.form_submit_button("Save Record")
+                submit_button = st.form_submit_button("Save Record")
             
-            if submit_button:
-                record_id = f"REC_{uuid.uuid4().hex[:6]}"
-                record_datetime = datetime.combine(record_date, record_time).isoformat()
+                if submit_button:
+                    record_id = f"REC_{uuid.uuid4().hex[:6]}"
+                    record_datetime = datetime.combine(record_date, record_time).isoformat()
                 
+                    try:
+                        cursor.execute(INSERT_HEALTH_RECORD_SQL,
+                                      (record_id, patient_id, record_datetime, record_type, str(value), notes,
+                                       fields.get("numeric_value"), fields.get("secondary_value"),
+                                       HEALTH_UNITS.get(record_type), fields.get("label"), fields.get("dosage")))
+                        update_rollups(cursor, [(patient_id, record_type, record_datetime,
+                                                 fields.get("numeric_value"), fields.get("secondary_value"))])
+                        conn.commit()
+                        log_event("INFO", "health_record", f"{record_type} record {record_id} saved for {patient_id}")
+                        st.success("Health record saved successfully!")
+                    except Exception as e:
+                        log_event("ERROR", "error", f"Saving a {record_type} record for {patient_id} failed: {e}")
+                        st.error(f"Error saving record: {e}")
+        
+            st.subheader("Bulk Import")
+            st.caption("Import a CSV or JSON export from a watch or blood pressure cuff with record_date, "
+                       "record_type and value columns (notes optional). Values use the same forms as your "
+                       "history, e.g. 120/80, 72, Running: 30 minutes or Aspirin: 100mg.")
+            uploaded = st.file_uploader("Readings File", type=["csv", "json", "jsonl"])
+            if uploaded is not None and st.button("Import Records"):
                 try:
-                    cursor.execute("INSERT INTO health_records VALUES (?, ?, ?, ?, ?, ?)",
-                                  (record_id, patient_id, record_datetime, record_type, str(value), notes))
-                    conn.commit()
-                    st.success("Health record saved successfully!")
+                    with st.spinner("Importing..."):
+                        report = import_health_records(conn, patient_id, uploaded)
+                    log_event("INFO", "health_import",
+                              f"Imported {report['imported']} of {report['read']} rows from {uploaded.name} for "
+                              f"{patient_id} ({report['duplicates']} duplicates, {report['rejected']} rejected)")
+                    st.success(f"Imported {report['imported']:,} of {report['read']:,} rows in "
+                               f"{report['seconds']:.1f} s ({report['rows_per_second']:,.0f} rows/s); "
+                               f"{report['duplicates']:,} duplicates skipped, {report['rejected']:,} rejected.")
+                    if report["rejections"]:
+                        st.dataframe(pd.DataFrame(report["rejections"], columns=["Line", "Reason"]))
                 except Exception as e:
-                    st.error(f"Error saving record: {e}")
-    else:
-        st.warning("Patient profile not found. Please contact support.")
+                    log_event("ERROR", "error", f"Importing {uploaded.name} for {patient_id} failed: {e}")
+                    st.error(f"Error importing records: {e}")
+        else:
+            st.warning("Patient profile not found. Please contact support.")
     
-    conn.close()
 
 def view_health_history():
     st.subheader("Health History")
     
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute("SELECT id FROM patients WHERE user_id = ?", (st.session_state.user['user_id'],))
-    patient_data = cursor.fetchone()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        patient_id = st.session_state.user.get('patient_id')
     
-    if patient_data:
-        patient_id = patient_data[0]
+        if patient_id:
         
-        # Get all record types for filtering
-        cursor.execute("SELECT DISTINCT record_type FROM health_records WHERE patient_id = ?", (patient_id,))
-        record_types = [r[0] for r in cursor.fetchall()]
+            # Get all record types for filtering
+            record_types = [r[0] for r in cached_query(cursor, RECORD_TYPES_SQL, (patient_id,), ("patient", patient_id))]
         
-        if record_types:
-            selected_type = st.selectbox("Filter by Type", ["All Types"] + record_types)
+            if record_types:
+                selected_type = st.selectbox("Filter by Type", ["All Types"] + record_types)
             
-            if selected_type == "All Types":
-                cursor.execute("""
-                    SELECT record_date, record_type, value, notes 
-                    FROM health_records 
-                    WHERE patient_id = ? 
-                    ORDER BY record_date DESC
-                """, (patient_id,))
-            else:
-                cursor.execute("""
-                    SELECT record_date, record_type, value, notes 
-                    FROM health_records 
-                    WHERE patient_id = ? AND record_type = ? 
-                    ORDER BY record_date DESC
-                """, (patient_id, selected_type))
+                if selected_type == "All Types":
+                    page_sql, export_sql, params = HEALTH_HISTORY_PAGE_SQL, HEALTH_HISTORY_SQL, (patient_id,)
+                else:
+                    page_sql, export_sql, params = HEALTH_HISTORY_BY_TYPE_PAGE_SQL, HEALTH_HISTORY_BY_TYPE_SQL, (patient_id, selected_type)
             
-            records = cursor.fetchall()
+                df = paged_table("health_history", cursor, page_sql, params, ["record_date", "id"],
+                                 ["Date & Time", "Type", "Value", "Notes"])
             
-            if records:
-                df = pd.DataFrame(records, columns=["Date & Time", "Type", "Value", "Notes"])
-                st.dataframe(df)
-                
-                if st.button("Export Health Records to CSV"):
-                    df.to_csv("my_health_records.csv", index=False)
-                    st.download_button(
-                        "Download Health Records", 
-                        data=open("my_health_records.csv", "rb"), 
-                        file_name="my_health_records.csv"
-                    )
+                if not df.empty:
+                    if st.button("Export Health Records to CSV"):
+                        st.download_button(
+                            "Download Health Records", 
+                            data=query_csv(export_sql, params, ["Date & Time", "Type", "Value", "Notes"]), 
+                            file_name="my_health_records.csv",
+                            mime="text/csv"
+                        )
                 
-                # Display chart for numeric data
-                if selected_type in ["Heart Rate", "Blood Sugar", "Weight", "Temperature"]:
-                    # Convert to numeric values
-                    numeric_values = []
-                    dates = []
-                    
-                    for record in records:
-                        try:
-                            date = datetime.fromisoformat(record[0]).strftime('%Y-%m-%d %H:%M')
-                            value = float(record[2])
-                            numeric_values.append(value)
-                            dates.append(date)
-                        except (ValueError, TypeError):
-                            pass
-                    
-                    if numeric_values:
-                        chart_data = pd.DataFrame({
-                            'Date': dates,
-                            'Value': numeric_values
-                        })
+                    # Statistics and chart for numeric data, from the typed columns
+                    if selected_type in HEALTH_UNITS:
+                        unit = HEALTH_UNITS[selected_type]
+                        count, minimum, maximum, average, secondary_average = cached_query(
+                            cursor, HEALTH_STATS_SQL, (patient_id, selected_type), ("patient", patient_id))[0]
                         
-                        st.line_chart(chart_data.set_index('Date'))
+                        if count:
+                            col1, col2, col3, col4 = st.columns(4)
+                            with col1:
+                                st.metric("Readings", count)
+                            with col2:
+                                # Legacy free-text readings may have no parsed diastolic value
+                                if selected_type == "Blood Pressure" and secondary_average is not None:
+                                    st.metric("Average", f"{average:.0f}/{secondary_average:.0f} {unit}")
+                                elif selected_type == "Blood Pressure":
+                                    st.metric("Average", f"{average:.0f} {unit}")
+                                else:
+                                    st.metric("Average", f"{average:.1f} {unit}")
+                            with col3:
+                                st.metric("Lowest", f"{minimum:g} {unit}")
+                            with col4:
+                                st.metric("Highest", f"{maximum:g} {unit}")
+                            
+                            # Short histories chart every reading; longer ones default to the
+                            # finest rollup period that fits the point budget
+                            resolution = "Every reading"
+                            if count > CHART_POINT_BUDGET:
+                                resolution = "Monthly"
+                                for period, label in [("day", "Daily"), ("week", "Weekly")]:
+                                    cursor.execute(HEALTH_ROLLUP_COUNT_SQL, (patient_id, selected_type, period))
+                                    if cursor.fetchone()[0] <= CHART_POINT_BUDGET:
+                                        resolution = label
+                                        break
+                                resolutions = ["Every reading", "Daily", "Weekly", "Monthly"]
+                                resolution = st.selectbox("Chart resolution", resolutions,
+                                                          index=resolutions.index(resolution))
+                            
+                            if resolution == "Every reading":
+                                cursor.execute(HEALTH_SERIES_SQL, (patient_id, selected_type))
+                                series = cursor.fetchall()
+                                columns = ["Systolic", "Diastolic"] if selected_type == "Blood Pressure" else ["Value"]
+                                budget = CHART_POINT_BUDGET
+                                if count > CHART_POINT_BUDGET:
+                                    budget = st.select_slider("Chart detail (points)", [250, 500, 1000, 2000, 5000],
+                                                              value=CHART_POINT_BUDGET)
+                                chart_data = prepare_chart_data(series, columns, budget)
+                                
+                                st.line_chart(chart_data)
+                                if len(chart_data) < count:
+                                    st.caption(f"Showing {len(chart_data)} of {count} readings; peaks and dips are preserved.")
+                            else:
+                                period = {"Daily": "day", "Weekly": "week", "Monthly": "month"}[resolution]
+                                cursor.execute(HEALTH_ROLLUP_SERIES_SQL, (patient_id, selected_type, period))
+                                rollups = pd.DataFrame(cursor.fetchall(),
+                                                       columns=["Date", "Average", "Diastolic", "Lowest", "Highest"])
+                                rollups["Date"] = pd.to_datetime(rollups["Date"])
+                                if selected_type == "Blood Pressure":
+                                    rollups = rollups.rename(columns={"Average": "Systolic"})[["Date", "Systolic", "Diastolic"]]
+                                else:
+                                    rollups = rollups[["Date", "Average", "Lowest", "Highest"]]
+                                
+                                st.line_chart(rollups.set_index("Date"))
+                                st.caption(f"{resolution} averages over {count} readings.")
+                else:
+                    st.info(f"No records found for {selected_type}")
             else:
-                st.info(f"No records found for {selected_type}")
+                st.info("No health records found. Start tracking your health data now!")
         else:
-            st.info("No health records found. Start tracking your health data now!")
-    else:
-        st.warning("Patient profile not found. Please contact support.")
+            st.warning("Patient profile not found. Please contact support.")
     
-    conn.close()
 
-def patient_dashboard():
+def patient_dashboard(view):
     st.markdown(f'<h2 style="color:#28A745">Patient Dashboard</h2>', unsafe_allow_html=True)
     
-    # Create tabs for different patient functions
-    tabs = st.tabs(["Book Appointments", "My Appointments", "Health Records", "Track Health", "Find Hospitals"])
-    
-    with tabs[0]:  # Book Appointments
+    if view == "Book Appointments":
         st.subheader("Book New Appointment")
         
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        cursor.execute("SELECT id FROM patients WHERE user_id = ?", (st.session_state.user['user_id'],))
-        patient_data = cursor.fetchone()
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            patient_id = st.session_state.user.get('patient_id')
         
-        if patient_data:
-            patient_id = patient_data[0]
+            if patient_id:
             
-            if "hospital_selected" not in st.session_state:
-                st.session_state.hospital_selected = False
+                if "hospital_selected" not in st.session_state:
+                    st.session_state.hospital_selected = False
             
-            if not st.session_state.hospital_selected:
-                if st.button("Find Hospitals"):
-                    st.session_state.hospital_selected = True
-                    st.rerun()
-            else:
-                cursor.execute("SELECT id, name FROM hospitals")
-                hospitals = cursor.fetchall()
-                hospital_dict = {name: id_ for id_, name in hospitals}
+                if not st.session_state.hospital_selected:
+                    if st.button("Find Hospitals"):
+                        st.session_state.hospital_selected = True
+                        st.rerun()
+                else:
+                    hospitals = cached_query(cursor, HOSPITAL_CHOICES_SQL, scope="hospitals")
+                    if not hospitals:
+                        st.info("No hospitals are registered yet")
+                    else:
+                        hospital_dict = {name: id_ for id_, name in hospitals}
                 
-                with st.form("book_appointment"):
-                    hospital_choice = st.selectbox("Choose Hospital", list(hospital_dict.keys()))
-                    appointment_date = st.date_input("Appointment Date", min_value=datetime.now().date())
-                    appointment_time = st.time_input("Appointment Time")
-                    reason = st.text_area("Reason for Visit")
-                    doctor_preference = st.text_input("Preferred Doctor (optional)")
-                    
-                    submit_button = st.form_submit_button("Book Appointment")
-                    
-                    if submit_button:
-                        if reason:
-                            appt_datetime = datetime.combine(appointment_date, appointment_time).isoformat()
-                            appt_id = f"APT_{uuid.uuid4().hex[:6]}"
-                            
-                            try:
-                                cursor.execute("INSERT INTO appointments VALUES (?, ?, ?, ?, ?, ?)",
-                                              (appt_id, patient_id, hospital_dict[hospital_choice], 
-                                               appt_datetime, f"{reason} (Doctor: {doctor_preference})", "Scheduled"))
-                                conn.commit()
-                                st.success("Appointment booked successfully!")
-                            except Exception as e:
-                                st.error(f"Error booking appointment: {e}")
+                        # Hospital and date sit outside the form so the free slots follow them
+                        hospital_choice = st.selectbox("Choose Hospital", list(hospital_dict.keys()))
+                        appointment_date = st.date_input("Appointment Date", min_value=datetime.now().date())
+                        hospital_id = hospital_dict[hospital_choice]
+                        open_slots = [slot for slot in available_slots(cursor, hospital_id, appointment_date)
+                                      if slot[1] > 0]
+                
+                        if not open_slots:
+                            st.info(f"{hospital_choice} has no free appointment slots on {appointment_date:%A, %B %d}. "
+                                    "Please choose another date.")
                         else:
-                            st.warning("Please provide a reason for your visit.")
-        else:
-            st.warning("Patient profile not found. Please contact support.")
+                            with st.form("book_appointment"):
+                                slot_choice = st.selectbox(
+                                    "Appointment Time", open_slots,
+                                    format_func=lambda slot: f"{slot[0][11:16]} ({slot[1]} left)")
+                                reason = st.text_area("Reason for Visit")
+                                doctor_preference = st.text_input("Preferred Doctor (optional)")
+                        
+                                submit_button = st.form_submit_button("Book Appointment")
+                        
+                                if submit_button:
+                                    if reason:
+                                        try:
+                                            appt_id = book_appointment(conn, patient_id, hospital_id, slot_choice[0],
+                                                                       f"{reason} (Doctor: {doctor_preference})")
+                                            if appt_id:
+                                                log_event("INFO", "booking", f"Appointment {appt_id} booked at "
+                                                          f"{hospital_id} for {slot_choice[0]}")
+                                                st.success("Appointment booked successfully!")
+                                            else:
+                                                log_event("WARNING", "booking_full", f"Slot {slot_choice[0]} at "
+                                                          f"{hospital_id} filled before booking")
+                                                st.warning("That time was just taken. Please choose another slot.")
+                                        except Exception as e:
+                                            log_event("ERROR", "error", f"Booking at {hospital_id} failed: {e}")
+                                            st.error(f"Error booking appointment: {e}")
+                                    else:
+                                        st.warning("Please provide a reason for your visit.")
+            else:
+                st.warning("Patient profile not found. Please contact support.")
         
-        conn.close()
     
-    with tabs[1]:  # My Appointments
+    elif view == "My Appointments":
         st.subheader("My Appointments")
         
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        cursor.execute("SELECT id FROM patients WHERE user_id = ?", (st.session_state.user['user_id'],))
-        patient_data = cursor.fetchone()
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            patient_id = st.session_state.user.get('patient_id')
         
-        if patient_data:
-            patient_id = patient_data[0]
-            
-            cursor.execute("""
-                SELECT a.id, h.name, a.appointment_date, a.reason, a.status 
-                FROM appointments a 
-                JOIN hospitals h ON a.hospital_id = h.id 
-                WHERE a.patient_id = ? 
-                ORDER BY a.appointment_date DESC
-            """, (patient_id,))
+            if patient_id:
             
-            appointments = cursor.fetchall()
+                appointments = cached_query(cursor, PATIENT_APPOINTMENTS_SQL, (patient_id,), ("patient", patient_id))
             
-            if appointments:
-                df = pd.DataFrame(appointments, columns=["Appointment ID", "Hospital", "Date & Time", "Reason", "Status"])
-                st.dataframe(df)
+                if appointments:
+                    df = pd.DataFrame(appointments, columns=["Appointment ID", "Hospital", "Date & Time", "Reason", "Status"])
+                    st.dataframe(df)
                 
-                if st.button("Export My Appointments to CSV"):
-                    df.to_csv("my_appointments.csv", index=False)
-                    st.download_button(
-                        "Download My Appointments", 
-                        data=open("my_appointments.csv", "rb"), 
-                        file_name="my_appointments.csv"
-                    )
+                    if st.button("Export My Appointments to CSV"):
+                        st.download_button(
+                            "Download My Appointments", 
+                            data=query_csv(PATIENT_APPOINTMENTS_SQL, (patient_id,), list(df.columns)), 
+                            file_name="my_appointments.csv",
+                            mime="text/csv"
+                        )
                 
-                selected_apt = st.selectbox("Select Appointment", df["Appointment ID"], key="cancel_apt")
-                if st.button("Cancel Appointment"):
-                    try:
-                        cursor.execute("UPDATE appointments SET status = 'Cancelled' WHERE id = ?", (selected_apt,))
-                        conn.commit()
-                        st.success("Appointment cancelled successfully.")
-                        st.rerun()
-                    except Exception as e:
-                        st.error(f"Error cancelling appointment: {e}")
+                    selected_apt = st.selectbox("Select Appointment", df["Appointment ID"], key="cancel_apt")
+                    if st.button("Cancel Appointment"):
+                        try:
+                            cursor.execute("UPDATE appointments SET status = 'Cancelled' WHERE id = ?", (selected_apt,))
+                            conn.commit()
+                            log_event("INFO", "cancellation", f"Appointment {selected_apt} cancelled by patient")
+                            st.success("Appointment cancelled successfully.")
+                            st.rerun()
+                        except Exception as e:
+                            log_event("ERROR", "error", f"Cancelling appointment {selected_apt} failed: {e}")
+                            st.error(f"Error cancelling appointment: {e}")
+                else:
+                    st.info("No appointments found. Book your first appointment now!")
             else:
-                st.info("No appointments found. Book your first appointment now!")
-        else:
-            st.warning("Patient profile not found. Please contact support.")
+                st.warning("Patient profile not found. Please contact support.")
         
-        conn.close()
     
-    with tabs[2]:  # Health Records
+    elif view == "Health Records":
         view_health_history()
     
-    with tabs[3]:  # Track Health
+    elif view == "Track Health":
         record_health_data()
     
-    with tabs[4]:  # Find Hospitals
+    elif view == "Find Hospitals":
         search_hospital()
 
-def hospital_dashboard():
+def hospital_dashboard(view):
     st.markdown(f'<h2 style="color:#28A745">Hospital Dashboard</h2>', unsafe_allow_html=True)
     
-    # Create tabs for different hospital functions
-    tabs = st.tabs(["Upcoming Appointments", "Appointment History", "Patient Records", "Hospital Profile"])
-    
-    with tabs[0]:  # Upcoming Appointments
+    if view == "Upcoming Appointments":
         st.subheader("Upcoming Appointments")
         
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        cursor.execute("SELECT id FROM hospitals WHERE user_id = ?", (st.session_state.user['user_id'],))
-        hospital_data = cursor.fetchone()
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            hospital_id = st.session_state.user.get('hospital_id')
         
-        if hospital_data:
-            hospital_id = hospital_data[0]
+            if hospital_id:
             
-            cursor.execute("""
-                SELECT a.id, u.name, a.appointment_date, a.reason, a.status 
-                FROM appointments a 
-                JOIN patients p ON a.patient_id = p.id 
-                JOIN users u ON p.user_id = u.id 
-                WHERE a.hospital_id = ? AND a.status = 'Scheduled' AND a.appointment_date >= ? 
-                ORDER BY a.appointment_date ASC
-            """, (hospital_id, datetime.now().isoformat()))
+                cursor.execute(UPCOMING_APPOINTMENTS_SQL, (hospital_id, datetime.now().isoformat()))
             
-            upcoming = cursor.fetchall()
+                upcoming = cursor.fetchall()
             
-            if upcoming:
-                df = pd.DataFrame(upcoming, columns=["Appointment ID", "Patient Name", "Date & Time", "Reason", "Status"])
-                st.dataframe(df)
+                if upcoming:
+                    df = pd.DataFrame(upcoming, columns=["Appointment ID", "Patient Name", "Date & Time", "Reason", "Status"])
+                    st.dataframe(df)
                 
-                selected_apt = st.selectbox("Select Appointment to Update", df["Appointment ID"])
-                new_status = st.selectbox("Update Status", ["Scheduled", "Completed", "Cancelled", "No Show"])
+                    selected_apt = st.selectbox("Select Appointment to Update", df["Appointment ID"])
+                    new_status = st.selectbox("Update Status", ["Scheduled", "Completed", "Cancelled", "No Show"])
                 
-                if st.button("Update Status"):
-                    try:
-                        cursor.execute("UPDATE appointments SET status = ? WHERE id = ?", (new_status, selected_apt))
-                        conn.commit()
-                        st.success("Appointment status updated successfully.")
-                        st.rerun()
-                    except Exception as e:
-                        st.error(f"Error updating appointment: {e}")
+                    if st.button("Update Status"):
+                        try:
+                            cursor.execute("UPDATE appointments SET status = ? WHERE id = ?", (new_status, selected_apt))
+                            conn.commit()
+                            log_event("INFO", "appointment_status", f"Appointment {selected_apt} marked {new_status}")
+                            st.success("Appointment status updated successfully.")
+                            st.rerun()
+                        except Exception as e:
+                            log_event("ERROR", "error", f"Updating appointment {selected_apt} failed: {e}")
+                            st.error(f"Error updating appointment: {e}")
+                else:
+                    st.info("No upcoming appointments found.")
             else:
-                st.info("No upcoming appointments found.")
-        else:
-            st.warning("Hospital profile not found. Please contact support.")
+                st.warning("Hospital profile not found. Please contact support.")
         
-        conn.close()
     
-    with tabs[1]:  # Appointment History
+    elif view == "Appointment History":
         st.subheader("Appointment History")
         
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        cursor.execute("SELECT id FROM hospitals WHERE user_id = ?", (st.session_state.user['user_id'],))
-        hospital_data = cursor.fetchone()
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            hospital_id = st.session_state.user.get('hospital_id')
         
-        if hospital_data:
-            hospital_id = hospital_data[0]
+            if hospital_id:
             
-            # Get all appointment statuses for filtering
-            cursor.execute("SELECT DISTINCT status FROM appointments WHERE hospital_id = ?", (hospital_id,))
-            statuses = [s[0] for s in cursor.fetchall()]
+                # Get all appointment statuses for filtering
+                statuses = [s[0] for s in cached_query(cursor, HOSPITAL_STATUSES_SQL, (hospital_id,), ("hospital", hospital_id))]
             
-            if statuses:
-                selected_status = st.selectbox("Filter by Status", ["All"] + statuses)
+                if statuses:
+                    selected_status = st.selectbox("Filter by Status", ["All"] + statuses)
                 
-                if selected_status == "All":
-                    cursor.execute("""
-                        SELECT a.id, u.name, a.appointment_date, a.reason, a.status 
-                        FROM appointments a 
-                        JOIN patients p ON a.patient_id = p.id 
-                        JOIN users u ON p.user_id = u.id 
-                        WHERE a.hospital_id = ? 
-                        ORDER BY a.appointment_date DESC
-                    """, (hospital_id,))
-                else:
-                    cursor.execute("""
-                        SELECT a.id, u.name, a.appointment_date, a.reason, a.status 
-                        FROM appointments a 
-                        JOIN patients p ON a.patient_id = p.id 
-                        JOIN users u ON p.user_id = u.id 
-                        WHERE a.hospital_id = ? AND a.status = ? 
-                        ORDER BY a.appointment_date DESC
-                    """, (hospital_id, selected_status))
+                    columns = ["Appointment ID", "Patient Name", "Date & Time", "Reason", "Status"]
+                    if selected_status == "All":
+                        page_sql, export_sql, params = APPOINTMENT_HISTORY_PAGE_SQL, APPOINTMENT_HISTORY_SQL, (hospital_id,)
+                    else:
+                        page_sql, export_sql, params = APPOINTMENT_HISTORY_BY_STATUS_PAGE_SQL, APPOINTMENT_HISTORY_BY_STATUS_SQL, (hospital_id, selected_status)
                 
-                appointments = cursor.fetchall()
+                    df = paged_table("appointment_history", cursor, page_sql, params,
+                                     ["a.appointment_date", "a.id"], columns)
                 
-                if appointments:
-                    df = pd.DataFrame(appointments, columns=["Appointment ID", "Patient Name", "Date & Time", "Reason", "Status"])
-                    st.dataframe(df)
-                    
-                    if st.button("Export Appointments to CSV"):
-                        df.to_csv("hospital_appointments.csv", index=False)
-                        st.download_button(
-                            "Download CSV", 
-                            data=open("hospital_appointments.csv", "rb"), 
-                            file_name="hospital_appointments.csv"
-                        )
+                    if not df.empty:
+                        if st.button("Export Appointments to CSV"):
+                            st.download_button(
+                                "Download CSV", 
+                                data=query_csv(export_sql, params, columns), 
+                                file_name="hospital_appointments.csv",
+                                mime="text/csv"
+                            )
+                    else:
+                        st.info(f"No appointments with status '{selected_status}' found.")
                 else:
-                    st.info(f"No appointments with status '{selected_status}' found.")
+                    st.info("No appointment history found.")
             else:
-                st.info("No appointment history found.")
-        else:
-            st.warning("Hospital profile not found. Please contact support.")
+                st.warning("Hospital profile not found. Please contact support.")
         
-        conn.close()
     
-    with tabs[2]:  # Patient Records
+    elif view == "Patient Records":
         st.subheader("Patient Records")
         st.info("This feature will allow you to view patient records for those who have appointments with your hospital.")
         
         # Demo functionality - in a real app, this would be connected to patient records
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        cursor.execute("SELECT id FROM hospitals WHERE user_id = ?", (st.session_state.user['user_id'],))
-        hospital_data = cursor.fetchone()
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            hospital_id = st.session_state.user.get('hospital_id')
         
-        if hospital_data:
-            hospital_id = hospital_data[0]
-            
-            cursor.execute("""
-                SELECT DISTINCT p.id, u.name 
-                FROM appointments a 
-                JOIN patients p ON a.patient_id = p.id 
-                JOIN users u ON p.user_id = u.id 
-                WHERE a.hospital_id = ?
-            """, (hospital_id,))
+            if hospital_id:
             
-            patients = cursor.fetchall()
+                patients = cached_query(cursor, HOSPITAL_PATIENTS_SQL, (hospital_id,), ("hospital", hospital_id))
             
-            if patients:
-                patient_dict = {name: id_ for id_, name in patients}
-                selected_patient = st.selectbox("Select Patient", list(patient_dict.keys()))
+                if patients:
+                    patient_dict = {name: id_ for id_, name in patients}
+                    selected_patient = st.selectbox("Select Patient", list(patient_dict.keys()))
                 
-                st.write("Patient records would be displayed here (demo functionality)")
+                    st.write("Patient records would be displayed here (demo functionality)")
+                else:
+                    st.info("No patients have appointments with your hospital yet.")
             else:
-                st.info("No patients have appointments with your hospital yet.")
-        else:
-            st.warning("Hospital profile not found. Please contact support.")
+                st.warning("Hospital profile not found. Please contact support.")
         
-        conn.close()
     
-    with tabs[3]:  # Hospital Profile
+    elif view == "Hospital Profile":
         st.subheader("Hospital Profile")
         
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT h.name, h.address, h.phone, u.email 
-            FROM hospitals h 
-            JOIN users u ON h.user_id = u.id 
-            WHERE h.user_id = ?
-        """, (st.session_state.user['user_id'],))
-        
-        profile = cursor.fetchone()
-        
-        if profile:
-            st.write(f"**Hospital Name:** {profile[0]}")
-            st.write(f"**Address:** {profile[1]}")
-            st.write(f"**Phone:** {profile[2]}")
-            st.write(f"**Email:** {profile[3]}")
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            profile = st.session_state.user.get('profile')
+        
+            if profile:
+                st.write(f"**Hospital Name:** {profile['name']}")
+                st.write(f"**Address:** {profile['address']}")
+                st.write(f"**Phone:** {profile['phone']}")
+                st.write(f"**Email:** {profile['email']}")
             
-            st.subheader("Update Hospital Information")
-            with st.form("update_hospital"):
-                new_address = st.text_area("Address", value=profile[1])
-                new_phone = st.text_input("Phone", value=profile[2])
-                new_email = st.text_input("Email", value=profile[3])
+                st.subheader("Update Hospital Information")
+                with st.form("update_hospital"):
+                    new_address = st.text_area("Address", value=profile['address'])
+                    new_phone = st.text_input("Phone", value=profile['phone'])
+                    new_email = st.text_input("Email", value=profile['email'])
                 
-                submit_button = st.form_submit_button("Update Profile")
+                    submit_button = st.form_submit_button("Update Profile")
                 
-                if submit_button:
-                    try:
-                        cursor.execute("UPDATE hospitals SET address = ?, phone = ? WHERE user_id = ?", 
-                                      (new_address, new_phone, st.session_state.user['user_id']))
-                        cursor.execute("UPDATE users SET email = ? WHERE id = ?", 
-                                      (new_email, st.session_state.user['user_id']))
-                        conn.commit()
-                        st.success("Hospital profile updated successfully!")
-                    except Exception as e:
-                        st.error(f"Error updating profile: {e}")
-        else:
-            st.warning("Hospital profile not found. Please contact support.")
+                    if submit_button:
+                        try:
+                            cursor.execute("UPDATE hospitals SET address = ?, phone = ? WHERE user_id = ?", 
+                                          (new_address, new_phone, st.session_state.user['user_id']))
+                            cursor.execute("UPDATE users SET email = ? WHERE id = ?", 
+                                          (new_email, st.session_state.user['user_id']))
+                            conn.commit()
+                            profile.update(address=new_address, phone=new_phone, email=new_email)
+                            log_event("INFO", "profile_update", f"Hospital profile updated: {profile['name']}")
+                            st.success("Hospital profile updated successfully!")
+                        except Exception as e:
+                            log_event("ERROR", "error", f"Updating hospital profile failed: {e}")
+                            st.error(f"Error updating profile: {e}")
+            
+                st.subheader("Appointment Slots")
+                hospital_id = st.session_state.user['hospital_id']
+                schedule = cached_query(cursor, HOSPITAL_SCHEDULE_SQL, (hospital_id,), ("hospital", hospital_id))
+                _, open_time, close_time, slot_minutes, capacity = schedule[0] if schedule else DEFAULT_SCHEDULE[0]
+                with st.form("hospital_schedule"):
+                    open_days = st.multiselect("Open Days", WEEKDAYS, default=[WEEKDAYS[row[0]] for row in schedule])
+                    new_open = st.time_input("Opens At", value=datetime.strptime(open_time, "%H:%M").time())
+                    new_close = st.time_input("Closes At", value=datetime.strptime(close_time, "%H:%M").time())
+                    new_minutes = st.number_input("Slot Length (minutes)", min_value=5, max_value=240,
+                                                  value=slot_minutes, step=5)
+                    new_capacity = st.number_input("Patients per Slot", min_value=1, max_value=50, value=capacity)
+                
+                    if st.form_submit_button("Update Slots"):
+                        if new_open >= new_close:
+                            st.warning("Opening time must be before closing time.")
+                        else:
+                            try:
+                                insert_schedule(cursor, hospital_id, [
+                                    (WEEKDAYS.index(day), f"{new_open:%H:%M}", f"{new_close:%H:%M}",
+                                     int(new_minutes), int(new_capacity))
+                                    for day in open_days])
+                                conn.commit()
+                                log_event("INFO", "schedule_update", f"Appointment slots updated for {hospital_id}")
+                                st.success("Appointment slots updated successfully!")
+                            except Exception as e:
+                                log_event("ERROR", "error", f"Updating slots for {hospital_id} failed: {e}")
+                                st.error(f"Error updating slots: {e}")
+            else:
+                st.warning("Hospital profile not found. Please contact support.")
         
-        conn.close()
 
-def admin_dashboard():
+# Admin statistics are shared by every admin session and refreshed at most once
+# per SYSTEM_STATS_TTL seconds: one counter read plus the 10-row recent activity.
+SYSTEM_STATS_TTL = 60
+
+@st.cache_data(ttl=SYSTEM_STATS_TTL, show_spinner=False)
+def load_system_stats(db_file):
+    with get_connection(db_file) as conn:
+        cursor = conn.cursor()
+        cursor.execute(SYSTEM_COUNTERS_SQL)
+        counters = dict(cursor.fetchall())
+        cursor.execute(RECENT_ACTIVITY_SQL)
+        recent_activity = cursor.fetchall()
+    statuses = sorted((name[len("status:"):], value) for name, value in counters.items()
+                      if name.startswith("status:") and value)
+    return {
+        "patients": counters.get("role:patient", 0),
+        "hospitals": counters.get("role:hospital", 0),
+        "appointments": counters.get("appointments", 0),
+        "completed": counters.get("status:Completed", 0),
+        "statuses": statuses,
+        "recent_activity": recent_activity,
+        "loaded_at": datetime.now().isoformat(),
+    }
+
+def admin_dashboard(view):
     st.markdown(f'<h2 style="color:#28A745">Admin Dashboard</h2>', unsafe_allow_html=True)
     
-    # Create tabs for different admin functions
-    tabs = st.tabs(["System Statistics", "User Management", "Hospital Approvals", "System Logs"])
-    
-    with tabs[0]:  # System Statistics
+    if view == "System Statistics":
         st.subheader("System Statistics")
         
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        
-        # Get counts for dashboard
-        cursor.execute("SELECT COUNT(*) FROM users WHERE role='patient'")
-        patient_count = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT COUNT(*) FROM users WHERE role='hospital'")
-        hospital_count = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT COUNT(*) FROM appointments")
-        appointment_count = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT COUNT(*) FROM appointments WHERE status='Completed'")
-        completed_count = cursor.fetchone()[0]
+        if st.button("Refresh Statistics"):
+            load_system_stats.clear()
+        stats = load_system_stats(DB_FILE)
         
         # Display statistics in a nice format
         col1, col2, col3, col4 = st.columns(4)
         with col1:
-            st.metric("Registered Patients", patient_count)
+            st.metric("Registered Patients", stats["patients"])
         with col2:
-            st.metric("Registered Hospitals", hospital_count)
+            st.metric("Registered Hospitals", stats["hospitals"])
         with col3:
-            st.metric("Total Appointments", appointment_count)
+            st.metric("Total Appointments", stats["appointments"])
         with col4:
-            st.metric("Completed Appointments", completed_count)
+            st.metric("Completed Appointments", stats["completed"])
+        st.caption(f"As of {stats['loaded_at'][11:19]}; refreshed at most every {SYSTEM_STATS_TTL} s.")
         
         # Chart for appointments by status
-        cursor.execute("SELECT status, COUNT(*) FROM appointments GROUP BY status")
-        status_data = cursor.fetchall()
-        if status_data:
-            status_df = pd.DataFrame(status_data, columns=["Status", "Count"])
+        if stats["statuses"]:
+            status_df = pd.DataFrame(stats["statuses"], columns=["Status", "Count"])
             st.subheader("Appointments by Status")
             st.bar_chart(status_df.set_index("Status"))
         
         # Recent activity
         st.subheader("Recent Activity")
-        cursor.execute("""
-            SELECT u.name, a.appointment_date, h.name, a.status 
-            FROM appointments a 
-            JOIN patients p ON a.patient_id = p.id 
-            JOIN users u ON p.user_id = u.id 
-            JOIN hospitals h ON a.hospital_id = h.id 
-            ORDER BY a.appointment_date DESC 
-            LIMIT 10
-        """)
-        recent_activity = cursor.fetchall()
-        if recent_activity:
-            activity_df = pd.DataFrame(recent_activity, columns=["Patient", "Date", "Hospital", "Status"])
+        if stats["recent_activity"]:
+            activity_df = pd.DataFrame(stats["recent_activity"], columns=["Patient", "Date", "Hospital", "Status"])
             st.dataframe(activity_df)
         else:
             st.info("No recent activity found.")
+
+        # Connection pool usage
+        pool_stats = get_connection_pool(DB_FILE).stats()
+        cache_stats = get_query_cache(DB_FILE).stats()
+        login_stats = get_password_verifier().stats()
+        st.subheader("Database Connections")
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            st.metric("Connections Opened", pool_stats["opened"])
+        with col2:
+            st.metric("Connections Reused", pool_stats["reused"])
+        with col3:
+            st.metric("Idle Connections", pool_stats["idle"])
+        with col4:
+            st.metric("In Use", pool_stats["in_use"])
         
-        conn.close()
-    
-    with tabs[1]:  # User Management
+        st.subheader("Query Cache")
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            st.metric("Hit Rate", f"{cache_stats['hit_rate']:.0%}")
+        with col2:
+            st.metric("Hits", cache_stats["hits"])
+        with col3:
+            st.metric("Misses", cache_stats["misses"])
+        with col4:
+            st.metric("Evictions", cache_stats["evictions"])
+        st.caption(f"{cache_stats['entries']} of {cache_stats['max_entries']} entries cached; "
+                   f"{cache_stats['invalidations']} invalidations.")
+        st.caption(f"Password checks: {login_stats['derivations']} key derivations, "
+                   f"{login_stats['cache_hits']} cached, {login_stats['rehashes']} hashes upgraded.")
+        
+        bootstrap = bootstrap_database(DB_FILE)
+        last_rerun = st.session_state.get("last_rerun_seconds")
+        last_sql = st.session_state.get("last_rerun_sql")
+        st.caption(
+            f"Schema version {bootstrap['version']}, bootstrapped in {bootstrap['seconds'] * 1000:.1f} ms "
+            f"at {bootstrap['initialized_at'][:19]}"
+            + (f"; previous rerun took {last_rerun * 1000:.1f} ms" if last_rerun is not None else "")
+            + (f", {last_sql['statements']} SQL statements and {last_sql['db_seconds'] * 1000:.1f} ms in the database"
+               if last_sql else "")
+        )
+        
+        # SQL tracing
+        st.subheader("SQL Tracing")
+        tracer = get_sql_tracer()
+        tracer.enabled = st.toggle("Trace SQL statements", value=tracer.enabled,
+                                   help="Counts and times every statement until switched off; adds a little overhead.")
+        if st.button("Reset Trace"):
+            tracer.reset()
+        page_stats = tracer.page_stats()
+        if page_stats:
+            st.write("Per page render (averages)")
+            st.dataframe(pd.DataFrame(page_stats).rename(columns={
+                "page": "Page", "renders": "Renders", "statements": "Statements", "queries": "Queries",
+                "db_ms": "DB ms", "max_db_ms": "Max DB ms", "rerun_ms": "Rerun ms",
+            }).round(1), hide_index=True)
+            st.write("Top statements by total time")
+            st.dataframe(pd.DataFrame(tracer.top_statements()).rename(columns={
+                "sql": "Statement", "calls": "Calls", "total_ms": "Total ms", "mean_ms": "Mean ms",
+                "max_ms": "Max ms", "params": "Parameters",
+            }).round(2), hide_index=True)
+            slow = tracer.slow_queries()
+            st.write(f"Slow statements (at least {tracer.slow_ms} ms, latest first)")
+            if slow:
+                st.dataframe(pd.DataFrame(slow).rename(columns={
+                    "at": "Time", "ms": "ms", "sql": "Statement", "params": "Parameters",
+                }).round(1), hide_index=True)
+            else:
+                st.info("No slow statements recorded.")
+            if tracer.untracked:
+                st.caption(f"{tracer.untracked} executions of statements beyond the first "
+                           f"{SQL_TRACE_MAX_STATEMENTS} distinct ones were not aggregated.")
+        elif tracer.enabled:
+            st.info("Tracing is on; statistics appear after the next page render.")
+
+    elif view == "User Management":
         st.subheader("User Management")
         
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
+        with get_connection() as conn:
+            cursor = conn.cursor()
         
-        # User role filter
-        role_filter = st.selectbox("Filter by Role", ["All", "Patient", "Hospital", "Admin"])
+            # User role filter
+            role_filter = st.selectbox("Filter by Role", ["All", "Patient", "Hospital", "Admin"])
         
-        if role_filter == "All":
-            cursor.execute("""
-                SELECT id, username, role, name, email 
-                FROM users 
-                ORDER BY role, name
-            """)
-        else:
-            cursor.execute("""
-                SELECT id, username, role, name, email 
-                FROM users 
-                WHERE LOWER(role) = LOWER(?) 
-                ORDER BY name
-            """, (role_filter,))
-        
-        users = cursor.fetchall()
-        
-        if users:
-            user_df = pd.DataFrame(users, columns=["User ID", "Username", "Role", "Name", "Email"])
-            st.dataframe(user_df)
+            columns = ["User ID", "Username", "Role", "Name", "Email"]
+            if role_filter == "All":
+                user_df = paged_table("users", cursor, USERS_PAGE_SQL, (), ["role", "name", "id"],
+                                      columns, descending=False)
+            else:
+                user_df = paged_table("users", cursor, USERS_BY_ROLE_PAGE_SQL, (role_filter.lower(),), ["name", "id"],
+                                      columns, descending=False)
+        
+            if not user_df.empty:
             
-            # User actions
-            selected_user = st.selectbox("Select User for Action", user_df["Username"])
-            action = st.selectbox("Action", ["Reset Password", "Disable Account", "Delete Account"])
+                # User actions
+                selected_user = st.selectbox("Select User for Action", user_df["Username"])
+                action = st.selectbox("Action", ["Reset Password", "Disable Account", "Delete Account"])
             
-            if st.button("Execute Action"):
-                if action == "Reset Password":
-                    try:
-                        new_password = "password123"
-                        cursor.execute("UPDATE users SET password_hash = ? WHERE username = ?", 
-                                      (hash_password(new_password), selected_user))
-                        conn.commit()
-                        st.success(f"Password reset successfully for {selected_user}. New password: {new_password}")
-                    except Exception as e:
-                        st.error(f"Error resetting password: {e}")
-                elif action == "Disable Account":
-                    st.info("Account disable functionality would be implemented here.")
-                elif action == "Delete Account":
-                    try:
-                        cursor.execute("DELETE FROM users WHERE username = ?", (selected_user,))
-                        conn.commit()
-                        st.success(f"Account {selected_user} deleted successfully.")
-                        st.rerun()
-                    except Exception as e:
-                        st.error(f"Error deleting account: {e}")
-        else:
-            st.info("No users found with the selected role.")
+                if st.button("Execute Action"):
+                    if action == "Reset Password":
+                        try:
+                            new_password = "password123"
+                            cursor.execute("UPDATE users SET password_hash = ? WHERE username = ?", 
+                                          (hash_password(new_password), selected_user))
+                            conn.commit()
+                            log_event("WARNING", "password_reset", f"Password reset by admin: {selected_user}")
+                            st.success(f"Password reset successfully for {selected_user}. New password: {new_password}")
+                        except Exception as e:
+                            log_event("ERROR", "error", f"Resetting password for {selected_user} failed: {e}")
+                            st.error(f"Error resetting password: {e}")
+                    elif action == "Disable Account":
+                        st.info("Account disable functionality would be implemented here.")
+                    elif action == "Delete Account":
+                        try:
+                            cursor.execute("DELETE FROM users WHERE username = ?", (selected_user,))
+                            conn.commit()
+                            get_query_cache(DB_FILE).clear()
+                            log_event("WARNING", "account_deleted", f"Account deleted by admin: {selected_user}")
+                            st.success(f"Account {selected_user} deleted successfully.")
+                            st.rerun()
+                        except Exception as e:
+                            log_event("ERROR", "error", f"Deleting account {selected_user} failed: {e}")
+                            st.error(f"Error deleting account: {e}")
+            else:
+                st.info("No users found with the selected role.")
         
-        conn.close()
     
-    with tabs[2]:  # Hospital Approvals
+    elif view == "Hospital Approvals":
         st.subheader("Hospital Registration Approvals")
         st.info("In a production system, hospital registrations would require admin approval before activation.")
         
@@ -865,33 +2938,83 @@ def admin_dashboard():
             if submit_button:
                 st.success(f"Hospital {hospital_name} status updated to {hospital_status}")
     
-    with tabs[3]:  # System Logs
+    elif view == "System Logs":
         st.subheader("System Logs")
         
-        # Demo of system logs
-        log_entries = [
-            {"timestamp": "2025-04-26 09:15:23", "level": "INFO", "message": "User login: admin"},
-            {"timestamp": "2025-04-26 09:12:11", "level": "INFO", "message": "System backup completed"},
-            {"timestamp": "2025-04-26 08:45:02", "level": "WARNING", "message": "Failed login attempt: unknown_user"},
-            {"timestamp": "2025-04-26 08:30:15", "level": "INFO", "message": "New user registered: patient4321"},
-            {"timestamp": "2025-04-26 08:25:33", "level": "ERROR", "message": "Database connection timeout"},
-            {"timestamp": "2025-04-25 23:15:12", "level": "INFO", "message": "System maintenance started"},
-            {"timestamp": "2025-04-25 22:30:45", "level": "INFO", "message": "Daily report generated"},
-            {"timestamp": "2025-04-25 21:12:05", "level": "WARNING", "message": "Low disk space warning"},
-        ]
+        # Write out what is still buffered so the view includes events up to now
+        system_log = get_system_log(DB_FILE)
+        system_log.flush()
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            level_filter = st.selectbox("Level", ["All"] + LOG_LEVELS)
+        with col2:
+            today = datetime.now().date()
+            date_range = st.date_input("Date Range", value=(today - timedelta(days=7), today), max_value=today)
+        if len(date_range) == 2:
+            range_params = (date_range[0].isoformat(), (date_range[1] + timedelta(days=1)).isoformat())
+            if level_filter == "All":
+                page_sql, export_sql, params = SYSTEM_LOGS_PAGE_SQL, SYSTEM_LOGS_SQL, range_params
+            else:
+                page_sql, export_sql, params = (SYSTEM_LOGS_BY_LEVEL_PAGE_SQL, SYSTEM_LOGS_BY_LEVEL_SQL,
+                                                (level_filter, *range_params))
+            
+            columns = ["Timestamp", "Level", "Event", "Message", "User ID"]
+            with get_connection() as conn:
+                log_df = paged_table("system_logs", conn.cursor(), page_sql, params, ["logged_at", "id"], columns)
+            
+            if log_df.empty:
+                st.info("No log entries in the selected range.")
+            elif st.button("Export Logs"):
+                st.download_button(
+                    "Download System Logs", 
+                    data=query_csv(export_sql, params, columns), 
+                    file_name="system_logs.csv",
+                    mime="text/csv"
+                )
+        else:
+            st.info("Select the last day of the range.")
         
-        log_df = pd.DataFrame(log_entries)
-        st.dataframe(log_df)
+        log_stats = system_log.stats()
+        st.caption(f"{log_stats['written']:,} events written by this server, {log_stats['pending']} pending, "
+                   f"{log_stats['dropped']} dropped; flushed every {LOG_FLUSH_SECONDS:.0f} s or "
+                   f"{LOG_FLUSH_BATCH} events. {log_stats['failed_flushes']} failed flushes retried.")
+    
+    elif view == "Data Export":
+        st.subheader("Bulk Data Export")
+        st.write("Export all health records (partitioned by record type and month) and appointments "
+                 f"(partitioned by hospital) as Parquet datasets under `{EXPORT_DIR}` on the server.")
         
-        if st.button("Export Logs"):
-            log_df.to_csv("system_logs.csv", index=False)
-            st.download_button(
-                "Download System Logs", 
-                data=open("system_logs.csv", "rb"), 
-                file_name="system_logs.csv"
-            )
+        if st.button("Export Parquet Datasets"):
+            out_dir = os.path.join(EXPORT_DIR, datetime.now().strftime("%Y%m%d-%H%M%S"))
+            try:
+                with st.spinner("Exporting..."):
+                    start = time.perf_counter()
+                    written = export_columnar(out_dir)
+                    elapsed = time.perf_counter() - start
+                files_df = pd.DataFrame(written, columns=["Dataset", "File", "Rows"])
+                st.success(f"Wrote {files_df['Rows'].sum():,} rows in {len(files_df)} files to `{out_dir}` "
+                           f"in {elapsed:.1f} s.")
+                st.dataframe(files_df)
+            except Exception as e:
+                log_event("ERROR", "error", f"Parquet export to {out_dir} failed: {e}")
+                st.error(f"Error exporting data: {e}")
 
 # Main dashboard router
+# Only the view picked in the sidebar runs, so a rerun loads just the data on screen
+DASHBOARD_VIEWS = {
+    "patient": ["Book Appointments", "My Appointments", "Health Records", "Track Health", "Find Hospitals"],
+    "hospital": ["Upcoming Appointments", "Appointment History", "Patient Records", "Hospital Profile"],
+    "admin": ["System Statistics", "User Management", "Hospital Approvals", "System Logs", "Data Export"],
+}
+
+def current_page():
+    # The page this rerun renders, as named in the SQL trace
+    if not st.session_state.authenticated:
+        return "Login"
+    role = st.session_state.user['role']
+    return f"{role}: {st.session_state.get(f'{role}_view', DASHBOARD_VIEWS[role][0])}"
+
 def dashboard():
     # Add sidebar with user info and logout
     with st.sidebar:
@@ -900,39 +3023,25 @@ def dashboard():
         st.markdown(f"### Welcome, {st.session_state.user['name']}")
         st.write(f"Role: {st.session_state.user['role'].capitalize()}")
         
-        # Add navigation links based on role
+        # Add navigation based on role
         st.markdown("---")
-        st.markdown("### Navigation")
-        
         role = st.session_state.user['role']
-        if role == "patient":
-            st.markdown("- Book Appointments")
-            st.markdown("- View Health Records")
-            st.markdown("- Track Health Data")
-            st.markdown("- Find Hospitals")
-        elif role == "hospital":
-            st.markdown("- Manage Appointments")
-            st.markdown("- Update Hospital Profile")
-            st.markdown("- Patient Records")
-        elif role == "admin":
-            st.markdown("- System Statistics")
-            st.markdown("- User Management")
-            st.markdown("- Hospital Approvals")
+        view = st.radio("Navigation", DASHBOARD_VIEWS[role], key=f"{role}_view")
         
         st.markdown("---")
         if st.button("Logout"):
+            log_event("INFO", "logout", f"User logout: {st.session_state.user['name']}")
             st.session_state.authenticated = False
             st.session_state.user = None
             st.rerun()
     
     # Main content area
-    role = st.session_state.user['role']
     if role == "patient":
-        patient_dashboard()
+        patient_dashboard(view)
     elif role == "hospital":
-        hospital_dashboard()
+        hospital_dashboard(view)
     elif role == "admin":
-        admin_dashboard()
+        admin_dashboard(view)
 
 def main():
     st.markdown(
@@ -965,15 +3074,20 @@ def main():
         unsafe_allow_html=True,
     )
     
-    initialize_database()
-    
+    rerun_start = time.perf_counter()
     if 'authenticated' not in st.session_state:
         st.session_state.authenticated = False
     
-    if not st.session_state.authenticated:
-        login_page()
-    else:
-        dashboard()
+    with get_sql_tracer().rerun(current_page()) as sql_trace:
+        bootstrap_database(DB_FILE)
+        
+        if not st.session_state.authenticated:
+            login_page()
+        else:
+            dashboard()
+    
+    st.session_state.last_rerun_seconds = time.perf_counter() - rerun_start
+    st.session_state.last_rerun_sql = sql_trace
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,1077 @@
+"""Performance benchmarks for Track My Health.
+
+Run from the repository root, e.g.:
+
+    python benchmark.py bootstrap --repeat 200
+    python benchmark.py chart --sizes 1000,100000,1000000
+    python benchmark.py export --rows 500000
+    python benchmark.py login --repeat 50
+    python benchmark.py booking --bookers 64 --slots 8
+    python benchmark.py generate --db data/synthetic.db --patients 100000 --hospitals 1000
+    python benchmark.py queries --patients 1000,10000,100000 --json report.json --compare baseline.json
+    python benchmark.py pages --patients 10000 --repeat 30
+    python benchmark.py trace --patients 10000
+    python benchmark.py log --events 100000
+    python benchmark.py search --hospitals 10000,100000
+    python benchmark.py nearest --hospitals 100000
+    python benchmark.py geocode --lookups 500 --delay-ms 200
+    python benchmark.py nominatim --sessions 16 --rate 20
+    python benchmark.py dashboard --years 1,3,5,10
+"""
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+import Trackmyhealth as app
+import manage
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def summarize(samples):
+    ordered = sorted(samples)
+
+    def pct(p):
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+    return {
+        "n": len(ordered),
+        "mean": statistics.fmean(ordered),
+        "p50": pct(50),
+        "p95": pct(95),
+        "p99": pct(99),
+        "max": ordered[-1],
+    }
+
+
+def print_table(title, rows):
+    print(title)
+    print(f"  {'case':<40} {'n':>6} {'mean ms':>10} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10}")
+    for name, stats in rows:
+        print(f"  {name:<40} {stats['n']:>6} {stats['mean']:>10.3f} {stats['p50']:>10.3f} "
+              f"{stats['p95']:>10.3f} {stats['p99']:>10.3f}")
+
+
+def temp_db(name):
+    return os.path.join(tempfile.mkdtemp(), name)
+
+
+def bench_bootstrap(args):
+    cold = []
+    for _ in range(args.cold):
+        db_file = temp_db("bootstrap.db")
+        cold.append(app.initialize_database(db_file)["seconds"] * 1000)
+
+    db_file = temp_db("bootstrap.db")
+    app.initialize_database(db_file)
+
+    def replay_all_migrations():
+        # What every rerun used to do: open a fresh connection, re-issue the
+        # whole schema and seed checks, commit and close
+        conn = sqlite3.connect(db_file)
+        cursor = conn.cursor()
+        for _, _, migration in app.MIGRATIONS:
+            migration(cursor)
+        conn.commit()
+        conn.close()
+
+    rows = [
+        ("cold start (empty database)", summarize(cold)),
+        ("rerun, replaying every migration", summarize(timed(replay_all_migrations, args.repeat))),
+        ("rerun, version check only", summarize(timed(lambda: app.initialize_database(db_file), args.repeat))),
+        ("rerun, cached bootstrap", summarize(timed(lambda: app.bootstrap_database(db_file), args.repeat))),
+    ]
+    print_table("Schema bootstrap", rows)
+    return 0
+
+
+def synthetic_series(size, seed=0):
+    # Five-minute heart rate readings with a slow trend, noise and a few spikes
+    rng = np.random.default_rng(seed)
+    start = np.datetime64("2015-01-01T00:00:00")
+    dates = (start + np.arange(size) * np.timedelta64(5, "m")).astype(str)
+    values = 70 + 8 * np.sin(np.arange(size) / 2000) + rng.normal(0, 3, size)
+    values[rng.integers(0, size, max(1, size // 10000))] = 160
+    return list(zip(dates.tolist(), values.tolist(), [None] * size))
+
+
+def bench_chart(args):
+    rows = []
+    for size in [int(size) for size in args.sizes.split(",")]:
+        series = synthetic_series(size)
+        samples = timed(lambda: app.prepare_chart_data(series, ["Value"], args.budget), args.repeat)
+        points = len(app.prepare_chart_data(series, ["Value"], args.budget))
+        rows.append((f"{size} readings -> {points} points", summarize(samples)))
+    print_table(f"Chart preparation (budget {args.budget} points)", rows)
+    return 0
+
+
+def seed_health_records(db_file, rows, patients=1000, seed=0):
+    rng = np.random.default_rng(seed)
+    start = np.datetime64("2020-01-01T00:00:00")
+    offsets = np.sort(rng.integers(0, 5 * 365 * 24 * 3600, rows)) * np.timedelta64(1, "s")
+    dates = (start + offsets).astype(str).tolist()
+    types = rng.choice(list(app.HEALTH_UNITS), rows).tolist()
+    values = rng.normal(80, 15, rows).round(1).tolist()
+    patient_ids = rng.integers(0, patients, rows).tolist()
+    with app.get_connection(db_file) as conn:
+        conn.executemany(app.INSERT_HEALTH_RECORD_SQL, (
+            (f"REC_{i:08d}", f"PAT_{patient_ids[i]:06d}", dates[i], types[i], str(values[i]), "",
+             values[i], None, app.HEALTH_UNITS[types[i]], None, None)
+            for i in range(rows)))
+        conn.commit()
+
+
+def bench_export(args):
+    app.DB_FILE = temp_db("export.db")
+    app.initialize_database(app.DB_FILE)
+    seed_health_records(app.DB_FILE, args.rows)
+    out_dir = tempfile.mkdtemp()
+    csv_file = os.path.join(out_dir, "health_records.csv")
+    sql, _, _ = app.COLUMNAR_EXPORTS["health_records"]
+
+    def write_csv():
+        with open(csv_file, "wb") as f, app.get_connection() as conn:
+            cursor = conn.cursor()
+            chunks = app.iter_query(cursor, sql)
+            first = next(chunks, [])
+            columns = [column[0] for column in cursor.description]
+            for chunk in app.csv_chunks([first, *chunks], columns):
+                f.write(chunk)
+
+    parquet_runs = []
+
+    def write_parquet():
+        # export_columnar only writes into new or empty directories
+        parquet_runs.append(os.path.join(out_dir, f"parquet-{len(parquet_runs)}"))
+        app.export_columnar(parquet_runs[-1])
+
+    rows = [
+        ("write CSV", summarize(timed(write_csv, args.repeat))),
+        ("write Parquet (partitioned)", summarize(timed(write_parquet, args.repeat))),
+        ("read CSV (pandas, parse dates)", summarize(timed(
+            lambda: pd.read_csv(csv_file, parse_dates=["record_date"]), args.repeat))),
+        ("read Parquet (pandas)", summarize(timed(
+            lambda: pd.read_parquet(os.path.join(parquet_runs[-1], "health_records")), args.repeat))),
+        ("read Parquet, one type and month", summarize(timed(
+            lambda: pd.read_parquet(os.path.join(parquet_runs[-1], "health_records"),
+                                    filters=[("record_type", "=", "Heart Rate"), ("month", "=", "2022-06")]),
+            args.repeat))),
+    ]
+    print_table(f"Bulk export of {args.rows} health records", rows)
+    csv_size = os.path.getsize(csv_file)
+    parquet_size = sum(os.path.getsize(os.path.join(root, name))
+                       for root, _, names in os.walk(os.path.join(parquet_runs[-1], "health_records"))
+                       for name in names)
+    print(f"  CSV {csv_size / 1e6:.1f} MB, Parquet {parquet_size / 1e6:.1f} MB")
+    return 0
+
+
+def bench_login(args):
+    # Single-threaded, so logins/s is the throughput of one core
+    app.DB_FILE = temp_db("login.db")
+    app.initialize_database(app.DB_FILE)
+    hashes = [
+        ("legacy SHA-256", hashlib.sha256(b"secret").hexdigest()),
+        ("pbkdf2_sha256 (default cost)", app.hash_password("secret", app.Pbkdf2Hasher())),
+        (f"{app.PASSWORD_HASHER.algorithm} (configured)", app.hash_password("secret")),
+    ]
+    rows = [(f"verify {name}", summarize(timed(lambda: app.verify_password("secret", encoded), args.repeat)))
+            for name, encoded in hashes]
+
+    with app.get_connection() as conn:
+        conn.executemany("INSERT INTO users VALUES (?, ?, ?, ?, ?, ?)", [
+            (f"USR_BENCH_{i}", f"legacy{i}", hashes[0][1], "admin", "Bench", "bench@example.com")
+            for i in range(args.repeat)])
+        conn.commit()
+    verifier = app.get_password_verifier()
+    legacy_users = iter(range(args.repeat))
+    rows.append(("authenticate, legacy row (rehash)", summarize(timed(
+        lambda: app.authenticate(f"legacy{next(legacy_users)}", "secret"), args.repeat))))
+    rows.append(("authenticate, first login", summarize(timed(
+        lambda: (verifier.clear(), app.authenticate("legacy0", "secret")), args.repeat))))
+    rows.append(("authenticate, repeat login (cached)", summarize(timed(
+        lambda: app.authenticate("legacy0", "secret"), args.repeat))))
+
+    print_table(f"Password verification ({os.cpu_count()} cores)", rows)
+    for name, stats in rows:
+        print(f"  {name:<40} {1000 / stats['mean']:>10.1f} logins/s per core")
+    return 0
+
+
+def bench_booking(args):
+    # The same race manage.py check-booking asserts on, timed
+    results, stored, elapsed = manage.race_bookings(args.bookers, args.attempts, args.slots, args.capacity)
+    print_table(f"Concurrent booking: {args.bookers} bookers x {args.attempts} attempts, "
+                f"{args.slots} slots of capacity {args.capacity}",
+                [("book_appointment", summarize([ms for _, _, ms in results]))])
+    checks, outcomes = manage.booking_problems(results, stored, args.capacity)
+    print(f"  outcomes: {outcomes}; {len(results) / elapsed:.0f} attempts/s")
+    print(f"  stored bookings per slot: {sorted(stored.values())}")
+    failed = [(name, problems) for name, problems in checks if problems]
+    for name, problems in failed:
+        print(f"  FAIL: {name}: {problems}")
+    if failed:
+        return 1
+    print("  ok: no slot exceeded its capacity and every attempt got an answer")
+    return 0
+
+
+# Deterministic synthetic data: the same arguments always produce the same rows
+FIRST_NAMES = ["Ann", "Ben", "Chloe", "David", "Emma", "Farid", "Grace", "Hiro", "Isla", "Jamal",
+               "Kira", "Liam", "Maya", "Noah", "Olga", "Priya", "Quinn", "Rosa", "Sam", "Tariq"]
+LAST_NAMES = ["Lee", "Patel", "Garcia", "Smith", "Nguyen", "Okafor", "Rossi", "Kim", "Muller", "Silva",
+              "Khan", "Brown", "Cohen", "Sato", "Novak", "Diaz", "Jones", "Ali", "Berg", "Moreau"]
+CITIES = ["Riverside", "Hillcrest", "Lakeview", "Oakwood", "Fairview", "Greenfield", "Westport", "Eastville"]
+HOSPITAL_KINDS = ["General Hospital", "Medical Center", "Community Clinic", "Health Network", "Care Center"]
+SYNTHETIC_PASSWORD = "synthetic123"
+SYNTHETIC_START = datetime(2024, 1, 1)
+SYNTHETIC_DAYS = 730
+GENERATE_CHUNK_ROWS = 100000
+
+
+def synthetic_values(rng, types):
+    # Typed value columns for numeric record types, vectorized per chunk
+    n = len(types)
+    numeric = np.empty(n)
+    secondary = np.full(n, np.nan)
+    means = {"Blood Pressure": (120, 12), "Heart Rate": (75, 10), "Blood Sugar": (110, 25),
+             "Weight": (75, 15), "Temperature": (36.8, 0.4), "Exercise": (40, 15)}
+    for record_type, (mean, sd) in means.items():
+        mask = types == record_type
+        numeric[mask] = rng.normal(mean, sd, mask.sum())
+    lows = np.array([app.HEALTH_VALUE_RANGES[t][0] for t in types])
+    highs = np.array([app.HEALTH_VALUE_RANGES[t][1] for t in types])
+    numeric = np.clip(np.round(numeric, 1), lows, highs)
+    integral = np.isin(types, ["Blood Pressure", "Heart Rate", "Blood Sugar", "Exercise"])
+    numeric[integral] = np.round(numeric[integral])
+    bp = types == "Blood Pressure"
+    secondary[bp] = np.clip(np.round(numeric[bp] * 0.65 + rng.normal(0, 5, bp.sum())), *app.DIASTOLIC_RANGE)
+    return numeric, secondary
+
+
+def generate_dataset(db_file, patients, hospitals, records_per_patient, appointments_per_patient, seed=0):
+    rng = np.random.default_rng(seed)
+    app.DB_FILE = db_file
+    app.initialize_database(db_file)
+    # One fixed-salt hash for every synthetic account keeps generation fast and repeatable
+    password_hash = app.hash_password(SYNTHETIC_PASSWORD, salt=b"synthetic-salt!!")
+    counts = {}
+    with app.get_connection() as conn:
+        cursor = conn.cursor()
+
+        def insert(sql, rows, table):
+            cursor.executemany(sql, rows)
+            counts[table] = counts.get(table, 0) + len(rows)
+
+        conn.execute("BEGIN IMMEDIATE")
+        first = rng.choice(FIRST_NAMES, patients)
+        last = rng.choice(LAST_NAMES, patients)
+        genders = rng.choice(["Male", "Female", "Other"], patients)
+        births = (np.datetime64("1940-01-01") + rng.integers(0, 60 * 365, patients)).astype(str)
+        insert("INSERT INTO users VALUES (?, ?, ?, ?, ?, ?)", [
+            (f"USR_PAT_{i:07d}", f"patient{i}", password_hash, "patient", f"{first[i]} {last[i]}",
+             f"patient{i}@example.com") for i in range(patients)], "users")
+        insert("INSERT INTO patients VALUES (?, ?, ?, ?, ?, ?)", [
+            (f"PAT_{i:07d}", f"USR_PAT_{i:07d}", first[i], last[i], births[i], genders[i])
+            for i in range(patients)], "patients")
+        for i in range(hospitals):
+            name = f"{CITIES[i % len(CITIES)]} {HOSPITAL_KINDS[(i // len(CITIES)) % len(HOSPITAL_KINDS)]} {i}"
+            insert("INSERT INTO users VALUES (?, ?, ?, ?, ?, ?)", [
+                (f"USR_HOS_{i:05d}", f"hospital{i}", password_hash, "hospital", name, f"hospital{i}@example.com")],
+                "users")
+            insert("INSERT INTO hospitals VALUES (?, ?, ?, ?, ?)", [
+                (f"HOS_{i:05d}", f"USR_HOS_{i:05d}", name, f"{i} Main St, {CITIES[i % len(CITIES)]}",
+                 f"555-{i:07d}")], "hospitals")
+            app.insert_schedule(cursor, f"HOS_{i:05d}")
+        conn.commit()
+
+        numeric_types = np.array(list(app.HEALTH_UNITS))
+        total_records = patients * records_per_patient
+        for offset in range(0, total_records, GENERATE_CHUNK_ROWS):
+            n = min(GENERATE_CHUNK_ROWS, total_records - offset)
+            patient_ids = rng.integers(0, patients, n)
+            types = rng.choice(numeric_types, n)
+            seconds = rng.integers(0, SYNTHETIC_DAYS * 86400, n)
+            # Inserting in index order keeps B-tree page writes local
+            order = np.lexsort((seconds, patient_ids))
+            patient_ids, types, seconds = patient_ids[order], types[order], seconds[order]
+            dates = (np.datetime64(SYNTHETIC_START) + seconds.astype("timedelta64[s]")).astype(str)
+            numeric, secondary = synthetic_values(rng, types)
+            rows = []
+            for i in range(n):
+                record_type = types[i]
+                value = numeric[i]
+                if record_type == "Blood Pressure":
+                    text, second = f"{value:g}/{secondary[i]:g}", float(secondary[i])
+                elif record_type == "Exercise":
+                    text, second = f"Walking: {value:g} minutes", None
+                else:
+                    text, second = f"{value:g}", None
+                rows.append((f"REC_{offset + i:09d}", f"PAT_{patient_ids[i]:07d}", dates[i], record_type, text, "",
+                             float(value), second, app.HEALTH_UNITS[record_type],
+                             "Walking" if record_type == "Exercise" else None, None))
+            conn.execute("BEGIN IMMEDIATE")
+            insert(app.INSERT_HEALTH_RECORD_SQL, rows, "health_records")
+            conn.commit()
+
+        total_appointments = patients * appointments_per_patient
+        now = np.datetime64(SYNTHETIC_START + timedelta(days=SYNTHETIC_DAYS // 2))
+        for offset in range(0, total_appointments, GENERATE_CHUNK_ROWS):
+            n = min(GENERATE_CHUNK_ROWS, total_appointments - offset)
+            patient_ids = rng.integers(0, patients, n)
+            hospital_ids = rng.integers(0, hospitals, n)
+            # Half-hour slots during opening hours, spread over the whole period
+            days = rng.integers(0, SYNTHETIC_DAYS, n)
+            slots = rng.integers(18, 34, n)
+            dates = (np.datetime64(SYNTHETIC_START) + days.astype("timedelta64[D]")
+                     + (slots * 30).astype("timedelta64[m]")).astype("datetime64[s]")
+            past_status = rng.choice(["Completed", "Completed", "Completed", "Cancelled", "No Show"], n)
+            statuses = np.where(dates < now, past_status, "Scheduled")
+            dates = dates.astype(str)
+            conn.execute("BEGIN IMMEDIATE")
+            insert("INSERT INTO appointments VALUES (?, ?, ?, ?, ?, ?)", [
+                (f"APT_{offset + i:09d}", f"PAT_{patient_ids[i]:07d}", f"HOS_{hospital_ids[i]:05d}", dates[i],
+                 "Routine checkup", statuses[i]) for i in range(n)], "appointments")
+            conn.commit()
+
+        conn.execute("BEGIN IMMEDIATE")
+        counts["health_rollups"] = app.rebuild_rollups(cursor)
+        conn.commit()
+        conn.execute("PRAGMA analysis_limit=1000")
+        conn.execute("ANALYZE")
+    return counts
+
+
+def bench_generate(args):
+    start = time.perf_counter()
+    counts = generate_dataset(args.db, args.patients, args.hospitals, args.records, args.appointments, args.seed)
+    elapsed = time.perf_counter() - start
+    for table, count in counts.items():
+        print(f"  {table:<16} {count:>12,}")
+    print(f"generated {args.db} in {elapsed:.1f} s")
+    return 0
+
+
+def typical_ids(cursor):
+    # The patient and hospital with the median amount of data
+    cursor.execute("""
+        SELECT patient_id FROM health_records GROUP BY patient_id
+        ORDER BY COUNT(*), patient_id LIMIT 1 OFFSET (SELECT COUNT(DISTINCT patient_id) / 2 FROM health_records)
+    """)
+    patient_id = cursor.fetchone()[0]
+    cursor.execute("""
+        SELECT hospital_id FROM appointments GROUP BY hospital_id
+        ORDER BY COUNT(*), hospital_id LIMIT 1 OFFSET (SELECT COUNT(DISTINCT hospital_id) / 2 FROM appointments)
+    """)
+    hospital_id = cursor.fetchone()[0]
+    return patient_id, hospital_id
+
+
+def page_queries(cursor, now):
+    # Every query the pages issue, with parameters for a typical patient and hospital
+    patient_id, hospital_id = typical_ids(cursor)
+    username = cursor.execute("SELECT u.username FROM users u JOIN patients p ON p.user_id = u.id WHERE p.id = ?",
+                              (patient_id,)).fetchone()[0]
+    history_key = ["record_date", "id"]
+    appointment_key = ["a.appointment_date", "a.id"]
+    week = date.fromisoformat(now[:10])
+
+    def fetch(sql, params=()):
+        return lambda: cursor.execute(sql, params).fetchall()
+
+    def page(sql, params, order_by, descending=True, depth=0):
+        # Walks `depth` pages in, then times fetching the next one
+        after = None
+        for _ in range(depth):
+            _, after = app.fetch_page(cursor, sql, params, order_by, 50, after, descending)
+        return lambda: app.fetch_page(cursor, sql, params, order_by, 50, after, descending)[0]
+
+    return [
+        ("login", fetch(app.AUTHENTICATE_SQL, (username,))),
+        ("health: record types", fetch(app.RECORD_TYPES_SQL, (patient_id,))),
+        ("health: history page 1", page(app.HEALTH_HISTORY_PAGE_SQL, (patient_id,), history_key)),
+        ("health: history page 3", page(app.HEALTH_HISTORY_PAGE_SQL, (patient_id,), history_key, depth=2)),
+        ("health: history count", lambda: app.estimate_count(cursor, app.HEALTH_HISTORY_PAGE_SQL, (patient_id,))),
+        ("health: by type page 1", page(app.HEALTH_HISTORY_BY_TYPE_PAGE_SQL, (patient_id, "Heart Rate"), history_key)),
+        ("health: statistics", fetch(app.HEALTH_STATS_SQL, (patient_id, "Heart Rate"))),
+        ("health: series", fetch(app.HEALTH_SERIES_SQL, (patient_id, "Heart Rate"))),
+        ("health: weekly rollups", fetch(app.HEALTH_ROLLUP_SERIES_SQL, (patient_id, "Heart Rate", "week"))),
+        ("patient: appointments", fetch(app.PATIENT_APPOINTMENTS_SQL, (patient_id,))),
+        ("patient: free slots (1 week)", lambda: app.available_slots(cursor, hospital_id, week, 7,
+                                                                     datetime.fromisoformat(now))),
+        ("hospital: upcoming", fetch(app.UPCOMING_APPOINTMENTS_SQL, (hospital_id, now))),
+        ("hospital: statuses", fetch(app.HOSPITAL_STATUSES_SQL, (hospital_id,))),
+        ("hospital: history page 1", page(app.APPOINTMENT_HISTORY_PAGE_SQL, (hospital_id,), appointment_key)),
+        ("hospital: history count", lambda: app.estimate_count(cursor, app.APPOINTMENT_HISTORY_PAGE_SQL,
+                                                               (hospital_id,))),
+        ("hospital: by status page 1", page(app.APPOINTMENT_HISTORY_BY_STATUS_PAGE_SQL, (hospital_id, "Completed"),
+                                            appointment_key)),
+        ("hospital: patients", fetch(app.HOSPITAL_PATIENTS_SQL, (hospital_id,))),
+        ("admin: counters", fetch(app.SYSTEM_COUNTERS_SQL)),
+        ("admin: recent activity", fetch(app.RECENT_ACTIVITY_SQL)),
+        ("admin: users page 1", page(app.USERS_PAGE_SQL, (), ["role", "name", "id"], descending=False)),
+        ("admin: users page 3", page(app.USERS_PAGE_SQL, (), ["role", "name", "id"], descending=False, depth=2)),
+        ("admin: users by role page 1", page(app.USERS_BY_ROLE_PAGE_SQL, ("patient",), ["name", "id"],
+                                             descending=False)),
+        ("admin: users count", lambda: app.estimate_count(cursor, app.USERS_PAGE_SQL, ())),
+    ]
+
+
+def bench_queries(args):
+    report = {"generated_at": datetime.now().isoformat(timespec="seconds"), "sqlite": sqlite3.sqlite_version,
+              "scales": {}}
+    now = (SYNTHETIC_START + timedelta(days=SYNTHETIC_DAYS // 2)).isoformat()
+    for patients in [int(p) for p in args.patients.split(",")]:
+        hospitals = max(3, patients // args.patients_per_hospital)
+        label = f"{patients} patients"
+        db_file = temp_db("queries.db")
+        start = time.perf_counter()
+        counts = generate_dataset(db_file, patients, hospitals, args.records, args.appointments, args.seed)
+        generate_seconds = time.perf_counter() - start
+        rows = []
+        with app.get_connection(db_file) as conn:
+            for name, run in page_queries(conn.cursor(), now):
+                run()  # warm the page cache
+                rows.append((name, summarize(timed(run, args.repeat))))
+        print_table(f"{label}, {hospitals} hospitals, {counts['health_records']:,} health records, "
+                    f"{counts['appointments']:,} appointments (generated in {generate_seconds:.1f} s)", rows)
+        report["scales"][label] = {"counts": counts, "queries": dict(rows)}
+        os.remove(db_file)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"wrote {args.json}")
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(f"p50 change against {args.compare} ({baseline['generated_at']})")
+        for label, scale in report["scales"].items():
+            before = baseline["scales"].get(label, {}).get("queries", {})
+            for name, stats in scale["queries"].items():
+                if name in before:
+                    ratio = stats["p50"] / before[name]["p50"] if before[name]["p50"] else float("inf")
+                    flag = "  REGRESSION" if ratio > args.tolerance else ""
+                    print(f"  {label:<18} {name:<32} {before[name]['p50']:>9.3f} -> {stats['p50']:>9.3f} ms "
+                          f"({ratio:.2f}x){flag}")
+    return 0
+
+
+def bench_pages(args):
+    # Full script reruns through Streamlit's headless test harness, logged in as
+    # each role against a synthetic database, one row per dashboard view
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    from streamlit.testing.v1 import AppTest, local_script_runner
+
+    # AppTest recompiles the script on every rerun, which would dominate both
+    # the timings and the memory peaks; the server compiles it once
+    script_cache = ScriptCache()
+    local_script_runner.ScriptCache = lambda: script_cache
+
+    script = os.path.abspath(app.__file__)
+    workdir = tempfile.mkdtemp()
+    db_file = os.path.join(workdir, app.DB_FILE)
+    os.makedirs(os.path.dirname(db_file))
+    hospitals = max(3, args.patients // args.patients_per_hospital)
+    counts = generate_dataset(db_file, args.patients, hospitals, args.records, args.appointments, args.seed)
+    with app.get_connection(db_file) as conn:
+        cursor = conn.cursor()
+        patient_id, hospital_id = typical_ids(cursor)
+        patient_user = cursor.execute("SELECT u.username FROM users u JOIN patients p ON p.user_id = u.id "
+                                      "WHERE p.id = ?", (patient_id,)).fetchone()[0]
+        hospital_user = cursor.execute("SELECT u.username FROM users u JOIN hospitals h ON h.user_id = u.id "
+                                       "WHERE h.id = ?", (hospital_id,)).fetchone()[0]
+    # The app opens its database relative to the working directory
+    os.chdir(workdir)
+
+    def widget(elements, label):
+        return [element for element in elements if element.label == label][0]
+
+    def measure(at):
+        # The timed reruns warm the view up; the memory peak is what one more
+        # rerun allocates above what is already held when it starts
+        samples = timed(at.run, args.repeat)
+        peaks = []
+        tracemalloc.start()
+        for _ in range(args.memory_runs):
+            held = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            at.run()
+            peaks.append(tracemalloc.get_traced_memory()[1] - held)
+        tracemalloc.stop()
+        if at.exception:
+            raise RuntimeError(at.exception[0].message)
+        return summarize(samples), max(peaks)
+
+    results = []
+    at = AppTest.from_file(script, default_timeout=args.timeout).run()
+    results.append(("login page", *measure(at)))
+    for role, username, password in [("patient", patient_user, SYNTHETIC_PASSWORD),
+                                     ("hospital", hospital_user, SYNTHETIC_PASSWORD),
+                                     ("admin", "admin", "admin123")]:
+        at = AppTest.from_file(script, default_timeout=args.timeout).run()
+        widget(at.text_input, "Username").input(username)
+        widget(at.text_input, "Password").input(password)
+        widget(at.button, "Login").click().run()
+        if not at.session_state["authenticated"]:
+            raise RuntimeError(f"could not log in as {username}")
+        for view in app.DASHBOARD_VIEWS[role]:
+            at.sidebar.radio[0].set_value(view).run()
+            results.append((f"{role}: {view}", *measure(at)))
+
+    print_table(f"Page reruns: {args.patients} patients, {hospitals} hospitals, "
+                f"{counts['health_records']:,} health records, {counts['appointments']:,} appointments",
+                [(name, stats) for name, stats, _ in results])
+    print(f"  {'peak memory allocated by a rerun':<40} {'MiB':>6}")
+    for name, _, peak in results:
+        print(f"  {name:<40} {peak / 2 ** 20:>6.2f}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"generated_at": datetime.now().isoformat(timespec="seconds"), "counts": counts,
+                       "pages": {name: {**stats, "peak_bytes": peak} for name, stats, peak in results}}, f, indent=2)
+        print(f"wrote {args.json}")
+    return 0
+
+
+def bench_trace(args):
+    # Cost of the SQL tracing layer: every page query once per run, on a plain
+    # connection and on pooled connections with tracing off and on
+    db_file = temp_db("trace.db")
+    hospitals = max(3, args.patients // args.patients_per_hospital)
+    generate_dataset(db_file, args.patients, hospitals, args.records, args.appointments, args.seed)
+    now = (SYNTHETIC_START + timedelta(days=SYNTHETIC_DAYS // 2)).isoformat()
+    tracer = app.get_sql_tracer()
+
+    def run_all(conn):
+        queries = page_queries(conn.cursor(), now)
+        return lambda: [run() for _, run in queries]
+
+    rows = []
+    conn = sqlite3.connect(db_file)
+    run = run_all(conn)
+    run()
+    rows.append(("plain sqlite3 connection", summarize(timed(run, args.repeat))))
+    conn.close()
+    for enabled in [False, True]:
+        tracer.enabled = enabled
+        tracer.reset()
+        with app.get_connection(db_file) as conn, tracer.rerun("benchmark") as trace:
+            run = run_all(conn)
+            run()
+            rows.append((f"pooled, tracing {'on' if enabled else 'off'}", summarize(timed(run, args.repeat))))
+    print_table(f"All page queries per run, {args.patients} patients", rows)
+    print(f"traced: {trace['statements']} statements, {trace['queries']} timed queries, "
+          f"{trace['db_seconds'] * 1000:.1f} ms in the database")
+    for entry in tracer.top_statements(5):
+        print(f"  {entry['total_ms']:>9.1f} ms  {entry['calls']:>5} calls  {entry['params']:<16} {entry['sql'][:70]}")
+    os.remove(db_file)
+    return 0
+
+
+def bench_log(args):
+    # What a user action pays to record an event: a buffered log() call against
+    # a synchronous INSERT and commit, plus the background flush throughput
+    app.DB_FILE = temp_db("log.db")
+    app.initialize_database()
+    system_log = app.get_system_log(app.DB_FILE)
+    rows = []
+    with app.get_connection() as conn:
+        def insert():
+            conn.execute(app.INSERT_LOG_SQL, (datetime.now().isoformat(timespec="milliseconds"), "INFO",
+                                              "benchmark", "synchronous insert", None))
+            conn.commit()
+        rows.append(("synchronous INSERT + commit", summarize(timed(insert, args.repeat))))
+    rows.append(("buffered log()", summarize(timed(
+        lambda: system_log.log("INFO", "benchmark", "buffered event"), args.repeat))))
+    print_table("Cost per logged event", rows)
+
+    # Bursts that fit the ring buffer, each drained by the writer thread
+    system_log.flush()
+    written = system_log.stats()["written"]
+    start = time.perf_counter()
+    for burst_start in range(0, args.events, app.LOG_BUFFER_SIZE):
+        burst_end = min(burst_start + app.LOG_BUFFER_SIZE, args.events)
+        for i in range(burst_start, burst_end):
+            system_log.log("INFO", "benchmark", f"event {i}")
+        while system_log.stats()["written"] - written < burst_end:
+            time.sleep(0.001)
+    seconds = time.perf_counter() - start
+    stats = system_log.stats()
+    print(f"{stats['written'] - written:,} of {args.events:,} events written by the background writer in "
+          f"{seconds:.2f} s ({args.events / seconds:,.0f} events/s); {stats['dropped']} dropped")
+    return 0
+
+
+def bench_search(args):
+    # Hospital search latency as the directory grows, without the query cache:
+    # building the MATCH expression (typo correction included) plus the FTS5 query
+    queries = ["riv", "riverside", "lakeview medical", "oak 12", "memorial", "riversdie", "helth netwrk"]
+    for hospitals in [int(h) for h in args.hospitals.split(",")]:
+        db_file = temp_db("search.db")
+        generate_dataset(db_file, args.patients, hospitals, 1, 1, args.seed)
+        with app.get_connection(db_file) as conn:
+            cursor = conn.cursor()
+            start = time.perf_counter()
+            vocabulary = [term for (term,) in cursor.execute(app.HOSPITAL_SEARCH_TERMS_SQL)]
+            vocabulary_ms = (time.perf_counter() - start) * 1000
+
+            def search(text):
+                def run():
+                    match, _ = app.hospital_match_query(app.search_words(text), vocabulary)
+                    return cursor.execute(app.HOSPITAL_SEARCH_SQL, (match, app.HOSPITAL_SEARCH_LIMIT)).fetchall()
+                return run
+
+            rows = [(f'"{text}"', summarize(timed(search(text), args.repeat))) for text in queries]
+            rows.append(("directory, first page", summarize(timed(
+                lambda: cursor.execute(app.HOSPITAL_DIRECTORY_SQL, (app.HOSPITAL_SEARCH_LIMIT,)).fetchall(),
+                args.repeat))))
+        print_table(f"{hospitals:,} hospitals, {len(vocabulary):,} indexed terms "
+                    f"(vocabulary loaded in {vocabulary_ms:.1f} ms)", rows)
+        os.remove(db_file)
+    return 0
+
+
+def synthetic_locations(rng, hospitals):
+    # Most hospitals cluster around random city centres, the rest are scattered
+    # anywhere, including near the poles and the antimeridian
+    centres = np.column_stack([rng.uniform(-60, 70, 200), rng.uniform(-180, 180, 200)])
+    points = centres[rng.integers(0, len(centres), hospitals)] + rng.normal(0, 0.3, (hospitals, 2))
+    scattered = rng.random(hospitals) < 0.2
+    points[scattered] = np.column_stack([np.degrees(np.arcsin(rng.uniform(-1, 1, scattered.sum()))),
+                                         rng.uniform(-180, 180, scattered.sum())])
+    points[:, 0] = np.clip(points[:, 0], -90, 90)
+    points[:, 1] = (points[:, 1] + 180) % 360 - 180
+    return points
+
+
+def bench_nearest(args):
+    # k-nearest and radius queries through the R*Tree against a brute-force
+    # haversine scan over every hospital, checking both give the same answer
+    rng = np.random.default_rng(args.seed)
+    db_file = temp_db("nearest.db")
+    generate_dataset(db_file, args.patients, args.hospitals, 1, 1, args.seed)
+    points = synthetic_locations(rng, args.hospitals)
+    ids = [f"HOS_{i:05d}" for i in range(args.hospitals)]
+    queries = np.vstack([points[rng.integers(0, args.hospitals, args.queries - 4)],
+                         [[89.9, 0.0], [-89.9, 120.0], [10.0, 179.99], [-10.0, -179.99]]])
+    with app.get_connection(db_file) as conn:
+        start = time.perf_counter()
+        conn.execute("BEGIN IMMEDIATE")
+        conn.executemany(app.UPSERT_LOCATION_SQL, [(ids[i], *points[i], "synthetic") for i in range(args.hospitals)])
+        conn.commit()
+        print(f"indexed {args.hospitals:,} hospital locations in {time.perf_counter() - start:.1f} s")
+        cursor = conn.cursor()
+
+        def brute_force(latitude, longitude, radius_km=None):
+            distances = app.haversine_km(latitude, longitude, points[:, 0], points[:, 1])
+            order = np.argsort(distances, kind="stable")
+            if radius_km is not None:
+                order = order[distances[order] <= radius_km]
+            return [ids[i] for i in order[:args.k]]
+
+        mismatches = 0
+        for latitude, longitude in queries:
+            found = [row[0] for row in app.nearest_hospitals(cursor, latitude, longitude, args.k)]
+            within = [row[0] for row in app.nearest_hospitals(cursor, latitude, longitude, args.k, args.radius)]
+            mismatches += found != brute_force(latitude, longitude)
+            mismatches += within != brute_force(latitude, longitude, args.radius)
+
+        def cycle(fn):
+            # Each timing takes the next query point
+            state = {"i": 0}
+            def run():
+                latitude, longitude = queries[state["i"] % len(queries)]
+                state["i"] += 1
+                return fn(latitude, longitude)
+            return run
+
+        rows = [
+            (f"R*Tree {args.k} nearest", summarize(timed(
+                cycle(lambda lat, lon: app.nearest_hospitals(cursor, lat, lon, args.k)), args.repeat))),
+            (f"R*Tree within {args.radius:g} km", summarize(timed(
+                cycle(lambda lat, lon: app.nearest_hospitals(cursor, lat, lon, args.k, args.radius)), args.repeat))),
+            (f"brute-force NumPy {args.k} nearest", summarize(timed(cycle(brute_force), args.repeat))),
+        ]
+    print_table(f"{args.hospitals:,} located hospitals, {len(queries)} query points", rows)
+    print(f"{mismatches} answers differ from the brute-force scan")
+    os.remove(db_file)
+    return 1 if mismatches else 0
+
+
+def location_workload(rng, lookups, places):
+    # Rerun-like traffic: a few popular places typed with varying case and spacing
+    names = [f"{city} {n}" for n in range(places) for city in CITIES][:places] + ["Nowhere Land"]
+    weights = 1 / np.arange(1, len(names) + 1)
+    picks = rng.choice(len(names), lookups, p=weights / weights.sum())
+    variants = [str.lower, str.upper, lambda s: f"  {s} ", lambda s: s.replace(" ", "   ")]
+    return [variants[rng.integers(len(variants))](names[i]) for i in picks]
+
+
+def bench_geocode(args):
+    # TrackMyHealth1's Nominatim lookups against a local stub: latency of cache
+    # misses and hits, the requests that reach the server, persistence across a
+    # restart, TTL expiry and the size bound
+    os.chdir(tempfile.mkdtemp())  # the app opens its databases in the working directory
+    import TrackMyHealth1 as tmh1
+
+    server, seen = manage.stub_nominatim(args.delay_ms / 1000)
+    tmh1.NOMINATIM_URL = f"http://127.0.0.1:{server.server_address[1]}"
+    tmh1.NOMINATIM_RATE = args.rate  # the `nominatim` benchmark covers the limiter
+    workload = location_workload(np.random.default_rng(args.seed), args.lookups, args.places)
+    failures = []
+
+    def run(label):
+        samples = {"miss": [], "hit": []}
+        cache = tmh1.get_geocode_cache()
+
+        def lookup(fn):
+            misses = cache.stats()["misses"]
+            start = time.perf_counter()
+            result = fn()
+            samples["miss" if cache.stats()["misses"] > misses else "hit"].append((time.perf_counter() - start) * 1000)
+            return result
+
+        for text in workload:
+            loc = lookup(lambda: tmh1.geocode_location(text))
+            if loc:
+                lookup(lambda: tmh1.get_hospitals_near_location(loc["lat"], loc["lon"]))
+        return [(f"{label}: cache {kind}", summarize(values)) for kind, values in samples.items() if values]
+
+    rows = run("first run")
+    stats = tmh1.get_geocode_cache().stats()
+    geocodes = [query for query in seen["requests"] if query.get("q") != "hospital"]
+    searches = [(query["lat"], query["lon"]) for query in seen["requests"] if query.get("q") == "hospital"]
+    distinct = len({tmh1.normalize_location(text) for text in workload})
+    print(f"{len(workload)} location lookups, {distinct} distinct places after normalization: "
+          f"{len(seen['requests'])} requests reached the server over {len(seen['connections'])} connection(s); "
+          f"hit rate {stats['hit_rate']:.0%}")
+    # Each distinct place is geocoded once and each distinct point searched once
+    if len(geocodes) != distinct or len(searches) != len(set(searches)):
+        failures.append(f"{len(geocodes)} geocode requests for {distinct} places, "
+                        f"{len(searches)} hospital searches for {len(set(searches))} points")
+
+    # A restart keeps the cache: nothing new reaches the server
+    tmh1.get_geocode_cache.clear()
+    before = len(seen["requests"])
+    rows += run("after restart")
+    if len(seen["requests"]) != before:
+        failures.append(f"{len(seen['requests']) - before} requests after restart, expected none")
+    print_table(f"Lookup latency, stub answering in {args.delay_ms:g} ms", rows)
+
+    # Expired entries are fetched again; the size bound evicts least recently used
+    small = tmh1.GeocodeCache("bounded.db", max_entries=10)
+    small.get_or_fetch("ttl", 0.05, lambda: 1)
+    time.sleep(0.1)
+    small.get_or_fetch("ttl", 60, lambda: 2)
+    for i in range(25):
+        small.get_or_fetch(f"key {i}", 60, lambda: i)
+    small_stats = small.stats()
+    print(f"bounded cache: {small_stats['entries']} entries, {small_stats['evictions']} evicted, "
+          f"{small_stats['expired']} expired")
+    if small_stats["entries"] != 10 or small_stats["expired"] != 1:
+        failures.append(f"bounded cache kept {small_stats['entries']} entries and saw {small_stats['expired']} expiries")
+    server.shutdown()
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+
+def bench_nominatim(args):
+    # TrackMyHealth1's shared Nominatim scheduler under concurrent sessions:
+    # identical queries in flight reach the server once, requests stay within
+    # the token bucket, and a 429 with Retry-After holds the whole queue back
+    os.chdir(tempfile.mkdtemp())
+    import TrackMyHealth1 as tmh1
+
+    server, seen = manage.stub_nominatim(args.delay_ms / 1000)
+    tmh1.NOMINATIM_URL = f"http://127.0.0.1:{server.server_address[1]}"
+    scheduler = tmh1.NominatimScheduler(tmh1.get_http_session(), rate=args.rate, burst=args.burst)
+    failures = []
+
+    def search(text):
+        start = time.perf_counter()
+        scheduler.search({"q": text, "format": "json", "limit": 1}, timeout=None)
+        return (time.perf_counter() - start) * 1000
+
+    # Sessions asking for the same place at once share a single request
+    with ThreadPoolExecutor(args.sessions) as pool:
+        list(pool.map(search, ["same place"] * args.sessions))
+    if len(seen["requests"]) != 1:
+        failures.append(f"{args.sessions} identical concurrent lookups sent {len(seen['requests'])} requests")
+
+    # Mixed traffic from many sessions, with one place rate limited by the server
+    workload = [tmh1.normalize_location(text) for text in
+                location_workload(np.random.default_rng(args.seed), args.lookups, args.places)]
+    workload.insert(len(workload) // 2, "busy street")
+    before = len(seen["requests"])
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.sessions) as pool:
+        latencies = list(pool.map(search, workload))
+    elapsed = time.perf_counter() - start
+    stats = scheduler.stats()
+    times = np.array(seen["times"][before:])
+    print(f"{len(workload)} lookups from {args.sessions} sessions in {elapsed:.1f} s: "
+          f"{len(times)} requests sent ({stats['coalesced']} lookups shared one in flight, "
+          f"{stats['retries']} retried), {len(set(workload))} distinct places")
+    print(f"queue depth peaked at {stats['max_waiting']}; wait for a token p50 {stats['wait_p50']:.2f} s, "
+          f"p95 {stats['wait_p95']:.2f} s, max {stats['wait_max']:.2f} s")
+    print_table(f"Lookup latency at {args.rate:g} req/s, stub answering in {args.delay_ms:g} ms",
+                [("lookup", summarize(latencies))])
+
+    # Every lookup either started a request or joined one; retries add requests
+    if stats["sent"] != len(seen["requests"]) or \
+            len(times) != len(workload) + args.sessions - stats["coalesced"] + stats["retries"] - 1:
+        failures.append(f"{len(times)} requests for {len(workload)} lookups with {stats['coalesced']} shared "
+                        f"and {stats['retries']} retries")
+    # Within any window of t seconds at most burst + rate * t requests arrive
+    # (a few milliseconds of slack for arrival jitter)
+    gaps = times[None, :] - times[:, None]
+    counts = np.arange(len(times))[None, :] - np.arange(len(times))[:, None] + 1
+    over = (counts > args.burst + args.rate * (gaps + 0.005)) & (counts > 0)
+    if over.any():
+        failures.append(f"{int(over.sum())} request windows exceeded {args.rate:g} req/s with burst {args.burst}")
+    # Once the 429 is answered nothing new goes out until Retry-After has passed;
+    # requests that already held a token leave within a few milliseconds
+    busy = [seen["times"][i] for i, query in enumerate(seen["requests"]) if query.get("q") == "busy street"]
+    answered = busy[0] + args.delay_ms / 1000
+    held = [t - answered for t in seen["times"] if answered + 0.02 < t < answered + manage.STUB_RETRY_AFTER - 0.02]
+    resumed = min(t for t in seen["times"] if t > answered + 0.02) - answered
+    print(f"429 for 'busy street' held new requests for {resumed:.2f} s (Retry-After {manage.STUB_RETRY_AFTER} s)")
+    if len(busy) != 2 or held:
+        failures.append(f"'busy street' sent {len(busy)} times, {len(held)} requests inside its Retry-After")
+    if stats["waiting"] or stats["errors"] or stats["rejected"]:
+        failures.append(f"{stats['waiting']} still queued, {stats['errors']} errors, {stats['rejected']} rejected")
+    server.shutdown()
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+
+def bench_dashboard(args):
+    # TrackMyHealth1's dashboard aggregates for users with multi-year daily
+    # histories: SQL day aggregation plus NumPy windows, uncached and cached,
+    # against a pandas version of the same computation, which they must match
+    os.chdir(tempfile.mkdtemp())
+    import TrackMyHealth1 as tmh1
+
+    rng = np.random.default_rng(args.seed)
+    today = np.datetime64(date.today())
+    years = [int(value) for value in args.years.split(",")]
+
+    def history(user_id, days):
+        # Daily entries with gaps, some days saved twice and some fields left blank (0)
+        offsets = np.sort(rng.choice(days, int(days * 0.85), replace=False))
+        offsets = np.concatenate([offsets, rng.choice(offsets, len(offsets) // 10)])
+        n = len(offsets)
+        blank = rng.random((n, 4)) < 0.05
+        values = np.column_stack([70 + rng.normal(0, 2, n), rng.integers(2000, 15000, n),
+                                  rng.integers(55, 100, n), np.round(rng.normal(7, 1, n), 1)])
+        values[blank] = 0
+        day_strings = (today - offsets).astype(str)
+        return [(user_id, day, *row) for day, row in zip(day_strings, values.tolist())]
+
+    for user_id in range(1, args.background_users + 1):
+        tmh1.conn.executemany("INSERT INTO health_data (user_id, date, weight, steps, heart_rate, sleep_hours) "
+                              "VALUES (?, ?, ?, ?, ?, ?)", history(user_id, 365))
+    for offset, count in enumerate(years):
+        tmh1.conn.executemany("INSERT INTO health_data (user_id, date, weight, steps, heart_rate, sleep_hours) "
+                              "VALUES (?, ?, ?, ?, ?, ?)", history(100000 + offset, count * 365))
+    tmh1.conn.commit()
+    plan = " / ".join(row[3] for row in tmh1.conn.execute("EXPLAIN QUERY PLAN " + tmh1.DAILY_HEALTH_SQL, (1,)))
+    print(f"daily aggregation plan: {plan}")
+
+    def with_pandas(user_id, window):
+        frame = pd.read_sql("SELECT date, weight, steps, heart_rate, sleep_hours FROM health_data WHERE user_id = ?",
+                            tmh1.conn, params=(user_id,))
+        frame = frame.replace(0, np.nan)
+        daily = frame.groupby(pd.to_datetime(frame["date"])).agg(
+            {"weight": "mean", "steps": "max", "heart_rate": "mean", "sleep_hours": "mean"})
+        daily = daily.reindex(pd.date_range(daily.index[0], pd.Timestamp(today)))
+        return daily, daily.rolling(window, min_periods=1).mean()
+
+    rows = []
+    failures = []
+    for offset, count in enumerate(years):
+        user_id = 100000 + offset
+        entries = tmh1.conn.execute("SELECT COUNT(*) FROM health_data WHERE user_id = ?", (user_id,)).fetchone()[0]
+        for period, (window, chart_days) in tmh1.DASHBOARD_WINDOWS.items():
+            label = f"{count}y ({entries:,} entries) {period.lower()}"
+            rows.append((f"{label}: sql", summarize(timed(
+                lambda: tmh1.load_daily_health(tmh1.conn, user_id, today), args.repeat))))
+            rows.append((f"{label}: sql + numpy", summarize(timed(
+                lambda: tmh1.health_dashboard(tmh1.conn, user_id, window, chart_days, today), args.repeat))))
+            rows.append((f"{label}: pandas", summarize(timed(lambda: with_pandas(user_id, window), args.repeat))))
+            tmh1.cached_health_dashboard(user_id, period, str(today), 0)
+            rows.append((f"{label}: cached", summarize(timed(
+                lambda: tmh1.cached_health_dashboard(user_id, period, str(today), 0), args.repeat))))
+
+            # Same rolling means, window extremes and least-squares trends as pandas/polyfit
+            chart, summary = tmh1.health_dashboard(tmh1.conn, user_id, window, chart_days, today)
+            daily, rolling = with_pandas(user_id, window)
+            tail = daily.to_numpy()[-window:]
+            trends = []
+            for column in tail.T:
+                present = ~np.isnan(column)
+                trends.append(np.polyfit(np.flatnonzero(present), column[present], 1)[0] * 7
+                              if present.sum() >= 2 else np.nan)
+            checks = {
+                "rolling means": (chart.to_numpy(), rolling.to_numpy()[-chart_days:]),
+                "min": (summary["Min"].to_numpy(), np.nanmin(tail, axis=0)),
+                "max": (summary["Max"].to_numpy(), np.nanmax(tail, axis=0)),
+                "trend": (summary["Trend per Week"].to_numpy(), np.array(trends)),
+            }
+            for name, (ours, expected) in checks.items():
+                if not np.allclose(ours, expected, equal_nan=True):
+                    failures.append(f"{label}: {name} differ from pandas")
+    print_table(f"Dashboard aggregates, {args.background_users} other users with a year each", rows)
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    bootstrap = commands.add_parser("bootstrap", help="startup vs. per-rerun schema bootstrap cost")
+    bootstrap.add_argument("--repeat", type=int, default=200, help="reruns to time")
+    bootstrap.add_argument("--cold", type=int, default=10, help="cold starts to time")
+    bootstrap.set_defaults(func=bench_bootstrap)
+
+    chart = commands.add_parser("chart", help="health history chart preparation and downsampling")
+    chart.add_argument("--sizes", default="1000,10000,100000", help="comma-separated history lengths")
+    chart.add_argument("--budget", type=int, default=app.CHART_POINT_BUDGET, help="chart point budget")
+    chart.add_argument("--repeat", type=int, default=5, help="runs per size")
+    chart.set_defaults(func=bench_chart)
+
+    export = commands.add_parser("export", help="CSV vs. partitioned Parquet bulk export and read-back")
+    export.add_argument("--rows", type=int, default=200000, help="synthetic health records to export")
+    export.add_argument("--repeat", type=int, default=3, help="runs per case")
+    export.set_defaults(func=bench_export)
+
+    login = commands.add_parser("login", help="password verification and login throughput")
+    login.add_argument("--repeat", type=int, default=30, help="logins per case")
+    login.set_defaults(func=bench_login)
+
+    booking = commands.add_parser("booking", help="stress test concurrent slot booking")
+    booking.add_argument("--bookers", type=int, default=32, help="concurrent booking threads")
+    booking.add_argument("--attempts", type=int, default=5, help="booking attempts per thread")
+    booking.add_argument("--slots", type=int, default=4, help="slots being competed for")
+    booking.add_argument("--capacity", type=int, default=2, help="patients per slot")
+    booking.set_defaults(func=bench_booking)
+
+    generate = commands.add_parser("generate", help="write a deterministic synthetic database")
+    generate.add_argument("--db", required=True, help="database file to create or extend")
+    generate.add_argument("--patients", type=int, default=10000)
+    generate.add_argument("--hospitals", type=int, default=100)
+    generate.add_argument("--records", type=int, default=100, help="health records per patient")
+    generate.add_argument("--appointments", type=int, default=5, help="appointments per patient")
+    generate.add_argument("--seed", type=int, default=0)
+    generate.set_defaults(func=bench_generate)
+
+    queries = commands.add_parser("queries", help="time every page query against synthetic data at several scales")
+    queries.add_argument("--patients", default="1000,10000", help="comma-separated patient counts")
+    queries.add_argument("--patients-per-hospital", type=int, default=100)
+    queries.add_argument("--records", type=int, default=100, help="health records per patient")
+    queries.add_argument("--appointments", type=int, default=5, help="appointments per patient")
+    queries.add_argument("--seed", type=int, default=0)
+    queries.add_argument("--repeat", type=int, default=20, help="timings per query")
+    queries.add_argument("--json", help="write the report to this file")
+    queries.add_argument("--compare", help="earlier --json report to compare p50 latencies with")
+    queries.add_argument("--tolerance", type=float, default=1.5, help="p50 ratio flagged as a regression")
+    queries.set_defaults(func=bench_queries)
+
+    pages = commands.add_parser("pages", help="headless full-page rerun latency and memory per role and view")
+    pages.add_argument("--patients", type=int, default=1000)
+    pages.add_argument("--patients-per-hospital", type=int, default=100)
+    pages.add_argument("--records", type=int, default=100, help="health records per patient")
+    pages.add_argument("--appointments", type=int, default=5, help="appointments per patient")
+    pages.add_argument("--seed", type=int, default=0)
+    pages.add_argument("--repeat", type=int, default=20, help="timed reruns per page")
+    pages.add_argument("--memory-runs", type=int, default=3, help="reruns traced for peak memory")
+    pages.add_argument("--timeout", type=float, default=120, help="seconds allowed per rerun")
+    pages.add_argument("--json", help="write the results to this file")
+    pages.set_defaults(func=bench_pages)
+
+    trace = commands.add_parser("trace", help="overhead of SQL tracing on the page queries")
+    trace.add_argument("--patients", type=int, default=1000)
+    trace.add_argument("--patients-per-hospital", type=int, default=100)
+    trace.add_argument("--records", type=int, default=100, help="health records per patient")
+    trace.add_argument("--appointments", type=int, default=5, help="appointments per patient")
+    trace.add_argument("--seed", type=int, default=0)
+    trace.add_argument("--repeat", type=int, default=50, help="runs per case")
+    trace.set_defaults(func=bench_trace)
+
+    log = commands.add_parser("log", help="buffered system log vs. synchronous inserts")
+    log.add_argument("--repeat", type=int, default=500, help="timings per case")
+    log.add_argument("--events", type=int, default=100000, help="events for the throughput run")
+    log.set_defaults(func=bench_log)
+
+    search = commands.add_parser("search", help="full-text hospital search latency by directory size")
+    search.add_argument("--hospitals", default="1000,10000", help="comma-separated hospital counts")
+    search.add_argument("--patients", type=int, default=100)
+    search.add_argument("--seed", type=int, default=0)
+    search.add_argument("--repeat", type=int, default=50, help="timings per query")
+    search.set_defaults(func=bench_search)
+
+    nearest = commands.add_parser("nearest", help="k-nearest and radius hospital queries through the R*Tree")
+    nearest.add_argument("--hospitals", type=int, default=100000)
+    nearest.add_argument("--patients", type=int, default=100)
+    nearest.add_argument("--k", type=int, default=app.NEAREST_LIMIT, help="hospitals per k-nearest query")
+    nearest.add_argument("--radius", type=float, default=25.0, help="km for radius queries")
+    nearest.add_argument("--queries", type=int, default=200, help="query points, checked against brute force")
+    nearest.add_argument("--seed", type=int, default=0)
+    nearest.add_argument("--repeat", type=int, default=200, help="timings per case")
+    nearest.set_defaults(func=bench_nearest)
+
+    geocode = commands.add_parser("geocode", help="TrackMyHealth1 lookup cache against a local Nominatim stub")
+    geocode.add_argument("--lookups", type=int, default=500, help="location lookups per run")
+    geocode.add_argument("--places", type=int, default=40, help="distinct places in the workload")
+    geocode.add_argument("--delay-ms", type=float, default=200, help="stub server response time")
+    geocode.add_argument("--rate", type=float, default=1000, help="requests per second allowed")
+    geocode.add_argument("--seed", type=int, default=0)
+    geocode.set_defaults(func=bench_geocode)
+
+    nominatim = commands.add_parser("nominatim", help="TrackMyHealth1 request coalescing and rate limiting")
+    nominatim.add_argument("--sessions", type=int, default=16, help="concurrent sessions")
+    nominatim.add_argument("--lookups", type=int, default=300, help="lookups across all sessions")
+    nominatim.add_argument("--places", type=int, default=30, help="distinct places in the workload")
+    nominatim.add_argument("--rate", type=float, default=20, help="requests per second allowed")
+    nominatim.add_argument("--burst", type=int, default=1, help="token bucket size")
+    nominatim.add_argument("--delay-ms", type=float, default=100, help="stub response time")
+    nominatim.add_argument("--seed", type=int, default=7)
+    nominatim.set_defaults(func=bench_nominatim)
+
+    dashboard = commands.add_parser("dashboard", help="TrackMyHealth1 dashboard aggregates by history length")
+    dashboard.add_argument("--years", default="1,3,5,10", help="comma-separated years of daily history")
+    dashboard.add_argument("--background-users", type=int, default=200, help="other users sharing the table")
+    dashboard.add_argument("--repeat", type=int, default=30, help="runs per case")
+    dashboard.add_argument("--seed", type=int, default=0)
+    dashboard.set_defaults(func=bench_dashboard)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,595 @@
+"""Maintenance commands for the Track My Health database.
+
+Run from the repository root, e.g.:
+
+    python manage.py migrate
+    python manage.py check-plans
+    python manage.py check-booking
+    python manage.py check-lookups
+    python manage.py rebuild-rollups
+    python manage.py calibrate-kdf --target-ms 100
+    python manage.py import-health --patient PAT_123abc readings.csv
+    python manage.py load-locations gazetteer.csv
+    python manage.py export-parquet --out exports/latest
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import Trackmyhealth as app
+
+# (name, query, sample parameters, tables/aliases that may legitimately be scanned)
+PLAN_CHECKS = [
+    ("authenticate", app.AUTHENTICATE_SQL, ("ann.lee",), ()),
+    ("hospital directory", app.HOSPITAL_DIRECTORY_SQL, (20,), ()),
+    ("hospital search", app.HOSPITAL_SEARCH_SQL, ('"memorial"*', 20), ()),
+    ("hospitals in box", app.HOSPITALS_IN_BOX_SQL, (51.0, 52.0, -1.0, 0.5), ()),
+    ("hospitals by id", app.HOSPITALS_BY_ID_SQL.format(placeholders="?, ?"), ("HOS_x", "HOS_y"), ()),
+    ("hospital choices", app.HOSPITAL_CHOICES_SQL, (), ("hospitals",)),
+    ("record types", app.RECORD_TYPES_SQL, ("PAT_x",), ()),
+    ("health history", app.HEALTH_HISTORY_SQL, ("PAT_x",), ()),
+    ("health history by type", app.HEALTH_HISTORY_BY_TYPE_SQL, ("PAT_x", "Heart Rate"), ()),
+    ("existing readings", app.EXISTING_READINGS_SQL.format(placeholders="?, ?"),
+     ("PAT_x", "2025-01-01T08:00:00", "2025-01-01T09:00:00"), ()),
+    ("health statistics", app.HEALTH_STATS_SQL, ("PAT_x", "Heart Rate"), ()),
+    ("health series", app.HEALTH_SERIES_SQL, ("PAT_x", "Heart Rate"), ()),
+    ("health rollup count", app.HEALTH_ROLLUP_COUNT_SQL, ("PAT_x", "Heart Rate", "day"), ()),
+    ("health rollup series", app.HEALTH_ROLLUP_SERIES_SQL, ("PAT_x", "Heart Rate", "week"), ()),
+    ("patient appointments", app.PATIENT_APPOINTMENTS_SQL, ("PAT_x",), ()),
+    ("upcoming appointments", app.UPCOMING_APPOINTMENTS_SQL, ("HOS_x", "2025-01-01T00:00:00"), ()),
+    ("hospital schedule", app.HOSPITAL_SCHEDULE_SQL, ("HOS_x",), ()),
+    ("slot appointments", app.SLOT_APPOINTMENTS_SQL, ("HOS_x", "2025-01-06", "2025-01-13"), ()),
+    ("slot bookings", app.SLOT_BOOKINGS_SQL, ("HOS_x", "2025-01-06T09:00:00", "2025-01-06T09:30:00"), ()),
+    ("hospital statuses", app.HOSPITAL_STATUSES_SQL, ("HOS_x",), ()),
+    ("appointment history", app.APPOINTMENT_HISTORY_SQL, ("HOS_x",), ()),
+    ("appointment history by status", app.APPOINTMENT_HISTORY_BY_STATUS_SQL, ("HOS_x", "Completed"), ()),
+    ("hospital patients", app.HOSPITAL_PATIENTS_SQL, ("HOS_x",), ()),
+    ("system counters", app.SYSTEM_COUNTERS_SQL, (), ("system_counters",)),
+    ("query cache scope version", app.SCOPE_VERSION_SQL, ("patient:PAT_x",), ()),
+    ("recent activity", app.RECENT_ACTIVITY_SQL, (), ()),
+    ("system logs", app.SYSTEM_LOGS_SQL, ("2025-01-01", "2025-01-08"), ()),
+    ("system logs by level", app.SYSTEM_LOGS_BY_LEVEL_SQL, ("ERROR", "2025-01-01", "2025-01-08"), ()),
+]
+
+# (name, page query, filter parameters, keyset columns, sample key, descending)
+PAGE_CHECKS = [
+    ("health history page", app.HEALTH_HISTORY_PAGE_SQL, ("PAT_x",),
+     ["record_date", "id"], ("2025-01-01T00:00:00", "REC_x"), True),
+    ("health history by type page", app.HEALTH_HISTORY_BY_TYPE_PAGE_SQL, ("PAT_x", "Heart Rate"),
+     ["record_date", "id"], ("2025-01-01T00:00:00", "REC_x"), True),
+    ("appointment history page", app.APPOINTMENT_HISTORY_PAGE_SQL, ("HOS_x",),
+     ["a.appointment_date", "a.id"], ("2025-01-01T00:00:00", "APT_x"), True),
+    ("appointment history by status page", app.APPOINTMENT_HISTORY_BY_STATUS_PAGE_SQL, ("HOS_x", "Completed"),
+     ["a.appointment_date", "a.id"], ("2025-01-01T00:00:00", "APT_x"), True),
+    ("users page", app.USERS_PAGE_SQL, (), ["role", "name", "id"], ("patient", "Ann Lee", "USR_x"), False),
+    ("users by role page", app.USERS_BY_ROLE_PAGE_SQL, ("patient",), ["name", "id"], ("Ann Lee", "USR_x"), False),
+    ("system logs page", app.SYSTEM_LOGS_PAGE_SQL, ("2025-01-01", "2025-01-08"),
+     ["logged_at", "id"], ("2025-01-07T00:00:00.000", 100), True),
+    ("system logs by level page", app.SYSTEM_LOGS_BY_LEVEL_PAGE_SQL, ("ERROR", "2025-01-01", "2025-01-08"),
+     ["logged_at", "id"], ("2025-01-07T00:00:00.000", 100), True),
+]
+for name, sql, params, order_by, key, descending in PAGE_CHECKS:
+    PLAN_CHECKS.append((f"{name} (first)", app.keyset_sql(sql, order_by, descending), (*params, 50), ()))
+    PLAN_CHECKS.append((f"{name} (next)", app.keyset_sql(sql, order_by, descending, after=True),
+                        (*params, *key, 50), ()))
+
+# A plain "SCAN <table>" reads every row; "SCAN <table> USING ... INDEX" walks an
+# index in order and is fine for counts and LIMIT queries. Any temp B-tree (ORDER
+# BY, RIGHT PART OF ORDER BY, GROUP BY, DISTINCT) sorts rows the index should
+# have delivered in order.
+FULL_SCAN = re.compile(r"^SCAN (\w+)$")
+
+
+def plan_problems(conn, sql, params, allowed_scans):
+    problems = []
+    plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+    for detail in plan:
+        match = FULL_SCAN.match(detail)
+        if match and match.group(1) not in allowed_scans:
+            problems.append(detail)
+        elif detail.startswith("USE TEMP B-TREE"):
+            problems.append(detail)
+    return plan, problems
+
+
+def use_database(db_file):
+    # The page helpers read app.DB_FILE at call time
+    app.DB_FILE = db_file
+    app.initialize_database(db_file)
+
+
+def migrate(args):
+    result = app.initialize_database(args.db or app.DB_FILE)
+    if result["applied"]:
+        names = {version: description for version, description, _ in app.MIGRATIONS}
+        for version in result["applied"]:
+            print(f"applied {version}: {names[version]}")
+    else:
+        print("schema is up to date")
+    print(f"schema version {result['version']} ({result['seconds'] * 1000:.1f} ms)")
+    return 0
+
+
+def check_plans(args):
+    if args.db:
+        use_database(args.db)
+    else:
+        use_database(os.path.join(tempfile.mkdtemp(), "plans.db"))
+
+    failures = 0
+    with app.get_connection() as conn:
+        for name, sql, params, allowed_scans in PLAN_CHECKS:
+            plan, problems = plan_problems(conn, sql, params, allowed_scans)
+            status = "FAIL" if problems else "ok"
+            print(f"{status:4}  {name}")
+            if problems or args.verbose:
+                for detail in plan:
+                    print(f"        {detail}")
+            failures += bool(problems)
+
+    print(f"{len(PLAN_CHECKS) - failures}/{len(PLAN_CHECKS)} query plans use indexes")
+    return 1 if failures else 0
+
+
+def race_bookings(bookers, attempts, slot_count, capacity):
+    # Many threads, each with its own pooled connection, race for a handful of
+    # slots in a fresh database; returns (slot, outcome, ms) per attempt, the
+    # stored bookings per slot and the wall time
+    use_database(os.path.join(tempfile.mkdtemp(), "booking.db"))
+    monday = date.today() + timedelta(days=7 - date.today().weekday())
+    schedule = [(monday.weekday(), "09:00", "17:00", 30, capacity)]
+    slots = [start for start, _, _ in app.schedule_slots(schedule, monday, 1)][:slot_count]
+    with app.get_connection() as conn:
+        hospital_id = conn.execute("SELECT id FROM hospitals LIMIT 1").fetchone()[0]
+        app.insert_schedule(conn.cursor(), hospital_id, schedule)
+        conn.commit()
+
+    results = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(bookers)
+
+    def booker(worker):
+        pool = app.get_connection_pool(app.DB_FILE)
+        conn = pool.acquire()
+        try:
+            barrier.wait()
+            for attempt in range(attempts):
+                slot = slots[(worker + attempt) % len(slots)]
+                start = time.perf_counter()
+                try:
+                    booked = app.book_appointment(conn, f"PAT_{worker}", hospital_id, slot, "stress")
+                    outcome = "booked" if booked else "full"
+                except Exception as e:
+                    outcome = type(e).__name__
+                with lock:
+                    results.append((slot, outcome, (time.perf_counter() - start) * 1000))
+        finally:
+            pool.release(conn)
+
+    threads = [threading.Thread(target=booker, args=(worker,)) for worker in range(bookers)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    with app.get_connection() as conn:
+        stored = dict(conn.execute("""
+            SELECT appointment_date, COUNT(*) FROM appointments
+            WHERE hospital_id = ? AND status = 'Scheduled' GROUP BY appointment_date
+        """, (hospital_id,)).fetchall())
+    return results, stored, elapsed
+
+
+def booking_problems(results, stored, capacity):
+    outcomes = {}
+    for _, outcome, _ in results:
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+    return [
+        ("no slot exceeds its capacity",
+         {slot: count for slot, count in stored.items() if count > capacity}),
+        ("every attempt is booked or refused",
+         {outcome: count for outcome, count in outcomes.items() if outcome not in ("booked", "full")}),
+        ("stored bookings match successful attempts",
+         {} if outcomes.get("booked", 0) == sum(stored.values())
+         else {"booked": outcomes.get("booked", 0), "stored": sum(stored.values())}),
+        ("every slot fills up",
+         {slot: stored.get(slot, 0) for slot in {slot for slot, _, _ in results} if stored.get(slot, 0) < capacity}),
+    ], outcomes
+
+
+def check_booking(args):
+    failures = 0
+    for round_ in range(args.rounds):
+        results, stored, _ = race_bookings(args.bookers, args.attempts, args.slots, args.capacity)
+        checks, outcomes = booking_problems(results, stored, args.capacity)
+        for name, problems in checks:
+            status = "FAIL" if problems else "ok"
+            print(f"{status:4}  round {round_ + 1}: {name}")
+            if problems:
+                print(f"        {problems}")
+            failures += bool(problems)
+        if args.verbose:
+            print(f"        outcomes {outcomes}, stored per slot {sorted(stored.values())}")
+
+    # The weekly schedule still offers last week's slots; booking one is refused
+    with app.get_connection() as conn:
+        hospital_id = conn.execute("SELECT hospital_id FROM hospital_schedules LIMIT 1").fetchone()[0]
+        schedule = conn.execute(app.HOSPITAL_SCHEDULE_SQL, (hospital_id,)).fetchall()
+        last_week = date.today() - timedelta(days=(date.today().weekday() - schedule[0][0]) % 7 or 7)
+        past_slot = next(app.schedule_slots(schedule, last_week, 1))[0]
+        try:
+            appt_id = app.book_appointment(conn, "PAT_past", hospital_id, past_slot, "stress")
+            problem = f"booked {appt_id} for {past_slot}"
+        except ValueError:
+            problem = ""
+    print(f"{'FAIL' if problem else 'ok':4}  past slots are refused")
+    if problem:
+        print(f"        {problem}")
+    failures += bool(problem)
+
+    total = args.rounds * len(checks) + 1
+    print(f"{total - failures}/{total} booking checks passed "
+          f"({args.bookers} bookers x {args.attempts} attempts, {args.slots} slots of capacity {args.capacity})")
+    return 1 if failures else 0
+
+
+STUB_RETRY_AFTER = 1  # seconds the stub asks for with its 429
+
+
+def stub_nominatim(delay):
+    # Local stand-in for Nominatim's /search that answers after `delay` seconds
+    # and records every request, its arrival time and the client connections it
+    # sees. The first query for a place starting with "busy" gets a 429; places
+    # starting with "down" always get a 503.
+    seen = {"requests": [], "times": [], "connections": set()}
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, so pooled sessions can reuse connections
+        disable_nagle_algorithm = True  # headers and body go out in separate writes
+
+        def do_GET(self):
+            query = {name: values[0] for name, values in parse_qs(urlparse(self.path).query).items()}
+            seen["times"].append(time.monotonic())
+            seen["requests"].append(query)
+            seen["connections"].add(self.client_address)
+            time.sleep(delay)
+            if query.get("q", "").startswith("busy") and seen["requests"].count(query) == 1:
+                self.send_response(429)
+                self.send_header("Retry-After", str(STUB_RETRY_AFTER))
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            if query.get("q", "").lower().startswith("down"):
+                self.send_response(503)
+                self.send_header("Retry-After", "0")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            if query.get("q") == "hospital":
+                lat, lon = float(query["lat"]), float(query["lon"])
+                body = [{"lat": str(lat + i / 100), "lon": str(lon), "display_name": f"Stub Hospital {i}"}
+                        for i in range(5)]
+            elif query.get("q", "").lower().startswith("nowhere"):
+                body = []
+            else:
+                digest = int(hashlib.sha256(query.get("q", "").lower().encode()).hexdigest()[:8], 16)
+                body = [{"lat": str(digest % 180 - 90), "lon": str(digest % 360 - 180),
+                         "display_name": query.get("q", "").title()}]
+            data = json.dumps(body).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, seen
+
+
+def check_lookups(args):
+    # TrackMyHealth1's Nominatim cache and scheduler against a local stub. The
+    # app opens its databases in the working directory.
+    os.chdir(tempfile.mkdtemp())
+    import TrackMyHealth1 as tmh1
+
+    server, seen = stub_nominatim(args.delay_ms / 1000)
+    tmh1.NOMINATIM_URL = f"http://127.0.0.1:{server.server_address[1]}"
+    tmh1.NOMINATIM_RATE = 1000  # the shared scheduler; the limiter is checked on its own below
+
+    def requests_during(fn):
+        before = len(seen["requests"])
+        result = fn()
+        return result, seen["requests"][before:]
+
+    def place_spellings():
+        places, sent = requests_during(lambda: [tmh1.geocode_location(text) for text in
+                                                ("Riverside 1", "  riverside   1 ", "RIVERSIDE 1")])
+        if len(sent) != 1 or not places[0] or places.count(places[0]) != 3:
+            return f"3 spellings of one place sent {len(sent)} requests and answered {places}"
+
+    def not_found_cached():
+        places, sent = requests_during(lambda: [tmh1.geocode_location("Nowhere Land") for _ in range(2)])
+        if len(sent) != 1 or places != [None, None]:
+            return f"2 lookups of an unknown place sent {len(sent)} requests and answered {places}"
+
+    def errors_not_cached():
+        places, sent = requests_during(lambda: [tmh1.geocode_location("Down Town") for _ in range(2)])
+        expected = 2 * (tmh1.NOMINATIM_RETRIES + 1)
+        if len(sent) != expected or places != [None, None] or tmh1.get_geocode_cache().cached("geocode:down town"):
+            return f"2 lookups of a failing place sent {len(sent)} requests (expected {expected}) and answered {places}"
+
+    def nearby_searches():
+        found, sent = requests_during(lambda: [tmh1.get_hospitals_near_location(51.50001, -0.1),
+                                               tmh1.get_hospitals_near_location(51.50002, -0.1)])
+        if len(sent) != 1 or len(found[0]) != 5 or found[0] != found[1]:
+            return f"2 searches 1 m apart sent {len(sent)} requests and found {[len(f) for f in found]} hospitals"
+
+    def prefetch_cached():
+        key, _ = tmh1.hospital_search_request(52.0, 0.0, 5000)
+
+        def prefetch_then_search():
+            tmh1.prefetch_hospitals_near_location(52.0, 0.0)
+            return [tmh1.get_hospitals_near_location(52.0, 0.0) for _ in range(2)]
+
+        found, sent = requests_during(prefetch_then_search)
+        if len(sent) != 1 or not tmh1.get_geocode_cache().cached(key) or found[0] != found[1]:
+            return f"a prefetch and 2 searches sent {len(sent)} requests"
+
+    def restart_keeps_cache():
+        tmh1.get_geocode_cache.clear()
+        _, sent = requests_during(lambda: (tmh1.geocode_location("riverside 1"), tmh1.geocode_location("nowhere land"),
+                                           tmh1.get_hospitals_near_location(51.5, -0.1)))
+        if sent:
+            return f"{len(sent)} requests after a restart, expected none"
+
+    def ttl_expiry():
+        cache = tmh1.GeocodeCache("ttl.db")
+        first = cache.get_or_fetch("ttl", 0.05, lambda: 1)
+        time.sleep(0.1)
+        second = cache.get_or_fetch("ttl", 60, lambda: 2)
+        if (first, second) != (1, 2) or cache.stats()["expired"] != 1:
+            return f"an entry past its TTL answered {second} with {cache.stats()['expired']} expiries"
+
+    def lru_eviction():
+        touch_seconds, tmh1.GEOCODE_TOUCH_SECONDS = tmh1.GEOCODE_TOUCH_SECONDS, 0
+        try:
+            cache = tmh1.GeocodeCache("bounded.db", max_entries=3)
+            for key in "abc":
+                cache.put(key, 60, key)
+                time.sleep(0.01)
+            cache.get_or_fetch("a", 60, lambda: "refetched")  # a is now more recent than b
+            cache.put("d", 60, "d")
+        finally:
+            tmh1.GEOCODE_TOUCH_SECONDS = touch_seconds
+        kept = [key for key in "abcd" if cache.cached(key)]
+        if kept != ["a", "c", "d"] or cache.stats()["evictions"] != 1:
+            return f"a cache bounded at 3 kept {kept} after {cache.stats()['evictions']} evictions"
+
+    scheduler = tmh1.NominatimScheduler(tmh1.get_http_session(), rate=args.rate, burst=1)
+
+    def search(text):
+        return scheduler.search({"q": text, "format": "json", "limit": 1}, timeout=None)
+
+    def coalescing():
+        answers, sent = requests_during(lambda: list(ThreadPoolExecutor(8).map(search, ["same place"] * 8)))
+        if len(sent) != 1 or answers.count(answers[0]) != 8 or scheduler.stats()["coalesced"] != 7:
+            return f"8 identical lookups in flight sent {len(sent)} requests"
+
+    def rate_limit():
+        before = len(seen["times"])
+        list(ThreadPoolExecutor(8).map(search, [f"paced place {i}" for i in range(8)]))
+        times = sorted(seen["times"][before:])
+        # With a burst of 1, consecutive requests are at least 1 / rate apart
+        # (a few milliseconds of slack for arrival jitter)
+        short = [b - a for a, b in zip(times, times[1:]) if b - a < 1 / args.rate - 0.005]
+        if len(times) != 8 or short:
+            return f"{len(times)} requests, {len(short)} gaps under {1 / args.rate:.3f} s: {short}"
+
+    def retry_after():
+        before = len(seen["times"])
+        busy = scheduler.submit({"q": "busy street", "format": "json", "limit": 1})
+        time.sleep(0.005)
+        others = [scheduler.submit({"q": f"queued place {i}", "format": "json", "limit": 1}) for i in range(3)]
+        answers = [future.result() for future in [busy] + others]
+        sent = list(zip(seen["times"][before:], seen["requests"][before:]))
+        busy_times = [t for t, query in sent if query["q"] == "busy street"]
+        if len(busy_times) != 2 or not all(answers):
+            return f"'busy street' was sent {len(busy_times)} times; answers {answers}"
+        # Once the 429 is answered nothing new goes out until Retry-After has passed
+        answered = busy_times[0] + args.delay_ms / 1000
+        held = [t - answered for t, _ in sent if answered + 0.02 < t < answered + STUB_RETRY_AFTER - 0.02]
+        if held or busy_times[1] < answered + STUB_RETRY_AFTER - 0.02:
+            return f"{len(held)} requests inside Retry-After; the retry left after {busy_times[1] - answered:.2f} s"
+
+    def scheduler_drained():
+        stats = scheduler.stats()
+        if stats["waiting"] or stats["errors"] or stats["rejected"] or stats["retries"] != 1:
+            return (f"{stats['waiting']} still queued, {stats['errors']} errors, {stats['rejected']} rejected, "
+                    f"{stats['retries']} retries")
+
+    checks = [
+        ("place spellings share a cache entry", place_spellings),
+        ("not found is cached", not_found_cached),
+        ("errors are not cached", errors_not_cached),
+        ("nearby hospital searches share a cache entry", nearby_searches),
+        ("prefetched searches are cached", prefetch_cached),
+        ("the cache survives a restart", restart_keeps_cache),
+        ("expired entries are fetched again", ttl_expiry),
+        ("the size bound evicts the least recently used", lru_eviction),
+        ("identical lookups in flight share a request", coalescing),
+        ("requests keep to the rate limit", rate_limit),
+        ("a 429 holds the queue for Retry-After", retry_after),
+        ("the scheduler ends idle", scheduler_drained),
+    ]
+    failures = 0
+    for name, check in checks:
+        problem = check()
+        print(f"{'FAIL' if problem else 'ok':4}  {name}")
+        if problem:
+            print(f"        {problem}")
+        failures += bool(problem)
+    server.shutdown()
+
+    print(f"{len(checks) - failures}/{len(checks)} lookup checks passed")
+    return 1 if failures else 0
+
+
+def rebuild_rollups(args):
+    with app.get_connection(args.db or app.DB_FILE) as conn:
+        start = time.perf_counter()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = app.rebuild_rollups(conn.cursor(), args.patient)
+            # Rollups have no cache triggers; the running app rereads its statistics
+            app.bump_scope_version(conn.cursor(), ("patient", args.patient) if args.patient else None)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    scope = f"patient {args.patient}" if args.patient else "all patients"
+    print(f"rebuilt {rows} rollup rows for {scope} ({time.perf_counter() - start:.1f} s)")
+    return 0
+
+
+# Cost parameters tried by calibrate-kdf, cheapest first
+KDF_COST_LADDERS = {
+    "scrypt": [{"n": 2 ** log_n, "r": 8, "p": 1} for log_n in range(12, 21)],
+    "pbkdf2_sha256": [{"iterations": 50000 * 2 ** step} for step in range(8)],
+}
+
+
+def calibrate_kdf(args):
+    hasher_class = app.PASSWORD_HASHERS[args.algorithm]
+    chosen = None
+    for params in KDF_COST_LADDERS[args.algorithm]:
+        samples = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            hasher_class.derive("calibration", os.urandom(16), **params)
+            samples.append((time.perf_counter() - start) * 1000)
+        median = sorted(samples)[len(samples) // 2]
+        print(f"{median:>8.1f} ms  {params}")
+        if median > args.target_ms and chosen:
+            break
+        chosen = params
+    arguments = ", ".join(f"{key}={value}" for key, value in chosen.items())
+    print(f"slowest parameters within {args.target_ms} ms; set in Trackmyhealth.py:")
+    print(f"PASSWORD_HASHER = {hasher_class.__name__}({arguments})")
+    return 0
+
+
+def import_health(args):
+    with app.get_connection(args.db or app.DB_FILE) as conn, open(args.file, "rb") as f:
+        report = app.import_health_records(conn, args.patient, f, args.chunk_rows)
+    for number, reason in report["rejections"]:
+        print(f"rejected line {number}: {reason}")
+    print(f"read {report['read']} rows: imported {report['imported']}, skipped {report['duplicates']} duplicates, "
+          f"rejected {report['rejected']} ({report['seconds']:.1f} s, {report['rows_per_second']:.0f} rows/s)")
+    return 0
+
+
+def load_locations(args):
+    with app.get_connection(args.db or app.DB_FILE) as conn, open(args.file, "rb") as f:
+        report = app.load_hospital_locations(conn, f)
+    for number, reason in report["rejections"]:
+        print(f"rejected line {number}: {reason}")
+    print(f"read {report['read']} gazetteer rows ({report['rejected']} rejected); located {report['located']} of "
+          f"{report['hospitals']} hospitals ({report['seconds']:.1f} s)")
+    return 0
+
+
+def export_parquet(args):
+    if args.db:
+        app.DB_FILE = args.db
+    start = time.perf_counter()
+    try:
+        written = app.export_columnar(args.out, args.chunk_rows)
+    except FileExistsError as e:
+        print(e)
+        return 1
+    for dataset, path, rows in written:
+        print(f"{rows:>10}  {dataset}  {path}")
+    total = sum(rows for _, _, rows in written)
+    print(f"wrote {total} rows in {len(written)} files to {args.out} ({time.perf_counter() - start:.1f} s)")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    migrate_cmd = commands.add_parser("migrate", help="apply pending schema migrations")
+    migrate_cmd.add_argument("--db", help=f"database file (default: {app.DB_FILE})")
+    migrate_cmd.set_defaults(func=migrate)
+
+    plans = commands.add_parser("check-plans", help="fail if a page query falls back to a full table scan")
+    plans.add_argument("--db", help="database to check (default: a freshly initialized temporary database)")
+    plans.add_argument("-v", "--verbose", action="store_true", help="print every plan")
+    plans.set_defaults(func=check_plans)
+
+    booking = commands.add_parser("check-booking", help="fail if concurrent bookings overfill a slot")
+    booking.add_argument("--bookers", type=int, default=16, help="threads racing for slots")
+    booking.add_argument("--attempts", type=int, default=10, help="booking attempts per thread")
+    booking.add_argument("--slots", type=int, default=4, help="slots competed for")
+    booking.add_argument("--capacity", type=int, default=3, help="patients per slot")
+    booking.add_argument("--rounds", type=int, default=3, help="fresh databases to race on")
+    booking.add_argument("-v", "--verbose", action="store_true", help="print outcome counts")
+    booking.set_defaults(func=check_booking)
+
+    lookups = commands.add_parser("check-lookups", help="fail if TrackMyHealth1's Nominatim cache or pacing misbehaves")
+    lookups.add_argument("--delay-ms", type=float, default=20.0, help="stub server response time")
+    lookups.add_argument("--rate", type=float, default=20.0, help="scheduler requests per second under test")
+    lookups.set_defaults(func=check_lookups)
+
+    rollups = commands.add_parser("rebuild-rollups", help="recompute health rollups from raw records")
+    rollups.add_argument("--db", help=f"database file (default: {app.DB_FILE})")
+    rollups.add_argument("--patient", help="only rebuild this patient id")
+    rollups.set_defaults(func=rebuild_rollups)
+
+    kdf = commands.add_parser("calibrate-kdf", help="pick password hashing cost for a target latency on this host")
+    kdf.add_argument("--algorithm", choices=sorted(app.PASSWORD_HASHERS), default=app.PASSWORD_HASHER.algorithm)
+    kdf.add_argument("--target-ms", type=float, default=100.0, help="target time for one password check")
+    kdf.add_argument("--repeat", type=int, default=5, help="timings per candidate")
+    kdf.set_defaults(func=calibrate_kdf)
+
+    importer = commands.add_parser("import-health", help="bulk import a patient's health readings from CSV/JSON")
+    importer.add_argument("file", help="CSV, JSON array or JSON Lines file")
+    importer.add_argument("--patient", required=True, help="patient id to import for")
+    importer.add_argument("--db", help=f"database file (default: {app.DB_FILE})")
+    importer.add_argument("--chunk-rows", type=int, default=app.IMPORT_CHUNK_ROWS, help="rows per transaction")
+    importer.set_defaults(func=import_health)
+
+    locations = commands.add_parser("load-locations", help="set hospital coordinates from a local gazetteer file")
+    locations.add_argument("file", help="CSV, JSON array or JSON Lines with latitude, longitude and "
+                                        "hospital_id, name or place")
+    locations.add_argument("--db", help=f"database file (default: {app.DB_FILE})")
+    locations.set_defaults(func=load_locations)
+
+    parquet = commands.add_parser("export-parquet", help="export health records and appointments as partitioned Parquet")
+    parquet.add_argument("--out", required=True, help="output directory (must be new or empty)")
+    parquet.add_argument("--db", help=f"database file (default: {app.DB_FILE})")
+    parquet.add_argument("--chunk-rows", type=int, default=app.COLUMNAR_CHUNK_ROWS, help="rows read per batch")
+    parquet.set_defaults(func=export_parquet)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())